@@ -0,0 +1,94 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, List, Optional
+import asyncio
+import contextvars
+import threading
+import logging
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain.agents.agent import RunnableMultiActionAgent
+from langchain_core.runnables import RunnableBranch, RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+# Agent steps, as tagged on their LLM calls ("agent_stage:plan")
+STAGE_PLAN = "plan"      # first step: pick the tools and write their queries
+STAGE_ANSWER = "answer"  # later steps: answer from the tool observations (or call more tools)
+STAGE_TAG_PREFIX = "agent_stage:"
+
+class AgentLoop:
+    """
+    Long-lived asyncio event loop, on its own thread, for agent turns.
+
+    The async AgentExecutor runs all the tool calls of one LLM step
+    concurrently; sync tools each get a thread from the loop's pool. Turns
+    come in on request worker threads. One persistent loop keeps the OpenAI
+    async client's connections on a single loop, and every turn runs in its
+    caller's context so TurnStore values and trace spans carry over.
+    """
+    def __init__(self, max_workers: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-tool")
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, name="agent-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the loop in the calling thread's context and wait for its result"""
+        future: Future = Future()
+
+        def start():
+            # Runs in the caller's context, so the task copies it
+            task = self._loop.create_task(coroutine)
+
+            def done(task: asyncio.Task):
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            task.add_done_callback(done)
+
+        self._loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+        return future.result(timeout)
+
+    def shutdown(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
+
+def create_agent_executor(llm, tools: List, prompt, memory=None, max_iterations: int = 3,
+                          on_tool_step: Optional[Callable[[], None]] = None, answer_llm=None,
+                          **kwargs) -> AgentExecutor:
+    """
+    Tools-calling agent: one LLM step may return several tool calls, which
+    the executor runs (concurrently under ainvoke) before the next step.
+    on_tool_step is called each time a step returns tool calls, before
+    they run.
+
+    With answer_llm, llm only plans the first step and answer_llm takes
+    every step after tool observations, so a fast model can pick tools
+    while a larger one writes the answers. Either way, LLM calls are
+    tagged with their stage.
+    """
+    def staged(model, stage: str):
+        return create_tool_calling_agent(model, tools, prompt).with_config(tags=[STAGE_TAG_PREFIX + stage])
+    
+    agent = RunnableBranch(
+        (lambda inputs: not inputs["intermediate_steps"], staged(llm, STAGE_PLAN)),
+        staged(answer_llm or llm, STAGE_ANSWER)
+    )
+    if on_tool_step is not None:
+        def mark_step(output):
+            if isinstance(output, list) and output:
+                on_tool_step()
+            return output
+        agent = agent | RunnableLambda(mark_step)
+    return AgentExecutor(
+        # Invoked rather than streamed, so the LLM reports token usage
+        agent=RunnableMultiActionAgent(runnable=agent, stream_runnable=False),
+        tools=tools,
+        memory=memory,
+        max_iterations=max_iterations,
+        **kwargs
+    )
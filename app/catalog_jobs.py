@@ -0,0 +1,261 @@
+from typing import Dict, Iterator, List, Optional
+from pydantic import ValidationError
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from app.config import get_settings
+from app.models import Product
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("ndjson", "parquet")
+
+# Errors kept per job for the status endpoint
+MAX_JOB_ERRORS = 20
+
+# Finished jobs kept in memory (older ones are still answered from their state file)
+MAX_JOBS_KEPT = 100
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    """Guess the upload format from its file name or content type"""
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    if name.endswith(".parquet") or content_type in ("application/vnd.apache.parquet", "application/x-parquet"):
+        return "parquet"
+    return None
+
+class IngestJob:
+    """Progress of one bulk upload"""
+    def __init__(self, path: str, file_format: str, size_bytes: int, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.path = path
+        self.format = file_format
+        self.size_bytes = size_bytes
+        self.status = "queued"  # queued, running, completed, failed, cancelled
+        self.total: Optional[int] = None  # known up front for Parquet
+        self.bytes_read = 0
+        self.received = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.image_embeddings = 0
+        self.image_errors = 0
+        self.errors: List[str] = []
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def add_error(self, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_JOB_ERRORS:
+            self.errors.append(message)
+
+    def to_dict(self) -> Dict:
+        processed = self.added + self.updated + self.unchanged
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        if self.status == "completed":
+            progress = 1.0
+        elif self.total:
+            progress = (processed + self.failed) / self.total
+        else:
+            progress = self.bytes_read / self.size_bytes if self.size_bytes else 0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "format": self.format,
+            "progress": round(min(progress, 1.0), 4),
+            "total": self.total,
+            "received": self.received,
+            "processed": processed,
+            "added": self.added,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "failed": self.failed,
+            "image_embeddings": self.image_embeddings,
+            "image_errors": self.image_errors,
+            "items_per_second": round(processed / elapsed, 1) if elapsed else 0,
+            "elapsed": round(elapsed, 2),
+            "errors": self.errors,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+def read_ndjson(job: IngestJob) -> Iterator[Dict]:
+    with open(job.path, "rb") as f:
+        for line_number, line in enumerate(f, 1):
+            job.bytes_read += len(line)
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                job.add_error(f"line {line_number}: invalid JSON ({e})")
+
+def read_parquet(job: IngestJob, batch_size: int) -> Iterator[Dict]:
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(job.path)
+    job.total = parquet_file.metadata.num_rows
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield from record_batch.to_pylist()
+
+class CatalogJobQueue:
+    """
+    Runs bulk catalog uploads one at a time on a background thread.
+
+    Uploads are spooled to disk and read back as a stream, so a job holds
+    one batch of products in memory at a time. Each batch is validated,
+    embedded (text and CLIP, in one call each) and upserted into Chroma.
+    Job state is also written to a small JSON file so any worker process
+    can answer status requests.
+    """
+    def __init__(self):
+        settings = get_settings()
+        self.batch_size = settings.catalog_ingest_batch_size
+        self.state_directory = settings.catalog_jobs_directory
+        self.jobs: Dict[str, IngestJob] = {}
+        self._queue: "queue.Queue[Optional[IngestJob]]" = queue.Queue(maxsize=settings.catalog_max_pending_jobs)
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def submit(self, path: str, file_format: str, size_bytes: int) -> IngestJob:
+        """Queue an upload; raises queue.Full when too many jobs are waiting"""
+        job = IngestJob(path, file_format, size_bytes)
+        self._queue.put_nowait(job)
+        self.jobs[job.id] = job
+        if len(self.jobs) > MAX_JOBS_KEPT:
+            finished = [old.id for old in self.jobs.values() if old.finished_at is not None]
+            for old_id in finished[:len(self.jobs) - MAX_JOBS_KEPT]:
+                del self.jobs[old_id]
+        self._save_state(job)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="catalog-jobs", daemon=True)
+                self._thread.start()
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        # The job may belong to another worker process
+        try:
+            with open(self._state_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_directory, f"{os.path.basename(job_id)}.json")
+
+    def _save_state(self, job: IngestJob):
+        try:
+            os.makedirs(self.state_directory, exist_ok=True)
+            temp_path = self._state_path(job.id) + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump(job.to_dict(), f)
+            os.replace(temp_path, self._state_path(job.id))
+        except OSError as e:
+            logger.warning(f"Could not save state of job {job.id}: {e}")
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._run(job)
+            finally:
+                if os.path.exists(job.path):
+                    os.remove(job.path)
+
+    def _run(self, job: IngestJob):
+        from app import tools
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            store = tools.vector_store
+            if store is None:
+                raise RuntimeError("Vector store is not initialized")
+
+            rows = read_parquet(job, self.batch_size) if job.format == "parquet" else read_ndjson(job)
+            batch: List[Dict] = []
+            # Caches and derived indices are invalidated once, when the job ends, not after every chunk
+            with store.deferred_invalidation():
+                for row in rows:
+                    job.received += 1
+                    try:
+                        batch.append(Product.model_validate(row).model_dump(exclude_none=True))
+                    except ValidationError as e:
+                        job.add_error(f"item {job.received}: {e.errors()[0]['loc']} {e.errors()[0]['msg']}")
+                    if len(batch) >= self.batch_size:
+                        self._write(store, job, batch)
+                        batch = []
+                    if self._stopping:
+                        job.status = "cancelled"
+                        return
+                if batch:
+                    self._write(store, job, batch)
+            job.status = "completed"
+        except Exception as e:
+            logger.error(f"Catalog job {job.id} failed: {e}")
+            job.status = "failed"
+            job.add_error(str(e))
+        finally:
+            job.finished_at = time.time()
+            self._save_state(job)
+            logger.info(f"Catalog job {job.id} {job.status}: {job.to_dict()['processed']} products "
+                        f"at {job.to_dict()['items_per_second']} items/s")
+
+    def _write(self, store, job: IngestJob, batch: List[Dict]):
+        start_time = time.time()
+        try:
+            report = store.upsert_products(batch, source="bulk")
+        except Exception as e:
+            # One bad chunk (e.g. an embedding API error) fails its items, not the whole job
+            for product in batch:
+                job.add_error(f"{product['id']}: {e}")
+            return
+        job.added += report["added"]
+        job.updated += report["updated"]
+        job.unchanged += report["unchanged"]
+        job.image_embeddings += report["image_embeddings"]
+        job.image_errors += report["errors"]
+        metrics.record_stage_time("catalog_ingest_batch", time.time() - start_time)
+        self._save_state(job)
+
+    def shutdown(self):
+        """Stop after the current batch; queued jobs are dropped"""
+        self._stopping = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+async def save_upload(upload, max_bytes: int, chunk_size: int = 1024 * 1024) -> tuple:
+    """Copy an upload to a temporary file in chunks; returns (path, size) or raises ValueError if too large"""
+    suffix = os.path.splitext(upload.filename or "")[1]
+    fd, path = tempfile.mkstemp(prefix="catalog-upload-", suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await upload.read(chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"Upload exceeds {max_bytes} bytes")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, size
+
+# Global job queue
+catalog_jobs = CatalogJobQueue()
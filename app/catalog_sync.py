@@ -0,0 +1,274 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import time
+import logging
+from app.monitoring import metrics
+from app.pipeline import batched, prefetch, ProgressTracker
+
+logger = logging.getLogger(__name__)
+
+# Source of entries written before sync tracked sources. Their origin is unknown,
+# so a sync adopts the ones its catalog still has and never deletes the rest
+LEGACY_SOURCE = "legacy"
+
+# Page size for reading stored hashes back from Chroma
+READ_PAGE_SIZE = 5000
+
+def content_hash(document: str, metadata: Dict, image_fingerprint: str = "") -> str:
+    """Hash of everything that ends up in the store for one product"""
+    payload = json.dumps([document, metadata, image_fingerprint], sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+class CatalogSync:
+    """
+    Incremental sync of a product catalog into the text and image collections.
+
+    Each stored product carries the hash of its content and the catalog source
+    it came from. A sync hashes the incoming catalog, diffs it against the stored
+    hashes and only embeds new or changed products (upserted in batches), then
+    deletes products of the same source that are no longer in the catalog.
+    Entries stored without a source tag are legacy: a sync whose catalog
+    contains them rewrites them under its source, and never deletes them.
+
+    Each batch is written image first and text (which holds the hash) last,
+    so completed batches stay marked done if a run is interrupted. The
+    checkpoint file records the stream position reached, so a rerun over the
+    same catalog can also skip re-reading the finished part.
+    """
+    def __init__(self, text_collection, image_collection, checkpoint_path: str, batch_size: int = 100,
+                 prefetch_batches: int = 2):
+        self.text_collection = text_collection
+        self.image_collection = image_collection
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self.prefetch_batches = prefetch_batches
+
+    def _stored_hashes(self, source: str) -> Tuple[Dict[str, Optional[str]], set]:
+        """
+        Map product id -> stored content hash for one source, including legacy
+        entries (no source tag); returns (hashes, legacy ids)
+        """
+        hashes = {}
+        legacy_ids = set()
+        offset = 0
+        while True:
+            page = self.text_collection.get(limit=READ_PAGE_SIZE, offset=offset, include=["metadatas"])
+            ids = page.get('ids') or []
+            for product_id, metadata in zip(ids, page.get('metadatas') or []):
+                metadata = metadata or {}
+                stored_source = metadata.get('source', LEGACY_SOURCE)
+                if stored_source == LEGACY_SOURCE:
+                    legacy_ids.add(product_id)
+                if stored_source in (source, LEGACY_SOURCE):
+                    hashes[product_id] = metadata.get('content_hash')
+            if len(ids) < READ_PAGE_SIZE:
+                return hashes, legacy_ids
+            offset += READ_PAGE_SIZE
+
+    def _load_checkpoint(self, source: str) -> Optional[Dict]:
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f).get(source)
+        except (OSError, ValueError):
+            return None
+
+    def _save_checkpoint(self, source: str, progress: Optional[Dict]):
+        checkpoints = {}
+        if os.path.exists(self.checkpoint_path):
+            try:
+                with open(self.checkpoint_path) as f:
+                    checkpoints = json.load(f)
+            except (OSError, ValueError):
+                checkpoints = {}
+        if progress is None:
+            checkpoints.pop(source, None)
+        else:
+            checkpoints[source] = progress
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(checkpoints, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def _diff(self, products: List[Dict], source: str, stored: Dict[str, Optional[str]],
+              prepare: Callable[[Dict], Tuple[str, Dict, str]]) -> Tuple[List, set, int, int]:
+        """Split products into pending (new or changed) writes; returns (pending, ids, added, updated)"""
+        pending = []
+        catalog_ids = set()
+        added = updated = 0
+        for product in products:
+            document, metadata, fingerprint = prepare(product)
+            product_hash = content_hash(document, metadata, fingerprint)
+            catalog_ids.add(product['id'])
+            if product['id'] not in stored:
+                added += 1
+            elif stored[product['id']] != product_hash:
+                updated += 1
+            else:
+                continue
+            pending.append((product, document, {**metadata, 'source': source, 'content_hash': product_hash}))
+        return pending, catalog_ids, added, updated
+
+    def resume_position(self, source: str, resume_key: str) -> int:
+        """
+        Where an interrupted sync of the same catalog (same resume_key) stopped,
+        so the caller can start its product stream there; 0 otherwise
+        """
+        checkpoint = self._load_checkpoint(source)
+        if checkpoint and checkpoint.get("resume_key") == resume_key:
+            return int(checkpoint.get("position", 0))
+        return 0
+
+    def sync(self, products: Iterable[Dict], source: str,
+             prepare: Callable[[Dict], Tuple[str, Dict, str]],
+             embed_images: Callable[[List[Dict]], List[Optional[List[float]]]],
+             delete_missing: bool = True, total: Optional[int] = None,
+             catalog_ids: Optional[Iterable[str]] = None,
+             resume_key: Optional[str] = None, start: int = 0) -> Dict:
+        """
+        Bring the stored products of `source` in line with `products`.
+
+        products is consumed as a stream, one batch at a time: diffing and image
+        embedding of the next batch (prepare/embed_images) run on a prefetch
+        thread while the current batch is upserted, with at most
+        prefetch_batches in flight. prepare(product) returns (document,
+        metadata, image_fingerprint) and embed_images(products) returns one
+        image vector (or None) per product, for new or changed products only.
+
+        To resume, pass the stream starting at `start` (see resume_position)
+        and the full catalog_ids, so products before `start` aren't deleted.
+        """
+        start_time = time.time()
+        stored, legacy_ids = self._stored_hashes(source)
+        if start and catalog_ids is None:
+            raise ValueError("Resuming a sync needs catalog_ids to know which products to keep")
+
+        report = {
+            "source": source,
+            "catalog_size": 0,
+            "legacy_kept": 0,
+            "added": 0,
+            "updated": 0,
+            "unchanged": 0,
+            "deleted": 0,
+            "image_embeddings": 0,
+            "errors": 0,
+            "resumed": start > 0,
+        }
+        if start:
+            logger.info(f"Resuming interrupted {source} sync at product {start}")
+
+        def diff_and_embed(batch: List[Dict]):
+            pending, ids, added, updated = self._diff(batch, source, stored, prepare)
+            embeddings = self._embed_batch([product for product, _, _ in pending], embed_images) if pending else []
+            return len(batch), ids, added, updated, pending, embeddings
+
+        progress = ProgressTracker(f"Catalog sync ({source})", total=total, done=start)
+        checkpoint = {"resume_key": resume_key, "position": start, "started_at": start_time}
+        seen_ids = set()
+        stages = prefetch(map(diff_and_embed, batched(products, self.batch_size)), depth=self.prefetch_batches)
+        for size, ids, added, updated, pending, embeddings in stages:
+            seen_ids.update(ids)
+            report["added"] += added
+            report["updated"] += updated
+            report["unchanged"] += len(ids) - added - updated
+            if pending:
+                report["image_embeddings"] += self._write_batch(pending, embeddings, report)
+            checkpoint["position"] += size
+            self._save_checkpoint(source, checkpoint)
+            progress.update(size)
+
+        keep_ids = set(catalog_ids) if catalog_ids is not None else seen_ids
+        removed = [product_id for product_id in stored
+                   if product_id not in keep_ids and product_id not in legacy_ids] if delete_missing else []
+        if removed:
+            self.image_collection.delete(ids=[f"{product_id}_img" for product_id in removed])
+            self.text_collection.delete(ids=removed)
+
+        self._save_checkpoint(source, None)
+        report["catalog_size"] = len(keep_ids)
+        report["deleted"] = len(removed)
+        report["legacy_kept"] = len(legacy_ids - keep_ids)
+        report["delta"] = report["added"] + report["updated"] + len(removed)
+        report["duration"] = round(time.time() - start_time, 3)
+        report["items_per_second"] = round(progress.rate, 1)
+        metrics.record_stage_time("catalog_sync", report["duration"])
+        logger.info(f"Catalog sync ({source}): +{report['added']} ~{report['updated']} -{len(removed)} "
+                    f"={report['unchanged']} in {report['duration']:.2f}s")
+        return report
+
+    def upsert(self, products: List[Dict], source: str,
+               prepare: Callable[[Dict], Tuple[str, Dict, str]],
+               embed_images: Callable[[List[Dict]], List[Optional[List[float]]]]) -> Dict:
+        """
+        Write one chunk of products without a full-catalog diff: only the stored
+        hashes of these ids are read, and unchanged products are skipped
+        """
+        start_time = time.time()
+        ids = [product['id'] for product in products]
+        existing = self.text_collection.get(ids=ids, include=["metadatas"])
+        stored = {
+            product_id: (metadata or {}).get('content_hash')
+            for product_id, metadata in zip(existing.get('ids') or [], existing.get('metadatas') or [])
+        }
+        pending, catalog_ids, added, updated = self._diff(products, source, stored, prepare)
+        report = {"added": added, "updated": updated, "unchanged": len(catalog_ids) - added - updated,
+                  "image_embeddings": 0, "errors": 0}
+        for batch_start in range(0, len(pending), self.batch_size):
+            batch = pending[batch_start:batch_start + self.batch_size]
+            embeddings = self._embed_batch([product for product, _, _ in batch], embed_images)
+            report["image_embeddings"] += self._write_batch(batch, embeddings, report)
+        report["delta"] = added + updated
+        report["duration"] = round(time.time() - start_time, 3)
+        return report
+
+    def _embed_batch(self, products: List[Dict], embed_images: Callable) -> List:
+        """Embed a batch in one call; if that fails, retry one by one so a bad item only fails itself"""
+        try:
+            return embed_images(products)
+        except Exception as e:
+            logger.warning(f"Batch image embedding failed, retrying items individually: {e}")
+        embeddings = []
+        for product in products:
+            try:
+                embeddings.append(embed_images([product])[0])
+            except Exception as e:
+                logger.error(f"Error processing image for {product['id']}: {e}")
+                embeddings.append(e)
+        return embeddings
+
+    def _write_batch(self, batch: List[Tuple[Dict, str, Dict]], embeddings: List, report: Dict) -> int:
+        """Upsert one batch: image vectors first, then text entries (which carry the hashes)"""
+        image_embeddings, image_metadatas, image_ids = [], [], []
+        stale_image_ids = []
+        for (product, document, metadata), embedding in zip(batch, embeddings):
+            if isinstance(embedding, Exception):
+                report["errors"] += 1
+                # Leave the hash unset so the next sync retries this product
+                metadata['content_hash'] = ""
+                continue
+            if embedding is not None:
+                image_embeddings.append(embedding)
+                image_metadatas.append(metadata.copy())
+                image_ids.append(f"{product['id']}_img")
+            else:
+                stale_image_ids.append(f"{product['id']}_img")
+
+        if image_embeddings:
+            self.image_collection.upsert(embeddings=image_embeddings, metadatas=image_metadatas, ids=image_ids)
+        if stale_image_ids:
+            # A changed product that lost its image must not keep the old vector
+            self.image_collection.delete(ids=stale_image_ids)
+
+        self.text_collection.upsert(
+            documents=[document for _, document, _ in batch],
+            metadatas=[metadata for _, _, metadata in batch],
+            ids=[product['id'] for product, _, _ in batch]
+        )
+        return len(image_embeddings)
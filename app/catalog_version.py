@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from typing import Optional
+import os
+import tempfile
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; builds are then only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Written next to a derived index: the catalog version it was built from
+BUILT_VERSION_FILE = "catalog_version"
+BUILD_LOCK_FILE = ".build.lock"
+
+class CatalogVersion:
+    """
+    Catalog version shared by every process using the same Chroma directory.
+
+    The version is the identity (inode and mtime) of a small file that bump()
+    replaces atomically, so reading it is one stat() call and a change made
+    by any pre-forked worker is seen by the others on their next read.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        if not os.path.exists(path):
+            self.bump()
+
+    def current(self) -> int:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self.bump()
+        return hash((stat.st_ino, stat.st_mtime_ns))
+
+    def bump(self) -> int:
+        """Start a new version; returns it"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".catalog_version.")
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{time.time()} {os.getpid()}\n")
+        os.replace(temp_path, self.path)
+        return self.current()
+
+@contextmanager
+def build_lock(path: str):
+    """Exclusive across processes: one worker builds the index at path, the others wait and load it"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, BUILD_LOCK_FILE), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def read_built_version(path: str) -> Optional[int]:
+    """The catalog version the index at path was built from, if recorded"""
+    try:
+        with open(os.path.join(path, BUILT_VERSION_FILE)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def write_built_version(path: str, version: int):
+    temp_path = os.path.join(path, BUILT_VERSION_FILE + f".{os.getpid()}.tmp")
+    with open(temp_path, "w") as f:
+        f.write(str(version))
+    os.replace(temp_path, os.path.join(path, BUILT_VERSION_FILE))
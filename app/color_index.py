@@ -0,0 +1,206 @@
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
+import numpy as np
+import base64
+import re
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lab quantization: 4 lightness x 8 x 8 chroma bins
+L_BINS, AB_BINS = 4, 8
+N_BINS = L_BINS * AB_BINS * AB_BINS
+AB_RANGE = 100.0
+
+# Spread of the bin-to-bin similarity, in Lab units (one bin is 25 wide)
+COLOR_SIGMA = 20.0
+
+# Descriptors are computed on a thumbnail; the dataset images are 60x80 already
+THUMBNAIL_SIZE = (64, 64)
+
+# Rows fetched from Chroma per page while building
+READ_BATCH_SIZE = 5000
+
+# sRGB of the catalog's common baseColour names
+NAMED_COLORS: Dict[str, Tuple[int, int, int]] = {
+    "black": (20, 20, 20), "white": (245, 245, 245), "grey": (128, 128, 128), "gray": (128, 128, 128),
+    "charcoal": (60, 62, 66), "silver": (192, 192, 192), "off white": (240, 234, 220), "cream": (245, 235, 200),
+    "beige": (220, 200, 160), "khaki": (195, 176, 145), "tan": (210, 180, 140), "brown": (120, 75, 40),
+    "coffee brown": (90, 60, 40), "red": (200, 30, 35), "maroon": (120, 20, 35), "burgundy": (128, 0, 32),
+    "pink": (240, 140, 170), "peach": (250, 190, 160), "orange": (240, 120, 30), "rust": (180, 75, 30),
+    "yellow": (245, 210, 40), "mustard": (215, 170, 40), "gold": (212, 175, 55), "olive": (110, 115, 45),
+    "green": (40, 140, 60), "sea green": (46, 139, 87), "lime green": (140, 210, 60), "teal": (0, 128, 128),
+    "turquoise blue": (40, 190, 200), "blue": (40, 80, 190), "navy blue": (25, 35, 80), "navy": (25, 35, 80),
+    "purple": (110, 50, 140), "lavender": (190, 170, 220), "magenta": (200, 40, 140),
+}
+
+COLOR_NAME_PATTERN = re.compile(
+    r"\b(" + "|".join(sorted((re.escape(name) for name in NAMED_COLORS), key=len, reverse=True)) + r")\b",
+    re.IGNORECASE
+)
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """Convert sRGB values (uint8, shape (..., 3)) to CIE Lab under D65"""
+    c = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.array([[0.4124, 0.3576, 0.1805],
+                             [0.2126, 0.7152, 0.0722],
+                             [0.0193, 0.1192, 0.9505]], dtype=np.float32).T
+    xyz /= np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 216 / 24389, np.cbrt(xyz), (24389 / 27 * xyz + 16) / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+def _bin_indices(lab: np.ndarray) -> np.ndarray:
+    l_bin = np.clip((lab[..., 0] / 100.0 * L_BINS).astype(np.int32), 0, L_BINS - 1)
+    ab = np.clip(((lab[..., 1:] + AB_RANGE) / (2 * AB_RANGE) * AB_BINS).astype(np.int32), 0, AB_BINS - 1)
+    return (l_bin * AB_BINS + ab[..., 0]) * AB_BINS + ab[..., 1]
+
+def _bin_centers() -> np.ndarray:
+    l_centers = (np.arange(L_BINS) + 0.5) * 100.0 / L_BINS
+    ab_centers = (np.arange(AB_BINS) + 0.5) * 2 * AB_RANGE / AB_BINS - AB_RANGE
+    grid = np.stack(np.meshgrid(l_centers, ab_centers, ab_centers, indexing="ij"), axis=-1)
+    return grid.reshape(N_BINS, 3).astype(np.float32)
+
+BIN_CENTERS = _bin_centers()
+
+# Gaussian similarity between bins, so near-identical shades in neighboring bins still match
+_distances = np.linalg.norm(BIN_CENTERS[:, None, :] - BIN_CENTERS[None, :, :], axis=-1)
+BIN_SIMILARITY = np.exp(-(_distances ** 2) / (2 * COLOR_SIGMA ** 2)).astype(np.float32)
+del _distances
+
+def color_descriptor(image: Image.Image) -> Tuple[np.ndarray, str]:
+    """
+    Quantized Lab histogram (uint8, N_BINS, summing to ~255) of a product
+    image, and its dominant color as a hex string. The near-white studio
+    background is left out unless it is most of the image (a white product).
+    """
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail(THUMBNAIL_SIZE)
+    pixels = np.asarray(thumbnail, dtype=np.uint8).reshape(-1, 3)
+    lab = rgb_to_lab(pixels)
+
+    background = (lab[:, 0] > 90) & (np.hypot(lab[:, 1], lab[:, 2]) < 8)
+    if background.mean() < 0.9:
+        pixels, lab = pixels[~background], lab[~background]
+
+    bins = _bin_indices(lab)
+    counts = np.bincount(bins, minlength=N_BINS).astype(np.float32)
+    histogram = np.round(counts / counts.sum() * 255).astype(np.uint8)
+
+    dominant = pixels[bins == np.argmax(counts)].mean(axis=0).round().astype(int)
+    return histogram, "#{:02x}{:02x}{:02x}".format(*dominant)
+
+def encode_histogram(histogram: np.ndarray) -> str:
+    """Compact string form of a descriptor, for Chroma metadata"""
+    return base64.b64encode(histogram.astype(np.uint8).tobytes()).decode()
+
+def decode_histogram(encoded: str) -> Optional[np.ndarray]:
+    try:
+        histogram = np.frombuffer(base64.b64decode(encoded), dtype=np.uint8)
+    except (ValueError, TypeError):
+        return None
+    return histogram if len(histogram) == N_BINS else None
+
+def find_color_name(text: str) -> Optional[str]:
+    """The first named color mentioned in text, if any"""
+    match = COLOR_NAME_PATTERN.search(text or "")
+    return match.group(1).lower() if match else None
+
+class ColorIndex:
+    """
+    Per-product color histograms in one uint8 matrix (N_BINS bytes per product).
+
+    Scoring a set of products against a query image or a named color is a
+    row gather and one matrix-vector product, so filtering or reranking a
+    page of search results takes microseconds and no model pass.
+    """
+    def __init__(self, capacity: int = 1024):
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.histograms = np.zeros((capacity, N_BINS), dtype=np.uint8)
+        # sqrt(h^T S h) per product, for normalized histogram similarity
+        self.norms = np.zeros(capacity, dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.positions
+
+    def set(self, product_id: str, histogram: np.ndarray):
+        """Add or replace the descriptor of one product"""
+        values = histogram.astype(np.float32)
+        norm = float(np.sqrt(values @ BIN_SIMILARITY @ values))
+        with self._lock:
+            position = self.positions.get(product_id)
+            is_new = position is None
+            if is_new:
+                position = len(self.ids)
+                if position == len(self.histograms):
+                    self.histograms = np.concatenate([self.histograms, np.zeros_like(self.histograms)])
+                    self.norms = np.concatenate([self.norms, np.zeros_like(self.norms)])
+            self.histograms[position] = histogram
+            self.norms[position] = norm
+            # Publish the id only once its row is written (readers don't take the lock)
+            if is_new:
+                self.ids.append(product_id)
+                self.positions[product_id] = position
+
+    def set_encoded(self, product_id: str, encoded: str):
+        histogram = decode_histogram(encoded)
+        if histogram is not None:
+            self.set(product_id, histogram)
+
+    @classmethod
+    def build(cls, collection) -> "ColorIndex":
+        """Load the descriptors stored in a collection's metadata"""
+        total = collection.count()
+        index = cls(capacity=max(total, 1))
+        for offset in range(0, total, READ_BATCH_SIZE):
+            page = collection.get(limit=READ_BATCH_SIZE, offset=offset, include=["metadatas"])
+            for product_id, metadata in zip(page['ids'], page['metadatas']):
+                encoded = (metadata or {}).get('color_histogram')
+                if encoded:
+                    index.set_encoded(product_id, encoded)
+        logger.info(f"Loaded color descriptors for {len(index)} of {total} products")
+        return index
+
+    def _rows(self, product_ids: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        found = np.array([product_id in self.positions for product_id in product_ids], dtype=bool)
+        rows = np.array([self.positions[product_id] for product_id in product_ids if product_id in self.positions], dtype=np.int64)
+        return found, rows
+
+    def similarity_to_histogram(self, product_ids: List[str], histogram: np.ndarray) -> np.ndarray:
+        """Color similarity (0-1) of each product to a query histogram; NaN for products without a descriptor"""
+        query = histogram.astype(np.float32)
+        weights = BIN_SIMILARITY @ query
+        query_norm = float(np.sqrt(query @ weights)) or 1.0
+        found, rows = self._rows(product_ids)
+        scores = np.full(len(product_ids), np.nan, dtype=np.float32)
+        if len(rows):
+            norms = np.maximum(self.norms[rows], 1e-6)
+            scores[found] = (self.histograms[rows].astype(np.float32) @ weights) / (norms * query_norm)
+        return scores
+
+    @staticmethod
+    def _color_weights(color_name: str) -> np.ndarray:
+        target = rgb_to_lab(np.array(NAMED_COLORS[color_name], dtype=np.uint8))
+        return np.exp(-np.sum((BIN_CENTERS - target) ** 2, axis=1) / (2 * COLOR_SIGMA ** 2)).astype(np.float32)
+
+    def share_of_color(self, product_ids: List[str], color_name: str) -> np.ndarray:
+        """Share (0-1) of each product's pixels close to a named color; NaN for products without a descriptor"""
+        weights = self._color_weights(color_name)
+        found, rows = self._rows(product_ids)
+        scores = np.full(len(product_ids), np.nan, dtype=np.float32)
+        if len(rows):
+            scores[found] = (self.histograms[rows].astype(np.float32) @ weights) / 255.0
+        return scores
+
+    def nearest_to_color(self, color_name: str, n: int = 10) -> List[Tuple[str, float]]:
+        """The n products with the largest share of a named color, across the whole index"""
+        count = len(self.ids)
+        scores = (self.histograms[:count].astype(np.float32) @ self._color_weights(color_name)) / 255.0
+        top = np.argsort(-scores)[:n]
+        return [(self.ids[i], float(scores[i])) for i in top]
@@ -12,7 +12,12 @@ class Settings(BaseSettings):
     # API Settings
     api_host: str = "0.0.0.0"
     api_port: int = 8000
-    
+
+    # Worker processes (>1 pre-forks from a master that loads models and indices once)
+    workers: int = 1
+    prefork_preload: bool = True
+    image_snapshot_path: str = "./chroma_db/image_snapshot"
+
     # CORS Settings
     cors_origins: list = ["http://localhost:3000", "http://localhost:8080"]
     
@@ -20,6 +25,13 @@ class Settings(BaseSettings):
     max_upload_size: int = 10 * 1024 * 1024  # 10MB
     allowed_image_types: list = ["image/jpeg", "image/png", "image/jpg"]
     
+    # Rate Limiting
+    rate_limit_requests: int = 100
+    rate_limit_window_seconds: int = 60
+    rate_limit_routes: dict = {}  # path prefix -> [max_requests, window_seconds]
+    rate_limit_backend: str = "memory"  # memory, redis (shared across workers)
+    rate_limit_redis_url: str = "redis://localhost:6379/0"
+    
     # WebSocket Settings
     ws_heartbeat_interval: int = 30  # seconds
 
@@ -31,10 +43,109 @@ class Settings(BaseSettings):
     llm_model: str = "gpt-4"
     max_tokens: int = 2000
     temperature: float = 0.7
+    openai_base_url: Optional[str] = None  # any OpenAI-compatible endpoint, e.g. a local server
+    
+    # Model tiering: a fast model picks the tools and writes their queries, llm_model writes the answers
+    llm_tool_model: str = ""  # empty: llm_model for every step
+    llm_tool_base_url: Optional[str] = None  # endpoint for llm_tool_model; empty: openai_base_url
+    llm_intro_model: str = ""  # direct-return intro; empty: the tool model
+    
+    # Agent: tool calls from one LLM step run concurrently (needs a model with parallel tool calls)
+    agent_parallel_tools: bool = True
+    agent_tool_workers: int = 8
+    agent_max_iterations: int = 3
+    
+    # Speculative retrieval: search the raw message/image while the LLM plans, reuse if the tool query is close
+    speculative_retrieval_enabled: bool = False
+    speculative_similarity: float = 0.9  # CLIP text similarity between tool query and message
+    speculative_workers: int = 4
+    
+    # Direct return: a single search tool call ends the turn with the templated results, skipping the second LLM call
+    direct_return_enabled: bool = False
+    direct_return_intro: bool = False  # stream a short LLM intro after the results (WebSocket only)
+    direct_return_intro_max_tokens: int = 60
+    
+    # Prompt token budgets
+    history_token_budget: int = 1000
+    session_memory_max_sessions: int = 1000  # conversation memories kept, least recently used dropped
+    tool_observation_token_budget: int = 400
     
     # Vector Database
     chroma_persist_directory: str = "./chroma_db"
-    
+
+    # Catalog sync (incremental ingest of the dataset sample into the vector store)
+    catalog_size: int = 500  # 0 = the whole dataset
+    catalog_seed: int = 42
+    catalog_sync_on_startup: bool = True
+    catalog_sync_batch_size: int = 100
+    catalog_sync_prefetch_batches: int = 2  # batches embedded ahead of the upsert
+    catalog_sync_checkpoint_path: str = "./chroma_db/catalog_sync.json"
+
+    # Bulk catalog uploads (POST /catalog/products:bulk)
+    catalog_ingest_batch_size: int = 256
+    catalog_upload_max_bytes: int = 2 * 1024 * 1024 * 1024  # 2GB
+    catalog_max_pending_jobs: int = 10
+    catalog_jobs_directory: str = "./chroma_db/jobs"
+
+    # Precomputed "similar products" (GET /products/{id}/similar, build_neighbors.py)
+    neighbors_path: str = "./chroma_db/neighbors"
+    neighbors_k: int = 20
+    neighbors_chunk_size: int = 1024  # rows per similarity block while building
+    neighbors_build_on_startup: bool = True  # when missing or the startup sync changed the catalog
+
+    # Inference process pool for CLIP image embeddings and JPEG encoding (0 = in-process)
+    inference_pool_size: int = 0
+    inference_pool_queue_depth: int = 0  # shared-memory slots; 0 = 4 per worker
+    inference_pool_torch_threads: int = 1
+
+    # Zero-shot category routing of image search to per-category partitions
+    image_routing_enabled: bool = True
+    image_routing_confidence: float = 0.6  # below this, search the whole image index
+    image_partitions_path: str = "./chroma_db/image_partitions"
+
+    # Quantized vector storage: compressed codes are scanned, the top candidates rescored in float32
+    image_index_mode: str = "float32"  # float32, float16, int8, pq (in-process image index)
+    text_index_mode: str = "chroma"  # chroma (HNSW), float16, int8 (in-process text index)
+    text_index_path: str = "./chroma_db/text_index"
+    quantization_rescore_candidates: int = 100
+    pq_subspaces: int = 64  # bytes per PQ-coded image vector
+    image_cache_dtype: str = "float32"  # float32, float16 (image_cache.json)
+
+    # Color reranking of image search (dominant-color descriptors computed at ingest)
+    color_rerank_weight: float = 0.5  # blend of color score vs. CLIP similarity
+    color_min_share: float = 0.15  # share of pixels a named color must cover to pass the filter
+
+    # Reranking
+    rerank_enabled: bool = False
+    rerank_mode: str = "clip"  # clip, cross_encoder
+    rerank_cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_candidates: int = 50
+    rerank_latency_budget_ms: float = 150.0
+    rerank_clip_weight: float = 0.7  # blend of CLIP score vs. vector score
+
+    # Intent router (fast path that bypasses the LLM agent)
+    intent_router_enabled: bool = True
+    intent_router_confidence: float = 0.85
+    intent_router_margin: float = 0.03
+
+    # Semantic response cache (first turns of a session only)
+    response_cache_enabled: bool = False
+    response_cache_max_entries: int = 1000
+    response_cache_ttl_seconds: int = 600
+    response_cache_similarity: float = 0.93
+
+    # Vector search result cache (ranked, hydrated results; dropped on catalog changes)
+    search_cache_enabled: bool = True
+    search_cache_max_entries: int = 2000
+    search_cache_max_mb: int = 64
+
+    # Coalesce concurrent identical embeddings and searches into one computation
+    single_flight_enabled: bool = True
+
+    # Tracing
+    tracing_exporter: str = "none"  # none, console, otlp_file
+    tracing_file_path: str = "traces.jsonl"
+
     # API Gateway URL (for callbacks)
     api_gateway_url: str = "http://localhost:8000"
 
@@ -1,16 +1,18 @@
-from datasets import load_dataset
 import numpy as np
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 import logging
 from PIL import Image
 import io
 import base64
+from app.tracing import traced
+from app.inference_pool import get_inference_pool, PIXEL_SLOT_BYTES
 
 logger = logging.getLogger(__name__)
 
 class FashionDatasetLoader:
     def __init__(self):
         print("Loading fashion dataset from HuggingFace...")
+        from datasets import load_dataset
         self.dataset = load_dataset("ashraq/fashion-product-images-small", split="train")
         print(f"Loaded {len(self.dataset)} products")
         
@@ -18,45 +20,57 @@ class FashionDatasetLoader:
         self._create_indices()
         
     def _create_indices(self):
-        """Create indices for efficient searching"""
-        self.products_by_id = {}
-        self.products_by_category = {}
-        self.products_by_gender = {}
-        self.products_by_color = {}
-        self.all_products = []
-        
-        for idx, item in enumerate(self.dataset):
+        """
+        Create indices for efficient searching. They hold dataset row numbers
+        (and the lowercased text search_products scans), not products: rows are
+        read without the image column, so no image is decoded here, and products
+        are formatted from the Arrow-backed dataset when a lookup returns them.
+        """
+        # The dataset minus its image column; iterating it decodes no images
+        self.rows = self.dataset.remove_columns([column for column in self.dataset.column_names if column == "image"])
+        self.row_by_id: Dict[str, int] = {}
+        self.rows_by_category: Dict[str, List[int]] = {}
+        self.rows_by_gender: Dict[str, List[int]] = {}
+        self.rows_by_color: Dict[str, List[int]] = {}
+        self.prices = np.zeros(len(self.rows))
+        self.taxonomy = set()
+        self.search_texts: List[str] = []
+        
+        for idx, item in enumerate(self.rows):
             product = self._format_product(item, idx)
-            
-            # Index by ID
-            self.products_by_id[product['id']] = product
-            self.all_products.append(product)
-            
-            # Index by category
-            category = product['category']
-            if category not in self.products_by_category:
-                self.products_by_category[category] = []
-            self.products_by_category[category].append(product)
-            
-            # Index by gender
-            gender = product.get('gender', 'Unisex')
-            if gender not in self.products_by_gender:
-                self.products_by_gender[gender] = []
-            self.products_by_gender[gender].append(product)
-            
-            # Index by color
-            color = product.get('color', 'Unknown')
-            if color not in self.products_by_color:
-                self.products_by_color[color] = []
-            self.products_by_color[color].append(product)
+            self.row_by_id[product['id']] = idx
+            self.search_texts.append(self._searchable_text(product))
+            self.prices[idx] = product['price']
+            self.taxonomy.add((product['category'], product['sub_category'], product['article_type']))
+            self.rows_by_category.setdefault(product['category'], []).append(idx)
+            self.rows_by_gender.setdefault(product.get('gender', 'Unisex'), []).append(idx)
+            self.rows_by_color.setdefault(product.get('color', 'Unknown'), []).append(idx)
+    
+    @staticmethod
+    def _searchable_text(product: Dict) -> str:
+        # Search in name, description, category, brand, color
+        return f"{product['name']} {product['description']} {product['category']} {product['brand']} {product['color']}".lower()
+    
+    def _product(self, idx: int) -> Dict:
+        """The formatted product for one dataset row, image included"""
+        idx = int(idx)
+        return self._format_product(self.dataset[idx], idx)
     
     def _format_product(self, item: Dict, idx: int) -> Dict:
         """Format HuggingFace dataset item to our product format"""
+        # Rows without an id use their row number (as catalog_product_ids does)
+        item_id = item.get('id')
+        item_id = idx if item_id is None else item_id
+        
+        # Seed by product id so generated fields are the same on every load
+        # (the catalog sync compares content hashes across runs)
+        rng = np.random.default_rng(int(item_id))
+        
         # Generate a realistic price based on category
-        price = self._generate_price(item.get('masterCategory', 'Other'))
+        price = self._generate_price(item.get('masterCategory', 'Other'), rng)
         
         return {
-            'id': f"prod_{item.get('id', idx)}",
+            'id': f"prod_{item_id}",
             'name': item.get('productDisplayName', 'Fashion Product'),
             'description': self._generate_description(item),
             'price': price,
@@ -70,7 +84,7 @@ class FashionDatasetLoader:
             'brand': item.get('brandName', 'Generic'),
             'year': item.get('year', 2020),
             'image': item.get('image'),  # PIL Image object
-            'in_stock': np.random.choice([True, False], p=[0.9, 0.1]),
+            'in_stock': bool(rng.random() < 0.9),
             'features': [
                 item.get('articleType', ''),
                 item.get('baseColour', ''),
@@ -80,7 +94,7 @@ class FashionDatasetLoader:
             ]
         }
     
-    def _generate_price(self, category: str) -> float:
+    def _generate_price(self, category: str, rng: np.random.Generator) -> float:
         """Generate realistic price based on category"""
         price_ranges = {
             'Apparel': (15, 150),
@@ -96,7 +110,7 @@ class FashionDatasetLoader:
         if min_price == max_price:
             return 0.0
         
-        price = np.random.uniform(min_price, max_price)
+        price = rng.uniform(min_price, max_price)
         return round(price, 2)
     
     def _generate_description(self, item: Dict) -> str:
@@ -119,57 +133,87 @@ class FashionDatasetLoader:
     
     def get_product_by_id(self, product_id: str) -> Optional[Dict]:
         """Get a single product by ID"""
-        return self.products_by_id.get(product_id)
+        idx = self.row_by_id.get(product_id)
+        return self._product(idx) if idx is not None else None
     
     def search_products(self, query: str, limit: int = 10) -> List[Dict]:
         """Simple text search across products"""
         query_lower = query.lower()
-        results = []
+        matches = []
         
-        for product in self.all_products:
-            # Search in name, description, category, brand, color
-            searchable_text = f"{product['name']} {product['description']} {product['category']} {product['brand']} {product['color']}".lower()
-            
+        # Scan the prebuilt text; only the matches are loaded with their images
+        for idx, searchable_text in enumerate(self.search_texts):
             if query_lower in searchable_text:
-                results.append(product)
-                if len(results) >= limit:
+                matches.append(idx)
+                if len(matches) >= limit:
                     break
         
-        return results
+        return [self._product(idx) for idx in matches]
     
     def get_products_by_category(self, category: str, limit: int = 10) -> List[Dict]:
         """Get products by category"""
-        products = self.products_by_category.get(category, [])
-        return products[:limit]
+        rows = self.rows_by_category.get(category, [])
+        return [self._product(idx) for idx in rows[:limit]]
     
     def get_products_by_filters(self, filters: Dict, limit: int = 10) -> List[Dict]:
         """Get products by multiple filters"""
-        results = self.all_products
+        rows = np.arange(len(self.rows))
         
         if 'category' in filters:
-            results = [p for p in results if p['category'] == filters['category']]
+            rows = np.intersect1d(rows, np.asarray(self.rows_by_category.get(filters['category'], []), dtype=int))
         
         if 'gender' in filters:
-            results = [p for p in results if p['gender'] == filters['gender']]
+            rows = np.intersect1d(rows, np.asarray(self.rows_by_gender.get(filters['gender'], []), dtype=int))
         
         if 'color' in filters:
-            results = [p for p in results if p['color'] == filters['color']]
+            rows = np.intersect1d(rows, np.asarray(self.rows_by_color.get(filters['color'], []), dtype=int))
         
         if 'min_price' in filters:
-            results = [p for p in results if p['price'] >= filters['min_price']]
+            rows = rows[self.prices[rows] >= filters['min_price']]
         
         if 'max_price' in filters:
-            results = [p for p in results if p['price'] <= filters['max_price']]
+            rows = rows[self.prices[rows] <= filters['max_price']]
         
-        return results[:limit]
+        return [self._product(idx) for idx in rows[:limit]]
+    
+    def category_taxonomy(self) -> List[Tuple[str, str, str]]:
+        """Distinct (category, sub_category, article_type) combinations in the dataset"""
+        return sorted(label for label in self.taxonomy if all(label))
+    
+    def catalog_indices(self, n: int, seed: int = 42) -> List[int]:
+        """Dataset row indices of a fixed sample of n products (the same one on every load for a given seed)"""
+        if n <= 0 or n >= len(self.dataset):
+            return list(range(len(self.dataset)))
+        return sorted(int(i) for i in np.random.default_rng(seed).choice(len(self.dataset), n, replace=False))
+    
+    def catalog_product_ids(self, indices: List[int]) -> List[str]:
+        """Product ids for dataset rows, read from the id column only (no image decoding)"""
+        ids = self.dataset.select(indices)['id']
+        return [f"prod_{item_id if item_id is not None else idx}" for item_id, idx in zip(ids, indices)]
+    
+    def iter_products(self, indices: List[int], chunk_size: int = 256) -> Iterator[Dict]:
+        """
+        Stream formatted products for dataset rows straight from the Arrow-backed
+        dataset, chunk by chunk, so only one chunk of rows is decoded at a time
+        """
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            for idx, item in zip(chunk, self.dataset.select(chunk)):
+                yield self._format_product(item, idx)
     
     def get_random_products(self, n: int = 10) -> List[Dict]:
         """Get random products"""
-        indices = np.random.choice(len(self.all_products), min(n, len(self.all_products)), replace=False)
-        return [self.all_products[i] for i in indices]
+        indices = np.random.choice(len(self.dataset), min(n, len(self.dataset)), replace=False)
+        return [self._product(idx) for idx in indices]
     
+    @traced("image.encode_base64")
     def image_to_base64(self, image: Image.Image) -> str:
         """Convert PIL Image to base64"""
+        # Encode in the inference pool when it's running and the pixels fit a slot
+        pool = get_inference_pool()
+        if pool is not None and image.mode in ("RGB", "L"):
+            if len(image.getbands()) * image.width * image.height <= PIXEL_SLOT_BYTES:
+                return base64.b64encode(pool.encode_jpeg(image)).decode()
         buffered = io.BytesIO()
         image.save(buffered, format="JPEG")
         return base64.b64encode(buffered.getvalue()).decode()
@@ -179,4 +223,14 @@ class FashionDatasetLoader:
         product_copy = product.copy()
         if product.get('image'):
             product_copy['image_base64'] = self.image_to_base64(product['image'])
-        return product_copy
\ No newline at end of file
+        return product_copy
+
+# Shared loader instance; loaded once per process (or once in the pre-fork master)
+_dataset_loader: Optional[FashionDatasetLoader] = None
+
+def get_dataset_loader() -> FashionDatasetLoader:
+    """Get the shared dataset loader, loading the dataset on first use"""
+    global _dataset_loader
+    if _dataset_loader is None:
+        _dataset_loader = FashionDatasetLoader()
+    return _dataset_loader
\ No newline at end of file
@@ -1,27 +1,65 @@
+import base64
 import hashlib
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
+import numpy as np
 import json
 import os
+import tempfile
+import threading
 
 class ImageEmbeddingCache:
-    def __init__(self, cache_file: str = "image_cache.json"):
+    """
+    Image embeddings keyed by image hash, persisted to a JSON file.
+
+    With dtype="float16" embeddings are held as float16 arrays and written as
+    base64 strings (about 1KB per 512-d vector instead of ~10KB of JSON
+    floats). Files written in either format are read back in both.
+    
+    Safe to share between request threads: updates and saves hold a lock,
+    and the file is replaced atomically, so readers never see a torn file.
+    """
+    def __init__(self, cache_file: str = "image_cache.json", dtype: str = "float32"):
         self.cache_file = cache_file
-        self.cache: Dict[str, List[float]] = {}
+        self.dtype = dtype
+        self.cache: Dict[str, Union[List[float], np.ndarray]] = {}
+        self.lock = threading.Lock()
         self.load_cache()
     
+    def _to_memory(self, value):
+        if isinstance(value, str):
+            value = np.frombuffer(base64.b64decode(value), dtype=np.float16)
+        if self.dtype == "float16":
+            return np.asarray(value, dtype=np.float16)
+        return value.astype(np.float32).tolist() if isinstance(value, np.ndarray) else value
+    
     def load_cache(self):
         """Load cache from file"""
         if os.path.exists(self.cache_file):
             try:
                 with open(self.cache_file, 'r') as f:
-                    self.cache = json.load(f)
+                    self.cache = {key: self._to_memory(value) for key, value in json.load(f).items()}
             except:
                 self.cache = {}
     
     def save_cache(self):
         """Save cache to file"""
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f)
+        with self.lock:
+            self._save()
+    
+    def _save(self):
+        # Called with the lock held: write a temp file next to the cache, then swap it in
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".image_cache.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    key: base64.b64encode(value.tobytes()).decode() if isinstance(value, np.ndarray) else value
+                    for key, value in self.cache.items()
+                }, f)
+            os.replace(temp_path, self.cache_file)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
     
     def get_image_hash(self, base64_image: str) -> str:
         """Generate hash for image"""
@@ -30,10 +68,15 @@ class ImageEmbeddingCache:
     def get_embedding(self, base64_image: str) -> Optional[List[float]]:
         """Get cached embedding if exists"""
         image_hash = self.get_image_hash(base64_image)
-        return self.cache.get(image_hash)
+        embedding = self.cache.get(image_hash)
+        if isinstance(embedding, np.ndarray):
+            return embedding.astype(np.float32).tolist()
+        return embedding
     
     def set_embedding(self, base64_image: str, embedding: List[float]):
         """Cache an embedding"""
         image_hash = self.get_image_hash(base64_image)
-        self.cache[image_hash] = embedding
-        self.save_cache()
\ No newline at end of file
+        value = self._to_memory(embedding)
+        with self.lock:
+            self.cache[image_hash] = value
+            self._save()
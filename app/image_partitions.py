@@ -0,0 +1,157 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import json
+import os
+import logging
+from app.quantization import QuantizedMatrix, search_matrix
+
+logger = logging.getLogger(__name__)
+
+# Metadata fields the image vectors are partitioned by, coarse to fine
+LEVELS = ("category", "sub_category")
+
+VECTORS_FILE = "vectors.npy"
+INDEX_FILE = "partitions.json"
+
+# Rows fetched from Chroma per page while building
+READ_BATCH_SIZE = 1000
+
+class ImagePartitionIndex:
+    """
+    Image vectors grouped by product category, for routed image search.
+
+    Rows are sorted by (category, sub_category), so each partition is one or
+    a few contiguous row ranges of an mmap'd float32 matrix and a routed query
+    is a matmul over just those rows. Searching without a partition scans
+    everything.
+
+    With a quantized copy (float16, int8 or PQ codes) the scan runs on the
+    codes and only the top rescore_candidates rows are read back from the
+    float32 matrix for exact scores.
+    """
+    def __init__(self, ids: List[str], vectors: np.ndarray, partitions: Dict[str, Dict[str, List[List[int]]]],
+                 quantized: Optional[QuantizedMatrix] = None, rescore_candidates: int = 100):
+        self.ids = ids
+        self.vectors = vectors
+        self.partitions = partitions
+        self.quantized = quantized
+        self.rescore_candidates = rescore_candidates
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def partition_size(self, level: str, label: str) -> int:
+        return sum(end - start for start, end in self.partitions.get(level, {}).get(label, []))
+
+    @staticmethod
+    def _group(labels: List[Tuple[str, str]]) -> Tuple[np.ndarray, Dict[str, Dict[str, List[List[int]]]]]:
+        """Sort order of the rows and, per level, label -> [start, end) ranges in that order"""
+        order = np.array(sorted(range(len(labels)), key=lambda i: labels[i]), dtype=np.int64)
+        partitions: Dict[str, Dict[str, List[List[int]]]] = {level: {} for level in LEVELS}
+        for column, level in enumerate(LEVELS):
+            for row, i in enumerate(order):
+                ranges = partitions[level].setdefault(labels[i][column], [])
+                if ranges and ranges[-1][1] == row:
+                    ranges[-1][1] = row + 1
+                else:
+                    ranges.append([row, row + 1])
+        return order, partitions
+
+    @classmethod
+    def from_arrays(cls, ids: List[str], vectors: np.ndarray, labels: List[Tuple[str, str]],
+                    mode: str = "float32", pq_subspaces: int = 64) -> "ImagePartitionIndex":
+        """Build an in-memory index from product ids, their image vectors and (category, sub_category) labels"""
+        order, partitions = cls._group(labels)
+        sorted_vectors = np.ascontiguousarray(vectors[order], dtype=np.float32)
+        quantized = QuantizedMatrix.fit(sorted_vectors, mode, pq_subspaces) if mode != "float32" else None
+        return cls([ids[i] for i in order], sorted_vectors, partitions, quantized)
+
+    @classmethod
+    def build(cls, image_collection, path: str, mode: str = "float32", pq_subspaces: int = 64) -> "ImagePartitionIndex":
+        """
+        Read the image collection's vectors and categories and write the
+        partitioned matrix (plus its quantized codes, unless mode is float32) to path
+        """
+        total = image_collection.count()
+        ids: List[str] = []
+        labels: List[Tuple[str, str]] = []
+        vectors = None
+        for offset in range(0, total, READ_BATCH_SIZE):
+            page = image_collection.get(limit=READ_BATCH_SIZE, offset=offset, include=["embeddings", "metadatas"])
+            page_vectors = np.asarray(page['embeddings'], dtype=np.float32)
+            if not len(page_vectors):
+                continue
+            if vectors is None:
+                vectors = np.empty((total, page_vectors.shape[1]), dtype=np.float32)
+            vectors[len(ids):len(ids) + len(page_vectors)] = page_vectors
+            for image_id, metadata in zip(page['ids'], page['metadatas']):
+                metadata = metadata or {}
+                ids.append(image_id[:-len("_img")] if image_id.endswith("_img") else image_id)
+                labels.append((str(metadata.get('category') or ''), str(metadata.get('sub_category') or '')))
+        if vectors is None:
+            raise ValueError("Image collection is empty, nothing to partition")
+        vectors = vectors[:len(ids)]
+
+        order, partitions = cls._group(labels)
+        os.makedirs(path, exist_ok=True)
+        sorted_vectors = np.lib.format.open_memmap(os.path.join(path, VECTORS_FILE + ".tmp"), mode="w+",
+                                                   dtype=np.float32, shape=vectors.shape)
+        sorted_vectors[:] = vectors[order]
+        sorted_vectors.flush()
+        if mode != "float32":
+            QuantizedMatrix.fit(sorted_vectors, mode, pq_subspaces).save(path)
+        del sorted_vectors, vectors
+
+        # Rename into place so a reader never sees a half-written index
+        with open(os.path.join(path, INDEX_FILE + ".tmp"), "w") as f:
+            json.dump({"ids": [ids[i] for i in order], "partitions": partitions}, f)
+        os.replace(os.path.join(path, VECTORS_FILE + ".tmp"), os.path.join(path, VECTORS_FILE))
+        os.replace(os.path.join(path, INDEX_FILE + ".tmp"), os.path.join(path, INDEX_FILE))
+        logger.info(f"Partitioned {len(ids)} image vectors into {len(partitions['category'])} categories "
+                    f"and {len(partitions['sub_category'])} sub-categories ({mode})")
+        return cls.load(path, mode)
+
+    @classmethod
+    def load(cls, path: str, mode: str = "float32", rescore_candidates: int = 100) -> Optional["ImagePartitionIndex"]:
+        """Open an index written by build(), or None if there isn't one (with codes for `mode`)"""
+        try:
+            with open(os.path.join(path, INDEX_FILE)) as f:
+                index = json.load(f)
+            vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if len(index["ids"]) != len(vectors):
+            logger.warning(f"Image partition index at {path} is inconsistent, ignoring it")
+            return None
+        quantized = None
+        if mode != "float32":
+            quantized = QuantizedMatrix.load(path, mode)
+            if quantized is None or quantized.rows != len(vectors):
+                return None
+        return cls(index["ids"], vectors, index["partitions"], quantized, rescore_candidates)
+
+    def search(self, embedding: List[float], n_results: int, level: Optional[str] = None,
+               label: Optional[str] = None) -> Tuple[List[Tuple[str, float]], int]:
+        """
+        Top n_results (product id, cosine similarity) within one partition, or
+        across all rows when level is None. Also returns how many rows were scanned.
+        """
+        ranges = None if level is None else self.partitions.get(level, {}).get(label, [])
+        rows, scores, scanned = search_matrix(self.vectors, embedding, n_results, ranges,
+                                              self.quantized, self.rescore_candidates)
+        return [(self.ids[row], float(score)) for row, score in zip(rows, scores)], scanned
+
+def choose_partition(decision: Optional[Dict[str, Tuple[str, float]]], index: ImagePartitionIndex,
+                     confidence_threshold: float, n_results: int) -> Optional[Tuple[str, str, float]]:
+    """
+    Pick the narrowest partition the zero-shot decision ({level: (label,
+    confidence)}) is confident about and that holds at least n_results
+    products. Returns (level, label, confidence), or None for a global search.
+    """
+    if not decision:
+        return None
+    for level in reversed(LEVELS):
+        label, confidence = decision[level]
+        if confidence >= confidence_threshold and index.partition_size(level, label) >= n_results:
+            return level, label, confidence
+    return None
@@ -2,11 +2,13 @@ from PIL import Image
 import base64
 import io
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import torch
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 import logging
 from app.image_cache import ImageEmbeddingCache
+from app.config import get_settings
+from app.inference_pool import get_inference_pool
+from app.single_flight import SingleFlight
+from app.tracing import traced
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,10 +16,20 @@ logger = logging.getLogger(__name__)
 class ImageProcessor:
     def __init__(self):
         try:
+            # Imported here so torch only loads when the model does
+            from sentence_transformers import SentenceTransformer
+            
             # Load CLIP model for image embeddings
             self.model = SentenceTransformer('clip-ViT-B-32')
             logger.info("CLIP model loaded successfully")
-            self.cache = ImageEmbeddingCache()
+            settings = get_settings()
+            self.cache = ImageEmbeddingCache(dtype=settings.image_cache_dtype)
+            # Concurrent requests for the same uncached image share one CLIP pass
+            self.image_flights = SingleFlight("clip.image_embedding", enabled=settings.single_flight_enabled)
+            
+            # Zero-shot category labels (see load_category_labels)
+            self.category_taxonomy: List[Tuple[str, str, str]] = []
+            self.category_label_embeddings: Optional[np.ndarray] = None
         except Exception as e:
             logger.error(f"Error loading CLIP model: {e}")
             raise
@@ -41,6 +53,7 @@ class ImageProcessor:
             logger.error(f"Error converting base64 to image: {e}")
             raise
     
+    @traced("clip.image_embedding")
     def get_image_embedding(self, base64_string: str) -> List[float]:
         """Generate embedding from base64 image with caching"""
         # Check cache first
@@ -48,18 +61,25 @@ class ImageProcessor:
         if cached_embedding:
             logger.info("Using cached image embedding")
             return cached_embedding
-        
+        return self.image_flights.do(self.cache.get_image_hash(base64_string), self._embed_image, base64_string)
+    
+    def _embed_image(self, base64_string: str) -> List[float]:
         try:
             image = self.base64_to_image(base64_string)
             
             # Resize image for consistent processing
             image = image.resize((224, 224))
             
-            # Generate embedding
-            embedding = self.model.encode(image)
-            
-            # Normalize embedding
-            embedding = embedding / np.linalg.norm(embedding)
+            pool = get_inference_pool()
+            if pool is not None:
+                # Run CLIP in the inference pool, off this process's GIL (returns a normalized vector)
+                embedding = np.asarray(pool.embed_image(image))
+            else:
+                # Generate embedding
+                embedding = self.model.encode(image)
+                
+                # Normalize embedding
+                embedding = embedding / np.linalg.norm(embedding)
             
             # Cache the result
             self.cache.set_embedding(base64_string, embedding.tolist())
@@ -69,6 +89,7 @@ class ImageProcessor:
             logger.error(f"Error generating image embedding: {e}")
             raise
 
+    @traced("clip.text_embedding")
     def get_text_embedding(self, text: str) -> List[float]:
         """Generate embedding from text (CLIP is multimodal)"""
         try:
@@ -77,4 +98,61 @@ class ImageProcessor:
             return embedding.tolist()
         except Exception as e:
             logger.error(f"Error generating text embedding: {e}")
-            raise
\ No newline at end of file
+            raise
+    
+    @traced("clip.image_embedding_batch")
+    def get_image_embeddings(self, base64_strings: List[str], batch_size: int = 32) -> List[List[float]]:
+        """Embed many base64 images at once (bypasses the per-image cache, which rewrites its file on every set)"""
+        images = [self.base64_to_image(base64_string).resize((224, 224)) for base64_string in base64_strings]
+        pool = get_inference_pool()
+        if pool is not None:
+            # Queue everything first so all pool workers are busy
+            futures = [pool.submit_image_embedding(image) for image in images]
+            return [future.result() for future in futures]
+        embeddings = np.asarray(self.model.encode(images, batch_size=batch_size))
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
+    @traced("clip.text_embedding_batch")
+    def get_text_embeddings(self, texts: List[str], batch_size: int = 64) -> List[List[float]]:
+        """Embed many texts at once"""
+        embeddings = np.asarray(self.model.encode(texts, batch_size=batch_size))
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
+    def load_category_labels(self, taxonomy: List[Tuple[str, str, str]]):
+        """
+        Embed the catalog's (masterCategory, subCategory, articleType) labels
+        once for zero-shot classification. Prompts name the article type,
+        the most visual level; its scores are summed up the hierarchy.
+        """
+        if not taxonomy:
+            return
+        prompts = [f"a photo of {article_type.lower()}, a kind of {sub_category.lower()}"
+                   for _, sub_category, article_type in taxonomy]
+        self.category_label_embeddings = np.asarray(self.get_text_embeddings(prompts), dtype=np.float32)
+        self.category_taxonomy = list(taxonomy)
+        logger.info(f"Loaded {len(taxonomy)} category labels for zero-shot routing")
+
+    @traced("clip.classify_category")
+    def classify_category(self, embedding: List[float]) -> Optional[Dict[str, Tuple[str, float]]]:
+        """
+        Zero-shot category of an image embedding, as {level: (label, confidence)}
+        for "category" and "sub_category"; None if no labels are loaded.
+        Confidence is the softmax probability summed over the label's article types.
+        """
+        if self.category_label_embeddings is None:
+            return None
+        # CLIP's logit scale turns cosine similarities into a peaked distribution
+        logits = 100.0 * (self.category_label_embeddings @ np.asarray(embedding, dtype=np.float32))
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+
+        decision = {}
+        for level, column in (("category", 0), ("sub_category", 1)):
+            totals: Dict[str, float] = {}
+            for labels, probability in zip(self.category_taxonomy, probabilities):
+                totals[labels[column]] = totals.get(labels[column], 0.0) + float(probability)
+            label = max(totals, key=totals.get)
+            decision[level] = (label, totals[label])
+        return decision
@@ -0,0 +1,213 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional
+from PIL import Image
+import multiprocessing
+import numpy as np
+import queue
+import signal
+import threading
+import time
+import logging
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+CLIP_MODEL_NAME = "clip-ViT-B-32"
+EMBEDDING_DIM = 512
+
+# Each slot holds one image of up to MAX_SIDE x MAX_SIDE RGB pixels and one embedding
+MAX_SIDE = 224
+PIXEL_SLOT_BYTES = MAX_SIDE * MAX_SIDE * 3
+EMBEDDING_SLOT_BYTES = EMBEDDING_DIM * 4
+
+# State of a pool worker process, set up once by _init_worker
+_worker: Dict = {}
+
+def _init_worker(model_name: str, pixels_name: str, embeddings_name: str, torch_threads: int):
+    """Load the model and attach the shared buffers once per worker process"""
+    # The parent handles Ctrl+C and shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(torch_threads)
+    _worker["model"] = SentenceTransformer(model_name)
+    _worker["pixels"] = shared_memory.SharedMemory(name=pixels_name)
+    _worker["embeddings"] = shared_memory.SharedMemory(name=embeddings_name)
+
+def _read_pixels(slot: int, shape: tuple) -> np.ndarray:
+    return np.ndarray(shape, dtype=np.uint8, buffer=_worker["pixels"].buf, offset=slot * PIXEL_SLOT_BYTES)
+
+def _embed_image(slot: int, shape: tuple) -> float:
+    """Embed the image in a pixel slot and write the normalized vector to the same embedding slot"""
+    start_time = time.perf_counter()
+    image = Image.fromarray(_read_pixels(slot, shape))
+    embedding = _worker["model"].encode(image)
+    output = np.ndarray((EMBEDDING_DIM,), dtype=np.float32, buffer=_worker["embeddings"].buf,
+                        offset=slot * EMBEDDING_SLOT_BYTES)
+    output[:] = embedding / np.linalg.norm(embedding)
+    return time.perf_counter() - start_time
+
+def _encode_jpeg(slot: int, shape: tuple) -> bytes:
+    """JPEG-encode the image in a pixel slot"""
+    import io
+    buffered = io.BytesIO()
+    Image.fromarray(_read_pixels(slot, shape)).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+class InferencePool:
+    """
+    Process pool for CPU-bound image work (CLIP image embeddings, JPEG encoding),
+    so it runs outside the serving process's GIL.
+
+    Each worker loads the CLIP model once at startup. Pixels and embeddings are
+    passed through two shared-memory buffers split into fixed slots rather than
+    pickled; only the slot index and image shape cross the pipe. The number of
+    slots bounds how many tasks can be queued, and callers block for a free
+    slot when the pool is saturated.
+    """
+    def __init__(self, size: int, queue_depth: int = 0, torch_threads: int = 1,
+                 model_name: str = CLIP_MODEL_NAME):
+        self.size = size
+        self.slots = queue_depth or size * 4
+        self._pixels = shared_memory.SharedMemory(create=True, size=self.slots * PIXEL_SLOT_BYTES)
+        self._embeddings = shared_memory.SharedMemory(create=True, size=self.slots * EMBEDDING_SLOT_BYTES)
+        self._free_slots: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+
+        # spawn, not fork: the serving process has threads (event loop, warmup, torch)
+        self._executor = ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, self._pixels.name, self._embeddings.name, torch_threads)
+        )
+        self._lock = threading.Lock()
+        self._closed = False
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def warm(self):
+        """Start every worker and wait for the models to load"""
+        blank = Image.new("RGB", (MAX_SIDE, MAX_SIDE))
+        futures = [self.submit_image_embedding(blank) for _ in range(self.size)]
+        for future in futures:
+            future.result()
+
+    def _acquire_slot(self, timeout: Optional[float]) -> int:
+        if self._closed:
+            raise RuntimeError("Inference pool is shut down")
+        start_time = time.perf_counter()
+        try:
+            slot = self._free_slots.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No free inference pool slot")
+        metrics.record_stage_time("inference_pool.slot_wait", time.perf_counter() - start_time)
+        return slot
+
+    def _submit(self, func: Callable, image: Image.Image, finish: Callable, timeout: Optional[float]) -> Future:
+        pixels = np.asarray(image, dtype=np.uint8)
+        if pixels.nbytes > PIXEL_SLOT_BYTES:
+            raise ValueError(f"Image of shape {pixels.shape} does not fit a pool slot")
+
+        slot = self._acquire_slot(timeout)
+        np.ndarray(pixels.shape, dtype=np.uint8, buffer=self._pixels.buf,
+                   offset=slot * PIXEL_SLOT_BYTES)[...] = pixels
+
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        result: Future = Future()
+        start_time = time.perf_counter()
+
+        def done(task: Future):
+            try:
+                result.set_result(finish(slot, task.result()))
+                failed = False
+            except BaseException as e:
+                result.set_exception(e)
+                failed = True
+            finally:
+                self._free_slots.put(slot)
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.failed += failed
+            metrics.record_stage_time(f"inference_pool.{func.__name__.lstrip('_')}", time.perf_counter() - start_time)
+
+        try:
+            task = self._executor.submit(func, slot, pixels.shape)
+        except BaseException:
+            self._free_slots.put(slot)
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        task.add_done_callback(done)
+        return result
+
+    def submit_image_embedding(self, image: Image.Image, timeout: Optional[float] = None) -> Future:
+        """Queue a CLIP embedding of an RGB image no larger than MAX_SIDE x MAX_SIDE"""
+        def finish(slot: int, compute_time: float) -> List[float]:
+            embedding = np.ndarray((EMBEDDING_DIM,), dtype=np.float32, buffer=self._embeddings.buf,
+                                   offset=slot * EMBEDDING_SLOT_BYTES)
+            return embedding.tolist()
+        return self._submit(_embed_image, image, finish, timeout)
+
+    def submit_jpeg_encoding(self, image: Image.Image, timeout: Optional[float] = None) -> Future:
+        """Queue JPEG encoding of an RGB or grayscale image"""
+        return self._submit(_encode_jpeg, image, lambda slot, data: data, timeout)
+
+    def embed_image(self, image: Image.Image) -> List[float]:
+        return self.submit_image_embedding(image).result()
+
+    def encode_jpeg(self, image: Image.Image) -> bytes:
+        return self.submit_jpeg_encoding(image).result()
+
+    def shutdown(self, wait: bool = True):
+        """Finish running tasks, cancel queued ones and release the shared buffers"""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        for buffer in (self._pixels, self._embeddings):
+            buffer.close()
+            buffer.unlink()
+        logger.info("Inference pool shut down")
+
+    def get_stats(self) -> Dict:
+        return {
+            "size": self.size,
+            "slots": self.slots,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.size),
+            "max_in_flight": self.max_in_flight,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+# Process-wide pool, started by the warmup when inference_pool_size > 0
+_pool: Optional[InferencePool] = None
+
+def start_inference_pool(size: int, queue_depth: int = 0, torch_threads: int = 1) -> InferencePool:
+    global _pool
+    if _pool is None:
+        _pool = InferencePool(size, queue_depth, torch_threads)
+        _pool.warm()
+        logger.info(f"Inference pool started with {size} workers and {_pool.slots} slots")
+    return _pool
+
+def get_inference_pool() -> Optional[InferencePool]:
+    return _pool
+
+def shutdown_inference_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
@@ -2,10 +2,13 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
+from fastapi.responses import PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 import json
 import uuid
 from datetime import datetime
@@ -13,22 +16,51 @@ import base64
 from app.config import get_settings
 from app.middleware import log_requests, rate_limit_middleware, error_handler
 from app.monitoring import metrics
-from app.tools import create_tools, current_image_store
-from app.utils import clean_agent_response
+from app import tools
+from app.tools import (create_tools, current_image_store, current_products_store, current_speculation_store,
+                       general_chat, find_products, start_tool_step, DIRECT_RETURN_TOOLS)
+from app.startup import startup_state
+from app.inference_pool import get_inference_pool, shutdown_inference_pool
+from app.catalog_jobs import catalog_jobs, detect_format, save_upload, FORMATS
+from app.neighbors import KINDS as NEIGHBOR_KINDS
+from app.router import IntentRouter, ROUTE_LLM, ROUTE_GREETING, ROUTE_GENERAL, ROUTE_PRODUCT_SEARCH
+from app.response_cache import SemanticResponseCache
+from app.prompt_budget import TokenBudgetedMemory, budget_tools
+from app.session_memory import SessionMemoryStore
+from app.monitoring_agent import agent_monitor, AgentMonitorCallbackHandler
+from app.agent_runtime import AgentLoop, create_agent_executor, STAGE_TAG_PREFIX
+from app.speculation import SpeculativeRetrieval
+from app.tracing import setup_tracing, stage_span, LLMTracingCallbackHandler
+from app.utils import format_product_results, format_image_results
 from app.models import Product, MessageType
-from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.tools import Tool
 from typing import Dict
 import os
+import queue
 import traceback
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
+setup_tracing()
 
-app = FastAPI(title="AI Commerce Agent API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Serve /health right away; models, indices and the agent warm up in the background
+    startup_state.start_background(get_warmup_steps())
+    yield
+    catalog_jobs.shutdown()
+    if commerce_agent and commerce_agent.agent_loop:
+        commerce_agent.agent_loop.shutdown()
+    if commerce_agent and commerce_agent.speculation:
+        commerce_agent.speculation.shutdown()
+    # Let in-flight CLIP/JPEG tasks finish and release the shared-memory buffers
+    await run_in_threadpool(shutdown_inference_pool)
+
+app = FastAPI(title="AI Commerce Agent API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -51,22 +83,32 @@ class AICommerceAgent:
         if not settings.openai_api_key:
             raise ValueError("OpenAI API key not found in environment variables")
         
-        self.llm = ChatOpenAI(
-            model=settings.llm_model,
-            temperature=settings.temperature,
-            openai_api_key=settings.openai_api_key  # Use from config
-        )
+        # Answers come from llm_model; tool selection can use a faster model
+        self.llm = self._chat_model(settings, settings.llm_model)
+        self.tool_llm = self.llm
+        if settings.llm_tool_model and (settings.llm_tool_model != settings.llm_model or settings.llm_tool_base_url):
+            self.tool_llm = self._chat_model(settings, settings.llm_tool_model, base_url=settings.llm_tool_base_url)
         
-        # Initialize memory for conversation
-        self.memory = ConversationBufferWindowMemory(
-            memory_key="chat_history",
-            return_messages=True,
-            k=10,  # Keep last 10 messages
-            output_key="output"  # Specify which output key to use
+        # Conversation memory, one per session (turns of a session run one at a time)
+        self.sessions = SessionMemoryStore(
+            lambda: TokenBudgetedMemory(
+                memory_key="chat_history",
+                return_messages=True,
+                k=10,  # Keep last 10 messages
+                token_budget=settings.history_token_budget,  # ...and trim them to fit
+                model_name=settings.llm_model,
+                output_key="output"  # Specify which output key to use
+            ),
+            max_sessions=settings.session_memory_max_sessions
         )
             
-        # Get tools from tools.py
-        self.tools = create_tools()
+        # Get tools from tools.py, compacting their output for the prompt
+        self.direct_return = settings.direct_return_enabled
+        self.tools = budget_tools(
+            create_tools(direct_return=self.direct_return),
+            max_tokens=settings.tool_observation_token_budget,
+            model_name=settings.llm_model
+        )
         
         # Create prompt
         self.prompt = ChatPromptTemplate.from_messages([
@@ -80,26 +122,250 @@ class AICommerceAgent:
             - "same color items" for color matching
             - Don't just pass "uploaded_image" or generic text
             
+            When a request has several independent parts (e.g. items like the photo and also
+            rain gear), call the tools for all of them at once instead of one after another.
+            
+            Search results are shown to the user as product cards with full details.
+            Refer to products by name and highlight what fits the request; don't repeat every attribute.
+            
             Be friendly, helpful, and concise in your responses."""),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ])
         
-        # Create agent
-        self.agent = create_openai_functions_agent(self.llm, self.tools, self.prompt)
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            memory=self.memory,
+        # Create agent (an LLM step may return several tool calls)
+        self.agent_executor = create_agent_executor(
+            self.tool_llm,
+            self.tools,
+            self.prompt,
+            answer_llm=self.llm,  # history is passed in per turn, from the session's memory
+            max_iterations=settings.agent_max_iterations,
+            on_tool_step=start_tool_step,
             verbose=True,
             handle_parsing_errors=True,
-            max_iterations=3,
-            return_intermediate_steps=False
+            return_intermediate_steps=True  # to tell a direct tool return from an LLM answer
+        )
+        
+        # Tool calls of one step run concurrently on this loop; otherwise one after another
+        self.agent_loop = AgentLoop(settings.agent_tool_workers) if settings.agent_parallel_tools else None
+        
+        # Searches on the raw turn input, started while the LLM plans its first step
+        self.speculation = None
+        if settings.speculative_retrieval_enabled:
+            self.speculation = SpeculativeRetrieval(
+                tools.image_processor.get_text_embedding,
+                similarity_threshold=settings.speculative_similarity,
+                max_workers=settings.speculative_workers
+            )
+        
+        # Short intro streamed after directly returned results
+        self.intro_llm = None
+        if settings.direct_return_enabled and settings.direct_return_intro:
+            intro_model = settings.llm_intro_model or settings.llm_tool_model or settings.llm_model
+            intro_base_url = settings.llm_tool_base_url if intro_model == settings.llm_tool_model else None
+            self.intro_llm = self._chat_model(settings, intro_model, base_url=intro_base_url,
+                                              max_tokens=settings.direct_return_intro_max_tokens)
+        
+        # Deterministic router in front of the agent
+        self.router = None
+        if settings.intent_router_enabled:
+            self.router = IntentRouter(tools.image_processor)
+        
+        # Semantic cache of whole responses, keyed by CLIP text embeddings
+        self.response_cache = None
+        if settings.response_cache_enabled:
+            self.response_cache = SemanticResponseCache(
+                embed_fn=tools.image_processor.get_text_embedding,
+                max_entries=settings.response_cache_max_entries,
+                ttl_seconds=settings.response_cache_ttl_seconds,
+                similarity_threshold=settings.response_cache_similarity
+            )
+    
+    @staticmethod
+    def _chat_model(settings, model: str, base_url: Optional[str] = None, **kwargs) -> ChatOpenAI:
+        """A chat model on the configured OpenAI-compatible endpoint"""
+        return ChatOpenAI(
+            model=model,
+            temperature=settings.temperature,
+            openai_api_key=settings.openai_api_key,  # Use from config
+            base_url=base_url or settings.openai_base_url,
+            **kwargs
         )
     
+    def _to_product_dicts(self, product_results: List[Dict]) -> List[Dict]:
+        """Validate raw search results through the Product model"""
+        products = []
+        for p in product_results:
+            try:
+                product_dict = {
+                    'id': p.get('id', 'unknown'),
+                    'name': p.get('name', 'Unknown Product'),
+                    'description': p.get('description', ''),
+                    'price': float(p.get('price', 0)),
+                    'category': p.get('category', 'General'),
+                    'sub_category': p.get('sub_category'),
+                    'brand': p.get('brand'),
+                    'color': p.get('color'),
+                    'gender': p.get('gender'),
+                    'in_stock': p.get('in_stock', True),
+                    'image_base64': p.get('image_base64'),  # Include base64 image
+                    'similarity_score': p.get('similarity_score')
+                }
+                
+                product = Product(**product_dict)
+                products.append(product.model_dump())  # Convert to dict
+            except Exception as e:
+                logger.error(f"Error creating product model: {e}")
+                continue
+        return products
+    
+    def _fast_path(self, message: str, decision: Dict, session_id: str, memory) -> Optional[Dict]:
+        """Answer a routed turn without the LLM agent"""
+        route = decision["route"]
+        products = None
+        message_type = "text"
+        
+        if route in (ROUTE_GREETING, ROUTE_GENERAL):
+            response = general_chat(message)
+        elif route == ROUTE_PRODUCT_SEARCH:
+            query = decision.get("query") or message
+            product_results = find_products(query, n_results=5)
+            if not product_results:
+                # Let the agent handle a search that came back empty
+                return None
+            response = format_product_results(query, product_results)
+            products = self._to_product_dicts(product_results)
+            message_type = "product_recommendation"
+        else:
+            return None
+        
+        # Keep the conversation history consistent with agent-handled turns
+        memory.save_context({"input": message}, {"output": response})
+        
+        return {
+            "response": response,
+            "products": products,
+            "session_id": session_id,
+            "message_type": message_type
+        }
+    
     def process_message(self, message: str, image: Optional[str] = None, session_id: str = None) -> Dict:
         """Process a message and return response with products if applicable"""
+        with stage_span("chat.process_message", has_image=bool(image)), self.sessions.turn(session_id) as memory:
+            return self._process_message(message, image, session_id, memory)
+    
+    def _process_message(self, message: str, image: Optional[str], session_id: str, memory) -> Dict:
+        start_time = time.time()
+        
+        # Serve near-identical earlier turns from the semantic cache. Only a
+        # session's first turn: later ones may depend on the conversation so far
+        cacheable = self.response_cache is not None and not memory.chat_memory.messages
+        query_embedding = None
+        if cacheable:
+            cached, query_embedding = self._get_cached_response(message, image, session_id, memory)
+            if cached is not None:
+                return cached
+        
+        result = None
+        route = ROUTE_LLM
+        
+        # Obvious intents skip the LLM round trips entirely
+        if self.router:
+            try:
+                decision = self.router.route(message, image)
+                if decision["route"] != ROUTE_LLM:
+                    with stage_span("chat.fast_path", route=decision["route"]):
+                        result = self._fast_path(message, decision, session_id, memory)
+                    if result is not None:
+                        route = decision["route"]
+            except Exception as e:
+                logger.error(f"Fast path failed, falling back to agent: {e}")
+        
+        if result is None:
+            result = self._run_agent(message, image, session_id, memory)
+            if result.get("direct_return"):
+                route = "direct_return"
+        
+        duration = time.time() - start_time
+        metrics.record_chat_route(route, duration)
+        agent_monitor.log_query_type(result.get("message_type", "text"))
+        if cacheable:
+            self._cache_response(message, image, result, duration, query_embedding)
+        return result
+    
+    def _get_cached_response(self, message: str, image: Optional[str], session_id: str, memory) -> Tuple[Optional[Dict], Any]:
+        """Look up a cached response for this turn; also returns the message embedding the lookup computed, if any"""
+        if not self.response_cache:
+            return None, None
+        
+        try:
+            start_time = time.time()
+            entry, embedding = self.response_cache.get(message, image, tools.vector_store.catalog_version)
+            if entry is None:
+                metrics.record_cache_lookup("response", hit=False)
+                return None, embedding
+            
+            lookup_time = time.time() - start_time
+            metrics.record_cache_lookup("response", hit=True, time_saved=entry["compute_time"] - lookup_time)
+            metrics.record_chat_route("cache", lookup_time)
+            
+            result = dict(entry["result"], session_id=session_id)
+            memory.save_context({"input": message}, {"output": result["response"]})
+            return result, embedding
+        except Exception as e:
+            logger.error(f"Response cache lookup failed: {e}")
+            return None, None
+    
+    def _cache_response(self, message: str, image: Optional[str], result: Dict, duration: float, embedding=None):
+        """Store a successful response for reuse, with the message embedding from the lookup if there was one"""
+        if not self.response_cache or result.get("error"):
+            return
+        
+        try:
+            self.response_cache.set(message, image, tools.vector_store.catalog_version, result, duration,
+                                    embedding=embedding)
+        except Exception as e:
+            logger.error(f"Response cache store failed: {e}")
+    
+    def _direct_response(self, steps: List, raw_response: str) -> Optional[str]:
+        """
+        The templated response for a turn the agent ended with a direct-return
+        search tool, or None if an LLM wrote the final answer
+        """
+        if not self.direct_return or not steps:
+            return None
+        action, observation = steps[-1]
+        if action.tool not in DIRECT_RETURN_TOOLS or observation != raw_response:
+            return None
+        
+        product_results = current_products_store["products"]
+        if not product_results:
+            # The tool's own "nothing found" message is already written for the user
+            return raw_response
+        if current_products_store["source"] == "search_by_image":
+            return format_image_results(product_results)
+        query = action.tool_input
+        if isinstance(query, dict):
+            query = next(iter(query.values()), "")
+        return format_product_results(str(query), product_results)
+    
+    def stream_intro(self, message: str, products: List[Dict]) -> Iterator[str]:
+        """Stream a one or two sentence intro for results the agent returned directly"""
+        names = ", ".join(p.get('name', 'Unknown') for p in products[:5])
+        prompt = [
+            ("system", "You are CommerceAI, a shopping assistant. The user already sees the search results. "
+                       "Write one or two friendly sentences introducing them. Don't list the products."),
+            ("human", f"Request: {message}\nResults: {names}")
+        ]
+        # Timed as the llm.intro stage
+        config = {"callbacks": [LLMTracingCallbackHandler()], "tags": [STAGE_TAG_PREFIX + "intro"]}
+        for chunk in self.intro_llm.stream(prompt, config=config):
+            if chunk.content:
+                yield chunk.content
+    
+    def _run_agent(self, message: str, image: Optional[str], session_id: str, memory) -> Dict:
+        """Run the LLM agent for a turn"""
         
         # Handle image uploads
         input_message = message
@@ -108,87 +374,99 @@ class AICommerceAgent:
             input_message = f"[User uploaded an image] {message}"
         else:
             current_image_store["image"] = None
+        current_products_store["products"] = None
+        current_products_store["source"] = None
+        
+        # Start the likely searches now; the tools pick them up if the LLM asks for the same thing
+        speculation = None
+        if self.speculation:
+            speculation = self.speculation.start(message, image, tools.speculative_text_search,
+                                                 tools.speculative_image_search)
+        current_speculation_store["speculation"] = speculation
         
         try:
             # Run agent
-            result = self.agent_executor.invoke({"input": input_message})
+            usage = AgentMonitorCallbackHandler()
+            inputs = {"input": input_message, **memory.load_memory_variables({})}
+            config = {"callbacks": [usage, LLMTracingCallbackHandler()]}
+            with stage_span("agent", parallel_tools=self.agent_loop is not None):
+                if self.agent_loop:
+                    result = self.agent_loop.run(self.agent_executor.ainvoke(inputs, config=config))
+                else:
+                    result = self.agent_executor.invoke(inputs, config=config)
+            usage.finish()
+            metrics.record_token_usage(usage.prompt_tokens, usage.completion_tokens)
+            logger.info(f"Agent token usage: {usage.prompt_tokens} prompt, {usage.completion_tokens} completion "
+                        f"over {usage.llm_calls} LLM calls")
             
             # Get the response
             raw_response = result.get("output", "I'm sorry, I couldn't process your request.")
+            memory.save_context({"input": input_message}, {"output": raw_response})
+            
+            # A search that ended the turn directly: format its results locally
+            direct_response = self._direct_response(result.get("intermediate_steps"), raw_response)
+            if direct_response is not None:
+                raw_response = direct_response
             
             # Initialize default values
             products = None
             message_type = "text"
             
-            # Check if the response mentions products
-            if any(keyword in raw_response.lower() for keyword in ['found', 'products', 'here are', 'similar']):
-                # Determine search type
-                if image:
+            # Products come from the records the search tools stashed this turn
+            product_results = current_products_store["products"]
+            if product_results:
+                if current_products_store["source"] == "search_by_image":
                     message_type = "image_search"
                 else:
                     message_type = "product_recommendation"
-                
-                # Extract products based on the last tool used
-                try:
-                    from app.tools import vector_store
-                    
-                    if image and "similar" in raw_response.lower():
-                        # Image search
-                        embedding = vector_store.image_processor.get_image_embedding(image)
-                        product_results = vector_store.search_by_image_embedding(embedding, n_results=5)
-                    else:
-                        # Text search - extract query from message
-                        search_query = message
-                        product_results = vector_store.search_products(search_query, n_results=5)
-                    
-                    # Convert to Product models
-                    if product_results:
-                        products = []
-                        for p in product_results:
-                            try:
-                                product_dict = {
-                                    'id': p.get('id', 'unknown'),
-                                    'name': p.get('name', 'Unknown Product'),
-                                    'description': p.get('description', ''),
-                                    'price': float(p.get('price', 0)),
-                                    'category': p.get('category', 'General'),
-                                    'sub_category': p.get('sub_category'),
-                                    'brand': p.get('brand'),
-                                    'color': p.get('color'),
-                                    'gender': p.get('gender'),
-                                    'in_stock': p.get('in_stock', True),
-                                    'image_base64': p.get('image_base64'),  # Include base64 image
-                                    'similarity_score': p.get('similarity_score')
-                                }
-                                
-                                product = Product(**product_dict)
-                                products.append(product.model_dump())  # Convert to dict
-                            except Exception as e:
-                                logger.error(f"Error creating product model: {e}")
-                                continue
-                                
-                except Exception as e:
-                    logger.error(f"Error extracting products: {e}")
+                products = self._to_product_dicts(product_results)
             
             return {
                 "response": raw_response,
                 "products": products,
                 "session_id": session_id,
-                "message_type": message_type
+                "message_type": message_type,
+                "direct_return": direct_response is not None
             }
             
         except Exception as e:
             logger.error(f"Agent error: {e}")
+            agent_monitor.log_error(str(e))
             import traceback
             traceback.print_exc()
             return {
                 "response": "I apologize, but I encountered an error processing your request. Please try again.",
                 "products": None,
                 "session_id": session_id,
-                "message_type": "text"
+                "message_type": "text",
+                "error": True
             }
+        finally:
+            if speculation:
+                speculation.finish()
     
-commerce_agent = AICommerceAgent()
+# Created by the startup warmup
+commerce_agent: Optional[AICommerceAgent] = None
+
+def init_agent():
+    global commerce_agent
+    commerce_agent = AICommerceAgent()
+
+def warm_router():
+    """Embed the router's intent prototypes so the first routed turn doesn't pay for it"""
+    if commerce_agent and commerce_agent.router:
+        commerce_agent.router._get_prototypes()
+
+def get_warmup_steps():
+    """Heavyweight components, in dependency order"""
+    return [
+        ("clip_model", tools.init_image_processor),
+        ("inference_pool", tools.init_inference_pool),
+        ("vector_store", tools.init_vector_store),
+        ("sample_products", tools.load_sample_products),
+        ("agent", init_agent),
+        ("router", warm_router),
+    ]
 
 # Connection manager for WebSocket connections
 class ConnectionManager:
@@ -236,20 +514,54 @@ async def root():
     return {"message": "AI Commerce Agent API is running"}
 
 @app.get("/metrics")
-async def get_metrics():
+async def get_metrics(request: Request, format: Optional[str] = None):
+    """
+    Get API metrics as JSON, or in Prometheus text format when requested
+    with ?format=prometheus or a text/plain / OpenMetrics Accept header
     """
-    Get API metrics
+    accept = request.headers.get("accept", "")
+    if format == "prometheus" or (format is None and ("text/plain" in accept or "openmetrics" in accept)):
+        return PlainTextResponse(metrics.get_prometheus_metrics(), media_type="text/plain; version=0.0.4")
+    result = metrics.get_metrics()
+    pool = get_inference_pool()
+    if pool is not None:
+        result["inference_pool"] = pool.get_stats()
+    if tools.vector_store is not None and tools.vector_store.search_cache is not None:
+        result["search_cache"] = tools.vector_store.search_cache.get_stats()
+    if tools.vector_store is not None:
+        result["catalog_indices"] = tools.vector_store.get_index_status()
+    if commerce_agent is not None and commerce_agent.speculation is not None:
+        result["speculative_retrieval"] = commerce_agent.speculation.get_stats()
+    return result
+
+@app.get("/metrics/agent")
+async def get_agent_metrics():
+    """
+    Get agent metrics: per-tool latency, LLM calls and tokens per turn,
+    iterations per turn and which tool sequences dominate latency
     """
-    return metrics.get_metrics()
+    return agent_monitor.get_stats()
 
 @app.get("/health")
 async def health_check():
     return {
         "status": "healthy",
+        "ready": startup_state.ready,
         "timestamp": datetime.now(),
         "version": "1.0.0"
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 200 once models, indices and the agent are warm, 503 until then.
+    catalog_indices.degraded is true while searches fall back to Chroma during an index rebuild
+    """
+    status = startup_state.get_status()
+    if tools.vector_store is not None:
+        status["catalog_indices"] = tools.vector_store.get_index_status()
+    return JSONResponse(status_code=200 if startup_state.ready else 503, content=status)
+
 # REST endpoint for chat
 @app.post("/chat", response_model=ChatResponse)
 async def chat(chat_message: ChatMessage):
@@ -270,8 +582,9 @@ async def chat(chat_message: ChatMessage):
                 message_type=MessageType.ERROR
             )
         
-        # Process with LangChain agent
-        agent_response = commerce_agent.process_message(
+        # Process with LangChain agent (on a worker thread, so the event loop keeps serving)
+        agent_response = await run_in_threadpool(
+            commerce_agent.process_message,
             message=chat_message.message,
             image=chat_message.image,
             session_id=session_id
@@ -338,6 +651,75 @@ async def upload_image(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Bulk catalog ingestion
+@app.post("/catalog/products:bulk", status_code=202)
+async def bulk_upload_products(file: UploadFile = File(...), format: Optional[str] = None):
+    """
+    Upload products as NDJSON (one product per line) or Parquet. The file is
+    queued as a background job; poll /catalog/jobs/{job_id} for progress.
+    """
+    if tools.vector_store is None:
+        raise HTTPException(status_code=503, detail="Catalog is still loading")
+    
+    file_format = format or detect_format(file.filename, file.content_type)
+    if file_format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Upload must be NDJSON (.ndjson/.jsonl) or Parquet (.parquet)")
+    
+    settings = get_settings()
+    try:
+        path, size = await save_upload(file, settings.catalog_upload_max_bytes)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    try:
+        job = catalog_jobs.submit(path, file_format, size)
+    except queue.Full:
+        os.remove(path)
+        raise HTTPException(status_code=429, detail="Too many catalog jobs queued, try again later")
+    
+    return {"job_id": job.id, "status": job.status, "status_url": f"/catalog/jobs/{job.id}"}
+
+@app.get("/catalog/jobs/{job_id}")
+async def get_catalog_job(job_id: str):
+    """Status, progress and throughput of a bulk upload job"""
+    job = catalog_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Item-to-item recommendations
+@app.get("/products/{product_id}/similar")
+async def get_similar_products(product_id: str, kind: str = "visual", limit: int = 5):
+    """
+    Products similar to a catalog product, by image ("visual") or by text,
+    served from the precomputed neighbor table
+    """
+    if tools.vector_store is None:
+        raise HTTPException(status_code=503, detail="Catalog is still loading")
+    if kind not in NEIGHBOR_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(NEIGHBOR_KINDS)}")
+    if not 1 <= limit <= 50:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 50")
+    
+    result = await run_in_threadpool(tools.vector_store.get_similar_products, product_id, kind, limit)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    products, source = result
+    return {"product_id": product_id, "kind": kind, "source": source, "products": products}
+
+async def stream_intro(client_id: str, message: str, products: List[Dict]):
+    """Send an intro as "intro" deltas, then the whole text in an "intro_done" message"""
+    intro = ""
+    try:
+        async for delta in iterate_in_threadpool(commerce_agent.stream_intro(message, products)):
+            intro += delta
+            await manager.send_message(json.dumps({"type": "intro", "data": {"delta": delta}}), client_id)
+    except Exception as e:
+        logger.error(f"Intro generation failed: {e}")
+    done = {"type": "intro_done", "data": {"message": intro, "timestamp": datetime.now().isoformat(),
+                                            "session_id": client_id}}
+    await manager.send_message(json.dumps(done), client_id)
+
 # WebSocket endpoint for real-time chat
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
@@ -361,12 +743,16 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
             
             # Handle different message types
             if ws_message.type == "chat":
-                # Process with LangChain agent
-                agent_response = commerce_agent.process_message(
-                    message=ws_message.data.get('message', ''),
-                    image=ws_message.data.get('image'),
-                    session_id=client_id
-                )
+                if not commerce_agent:
+                    agent_response = {"response": "I'm currently unavailable. Please try again later."}
+                else:
+                    # Process with LangChain agent
+                    agent_response = await run_in_threadpool(
+                        commerce_agent.process_message,
+                        message=ws_message.data.get('message', ''),
+                        image=ws_message.data.get('image'),
+                        session_id=client_id
+                    )
                 
                 response = {
                     "type": "response",
@@ -380,6 +766,11 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 
                 await manager.send_message(json.dumps(response), client_id)
                 
+                # Directly returned results: stream a short intro after them
+                if commerce_agent and commerce_agent.intro_llm and agent_response.get("direct_return") \
+                        and agent_response.get("products"):
+                    await stream_intro(client_id, ws_message.data.get('message', ''), agent_response["products"])
+                
             elif ws_message.type == "typing":
                 # Broadcast typing indicator to other clients if needed
                 pass
@@ -1,18 +1,33 @@
 from fastapi import Request, HTTPException
 from fastapi.responses import JSONResponse
-from app.utils import RateLimiter, log_api_request
+from starlette.routing import Match
+from app.utils import create_rate_limiter, log_api_request
 from app.monitoring import metrics
+from app.config import get_settings
+from app.tracing import tracer, start_server_timing, reset_server_timing, get_server_timing_header
 import time
 import logging
 
 logger = logging.getLogger(__name__)
-rate_limiter = RateLimiter(max_requests=100, window_seconds=60)
+rate_limiter = create_rate_limiter(get_settings())
+
+def get_endpoint_label(request: Request) -> str:
+    """
+    Label a request by its route template (e.g. /ws/{client_id}) so metrics
+    don't get one series per session or client id
+    """
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", request.url.path)
+    return "unmatched"
 
 async def log_requests(request: Request, call_next):
     """
     Middleware to log all requests
     """
     start_time = time.time()
+    endpoint = get_endpoint_label(request)
     
     log_api_request(
         endpoint=str(request.url.path),
@@ -20,18 +35,26 @@ async def log_requests(request: Request, call_next):
         client_id=request.client.host
     )
     
+    metrics.request_started(endpoint)
+    timing_token = start_server_timing()
     try:
-        response = await call_next(request)
+        with tracer.start_as_current_span(f"{request.method} {endpoint}", attributes={"http.route": endpoint}):
+            response = await call_next(request)
         process_time = time.time() - start_time
         
         # Record metrics
-        metrics.record_request(str(request.url.path), process_time)
+        metrics.record_request(endpoint, process_time, response.status_code)
         
         response.headers["X-Process-Time"] = str(process_time)
+        response.headers["Server-Timing"] = get_server_timing_header(total=process_time)
         return response
     except Exception as e:
         metrics.record_error()
+        metrics.record_request(endpoint, time.time() - start_time, 500)
         raise e
+    finally:
+        metrics.request_finished(endpoint)
+        reset_server_timing(timing_token)
 
 async def rate_limit_middleware(request: Request, call_next):
     """
@@ -39,7 +62,7 @@ async def rate_limit_middleware(request: Request, call_next):
     """
     client_id = request.client.host
     
-    if not rate_limiter.is_allowed(client_id):
+    if not rate_limiter.is_allowed(client_id, route=request.url.path):
         return JSONResponse(
             status_code=429,
             content={"detail": "Too many requests. Please try again later."}
@@ -1,45 +1,280 @@
 from datetime import datetime
 from typing import Dict, List
 from collections import defaultdict
+from bisect import bisect_left
 import asyncio
 
+def _latency_bounds() -> List[float]:
+    """Log-linear bucket upper bounds in seconds, 0.1ms to 100s"""
+    steps = [1, 1.25, 1.5, 2, 2.5, 3, 4, 5, 6, 7.5]
+    bounds = [round(step * 10 ** exponent, 6) for exponent in range(-4, 2) for step in steps]
+    return bounds + [100.0]
+
+LATENCY_BOUNDS = tuple(_latency_bounds())
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+    Recording is a binary search plus a counter increment; nothing grows with traffic.
+    Percentiles are reported as the upper bound of the bucket they fall in.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        self.counts[bisect_left(LATENCY_BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                bound = LATENCY_BOUNDS[index] if index < len(LATENCY_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "average": round(self.total / self.count, 4) if self.count else 0,
+            "p50": round(self.percentile(0.50), 4),
+            "p90": round(self.percentile(0.90), 4),
+            "p99": round(self.percentile(0.99), 4),
+            "max": round(self.max, 4)
+        }
+
+def _label(value) -> str:
+    """Escape a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
 class MetricsCollector:
     def __init__(self):
         self.request_count = 0
         self.error_count = 0
         self.endpoint_stats = defaultdict(int)
-        self.response_times = []
+        self.latency = LatencyHistogram()
+        self.endpoint_latency = defaultdict(LatencyHistogram)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.in_flight = defaultdict(int)
         self.active_websockets = 0
-        
-    def record_request(self, endpoint: str, response_time: float):
+        self.stage_times = defaultdict(LatencyHistogram)
+        self.chat_routes = defaultdict(lambda: {"count": 0, "total": 0.0})
+        self.cache_stats = defaultdict(lambda: {"hits": 0, "misses": 0, "time_saved": 0.0})
+        self.token_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.image_routes = defaultdict(lambda: {"count": 0, "candidates": 0})
+        self.single_flight = defaultdict(lambda: {"calls": 0, "coalesced": 0})
+
+    def request_started(self, endpoint: str):
+        self.in_flight[endpoint] += 1
+
+    def request_finished(self, endpoint: str):
+        self.in_flight[endpoint] = max(0, self.in_flight[endpoint] - 1)
+
+    def record_request(self, endpoint: str, response_time: float, status_code: int = 200):
         self.request_count += 1
         self.endpoint_stats[endpoint] += 1
-        self.response_times.append(response_time)
-        
-                # Keep only last 1000 response times
-        if len(self.response_times) > 1000:
-            self.response_times = self.response_times[-1000:]
-    
+        self.status_codes[endpoint][status_code] += 1
+        self.latency.record(response_time)
+        self.endpoint_latency[endpoint].record(response_time)
+
+    def record_stage_time(self, stage: str, duration: float):
+        """Record the duration of an internal pipeline stage (e.g. vector query, rerank)"""
+        self.stage_times[stage].record(duration)
+
+    def record_chat_route(self, route: str, duration: float):
+        """Record how a chat turn was handled (fast path or LLM agent) and how long it took"""
+        stats = self.chat_routes[route]
+        stats["count"] += 1
+        stats["total"] += duration
+
+    def get_routing_metrics(self) -> Dict:
+        total = sum(stats["count"] for stats in self.chat_routes.values())
+        llm = self.chat_routes.get("llm", {"count": 0, "total": 0.0})
+        routed = total - llm["count"]
+        avg_llm_time = llm["total"] / llm["count"] if llm["count"] else 0
+
+        # Savings estimate: each routed turn would otherwise have cost an average LLM turn
+        saved = sum(
+            stats["count"] * avg_llm_time - stats["total"]
+            for route, stats in self.chat_routes.items() if route != "llm"
+        ) if avg_llm_time else 0
+
+        return {
+            "total_turns": total,
+            "routed_fraction": round(routed / total, 3) if total else 0,
+            "average_llm_time": round(avg_llm_time, 3),
+            "estimated_time_saved": round(max(saved, 0), 3),
+            "routes": {
+                route: {
+                    "count": stats["count"],
+                    "average_time": round(stats["total"] / stats["count"], 4) if stats["count"] else 0
+                }
+                for route, stats in self.chat_routes.items()
+            }
+        }
+
+    def record_cache_lookup(self, cache: str, hit: bool, time_saved: float = 0.0):
+        """Record a cache hit or miss, with the compute time a hit avoided"""
+        stats = self.cache_stats[cache]
+        if hit:
+            stats["hits"] += 1
+            stats["time_saved"] += max(time_saved, 0.0)
+        else:
+            stats["misses"] += 1
+
+    def record_image_route(self, route: str, candidates: int):
+        """Record where an image search was routed (a category level or global) and how many vectors it scanned"""
+        stats = self.image_routes[route]
+        stats["count"] += 1
+        stats["candidates"] += candidates
+
+    def record_single_flight(self, name: str, coalesced: bool):
+        """Record a call through a single-flight group, and whether it joined an identical call in flight"""
+        stats = self.single_flight[name]
+        stats["calls"] += 1
+        if coalesced:
+            stats["coalesced"] += 1
+
+    def record_token_usage(self, prompt_tokens: int, completion_tokens: int):
+        """Record LLM token usage for one agent request"""
+        self.token_usage["requests"] += 1
+        self.token_usage["prompt_tokens"] += prompt_tokens
+        self.token_usage["completion_tokens"] += completion_tokens
+
     def record_error(self):
         self.error_count += 1
-    
+
     def record_websocket_connection(self, connected: bool):
         if connected:
             self.active_websockets += 1
         else:
             self.active_websockets = max(0, self.active_websockets - 1)
-    
+
     def get_metrics(self) -> Dict:
-        avg_response_time = sum(self.response_times) / len(self.response_times) if self.response_times else 0
-        
+        avg_response_time = self.latency.total / self.latency.count if self.latency.count else 0
+
         return {
             "total_requests": self.request_count,
             "total_errors": self.error_count,
             "active_websockets": self.active_websockets,
             "average_response_time": round(avg_response_time, 3),
             "endpoint_statistics": dict(self.endpoint_stats),
+            "latency": self.latency.summary(),
+            "endpoint_latency": {
+                endpoint: {
+                    **histogram.summary(),
+                    "status_codes": {str(code): count for code, count in self.status_codes[endpoint].items()},
+                    "in_flight": self.in_flight.get(endpoint, 0)
+                }
+                for endpoint, histogram in self.endpoint_latency.items()
+            },
+            "stage_timings": {stage: histogram.summary() for stage, histogram in self.stage_times.items()},
+            "chat_routing": self.get_routing_metrics(),
+            "caches": {
+                cache: {
+                    "hits": stats["hits"],
+                    "misses": stats["misses"],
+                    "hit_rate": round(stats["hits"] / (stats["hits"] + stats["misses"]), 3) if stats["hits"] + stats["misses"] else 0,
+                    "time_saved": round(stats["time_saved"], 3)
+                }
+                for cache, stats in self.cache_stats.items()
+            },
+            "image_routing": {
+                route: {
+                    "count": stats["count"],
+                    "average_candidates": round(stats["candidates"] / stats["count"], 1) if stats["count"] else 0
+                }
+                for route, stats in self.image_routes.items()
+            },
+            "single_flight": {
+                name: {
+                    "calls": stats["calls"],
+                    "executions": stats["calls"] - stats["coalesced"],
+                    "coalesced": stats["coalesced"],
+                    "coalesce_rate": round(stats["coalesced"] / stats["calls"], 3) if stats["calls"] else 0
+                }
+                for name, stats in self.single_flight.items()
+            },
+            "token_usage": {
+                **self.token_usage,
+                "average_prompt_tokens": round(self.token_usage["prompt_tokens"] / self.token_usage["requests"], 1) if self.token_usage["requests"] else 0,
+                "average_completion_tokens": round(self.token_usage["completion_tokens"] / self.token_usage["requests"], 1) if self.token_usage["requests"] else 0
+            },
             "timestamp": datetime.now().isoformat()
         }
 
+    def _histogram_lines(self, name: str, label: str, histograms: Dict[str, LatencyHistogram]) -> List[str]:
+        lines = [f"# TYPE {name} histogram"]
+        for key, histogram in histograms.items():
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BOUNDS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label}="{_label(key)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label}="{_label(key)}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label}="{_label(key)}"}} {histogram.total}')
+            lines.append(f'{name}_count{{{label}="{_label(key)}"}} {histogram.count}')
+        return lines
+
+    def get_prometheus_metrics(self) -> str:
+        """Render metrics in the Prometheus text exposition format"""
+        lines = ["# HELP http_requests_total HTTP requests by endpoint and status code",
+                 "# TYPE http_requests_total counter"]
+        for endpoint, codes in self.status_codes.items():
+            for code, count in codes.items():
+                lines.append(f'http_requests_total{{endpoint="{_label(endpoint)}",status="{code}"}} {count}')
+
+        lines.append("# HELP http_request_duration_seconds HTTP request latency")
+        lines += self._histogram_lines("http_request_duration_seconds", "endpoint", self.endpoint_latency)
+
+        lines += ["# HELP http_requests_in_flight Requests currently being served",
+                  "# TYPE http_requests_in_flight gauge"]
+        for endpoint, count in self.in_flight.items():
+            lines.append(f'http_requests_in_flight{{endpoint="{_label(endpoint)}"}} {count}')
+
+        lines += ["# TYPE http_errors_total counter", f"http_errors_total {self.error_count}",
+                  "# TYPE websocket_connections_active gauge", f"websocket_connections_active {self.active_websockets}"]
+
+        lines.append("# HELP pipeline_stage_duration_seconds Internal pipeline stage latency")
+        lines += self._histogram_lines("pipeline_stage_duration_seconds", "stage", self.stage_times)
+
+        lines.append("# TYPE chat_turns_total counter")
+        for route, stats in self.chat_routes.items():
+            lines.append(f'chat_turns_total{{route="{_label(route)}"}} {stats["count"]}')
+
+        # Each metric family's TYPE line and samples must be contiguous
+        lines += ["# HELP cache_hits_total Cache hits by cache", "# TYPE cache_hits_total counter"]
+        for cache, stats in self.cache_stats.items():
+            lines.append(f'cache_hits_total{{cache="{_label(cache)}"}} {stats["hits"]}')
+        lines += ["# HELP cache_misses_total Cache misses by cache", "# TYPE cache_misses_total counter"]
+        for cache, stats in self.cache_stats.items():
+            lines.append(f'cache_misses_total{{cache="{_label(cache)}"}} {stats["misses"]}')
+
+        lines += ["# HELP single_flight_calls_total Calls through a single-flight group",
+                  "# TYPE single_flight_calls_total counter"]
+        for name, stats in self.single_flight.items():
+            lines.append(f'single_flight_calls_total{{group="{_label(name)}"}} {stats["calls"]}')
+        lines += ["# HELP single_flight_coalesced_total Calls that shared another call's result",
+                  "# TYPE single_flight_coalesced_total counter"]
+        for name, stats in self.single_flight.items():
+            lines.append(f'single_flight_coalesced_total{{group="{_label(name)}"}} {stats["coalesced"]}')
+
+        lines += ["# TYPE llm_prompt_tokens_total counter",
+                  f'llm_prompt_tokens_total {self.token_usage["prompt_tokens"]}',
+                  "# TYPE llm_completion_tokens_total counter",
+                  f'llm_completion_tokens_total {self.token_usage["completion_tokens"]}']
+        return "\n".join(lines) + "\n"
+
 # Global metrics instance
-metrics = MetricsCollector()
\ No newline at end of file
+metrics = MetricsCollector()
@@ -1,37 +1,169 @@
 from datetime import datetime
 from collections import defaultdict
+from typing import Any, Dict, List
+from uuid import UUID
 import json
+import threading
+import time
+from app.monitoring import LatencyHistogram
+from app.prompt_budget import TokenUsageCallbackHandler
+
+# Cap on distinct tool-sequence patterns tracked; the rest are counted as "other"
+MAX_PATTERNS = 50
 
 class AgentMonitor:
     def __init__(self):
         self.tool_usage = defaultdict(int)
+        self.tool_errors = defaultdict(int)
+        self.tool_latency = defaultdict(LatencyHistogram)
         self.query_types = defaultdict(int)
-        self.response_times = []
+        self.response_times = LatencyHistogram()
+        self.iterations = defaultdict(int)  # iterations per turn -> turns
+        self.llm_calls = defaultdict(int)  # LLM calls per turn -> turns
+        self.patterns = defaultdict(LatencyHistogram)  # tool sequence -> turn latency
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_iterations_exhausted = 0
+        self.tool_calls = 0
+        self.parallel_steps = 0  # agent steps that issued more than one tool call
         self.error_count = 0
-        
+        self.lock = threading.Lock()
+
     def log_tool_usage(self, tool_name: str):
         self.tool_usage[tool_name] += 1
-        
+
+    def log_tool_latency(self, tool_name: str, duration: float, error: bool = False):
+        with self.lock:
+            self.tool_usage[tool_name] += 1
+            self.tool_latency[tool_name].record(duration)
+            if error:
+                self.tool_errors[tool_name] += 1
+
     def log_query_type(self, query_type: str):
         self.query_types[query_type] += 1
-        
+
     def log_response_time(self, duration: float):
-        self.response_times.append({
-            "timestamp": datetime.now().isoformat(),
-            "duration": duration
-        })
-        
+        self.response_times.record(duration)
+
+    def log_turn(self, tools: List[str], iterations: int, llm_calls: int, prompt_tokens: int,
+                 completion_tokens: int, exhausted: bool, duration: float, tool_calls: int = 0,
+                 parallel_steps: int = 0):
+        """Record one agent turn (tools: one entry per step, parallel calls joined with " + ")"""
+        pattern = " > ".join(tools) or "no_tool"
+        with self.lock:
+            self.tool_calls += tool_calls
+            self.parallel_steps += parallel_steps
+            if pattern not in self.patterns and len(self.patterns) >= MAX_PATTERNS:
+                pattern = "other"
+            self.patterns[pattern].record(duration)
+            self.iterations[iterations] += 1
+            self.llm_calls[llm_calls] += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if exhausted:
+                self.max_iterations_exhausted += 1
+            self.response_times.record(duration)
+
     def log_error(self, error: str):
         self.error_count += 1
-        
+
     def get_stats(self):
+        turns = self.response_times.count
         return {
             "tool_usage": dict(self.tool_usage),
+            "tool_errors": dict(self.tool_errors),
+            "tool_latency": {tool: histogram.summary() for tool, histogram in self.tool_latency.items()},
             "query_types": dict(self.query_types),
             "total_queries": sum(self.query_types.values()),
             "error_count": self.error_count,
-            "avg_response_time": sum(r["duration"] for r in self.response_times) / len(self.response_times) if self.response_times else 0
+            "avg_response_time": self.response_times.total / turns if turns else 0,
+            "response_time": self.response_times.summary(),
+            "iterations_per_turn": {str(k): v for k, v in sorted(self.iterations.items())},
+            "llm_calls_per_turn": {str(k): v for k, v in sorted(self.llm_calls.items())},
+            "max_iterations_exhausted": self.max_iterations_exhausted,
+            "tool_calls": self.tool_calls,
+            "parallel_tool_steps": self.parallel_steps,
+            "tokens": {
+                "prompt": self.prompt_tokens,
+                "completion": self.completion_tokens,
+                "average_prompt_per_turn": round(self.prompt_tokens / turns, 1) if turns else 0,
+                "average_completion_per_turn": round(self.completion_tokens / turns, 1) if turns else 0
+            },
+            # Sorted by total time spent so the dominant pattern comes first
+            "tool_patterns": dict(sorted(
+                ((pattern, {**histogram.summary(), "total_time": round(histogram.total, 3)})
+                 for pattern, histogram in self.patterns.items()),
+                key=lambda item: item[1]["total_time"],
+                reverse=True
+            ))
         }
 
 # Global monitor instance
-agent_monitor = AgentMonitor()
\ No newline at end of file
+agent_monitor = AgentMonitor()
+
+# Output AgentExecutor returns when it hits max_iterations or max_execution_time
+STOPPED_OUTPUT = "Agent stopped due to"
+
+class AgentMonitorCallbackHandler(TokenUsageCallbackHandler):
+    """
+    Per-turn LangChain callback that feeds AgentMonitor: tool latency,
+    LLM calls and tokens, iterations, and iteration-limit exhaustion.
+    Create one per AgentExecutor invocation and call finish() afterwards.
+
+    An iteration is one LLM step; the tool calls it returns (possibly
+    several, run in parallel) share the step's message log.
+    """
+    # Cheap bookkeeping: run on the event loop under ainvoke instead of a thread hop
+    run_inline = True
+
+    def __init__(self, monitor: AgentMonitor = agent_monitor):
+        super().__init__()
+        self.monitor = monitor
+        self.start_time = time.perf_counter()
+        self.tool_runs: Dict[UUID, tuple] = {}
+        self.steps: Dict[int, List[str]] = {}  # step (its LLM message) -> tools called, in order
+        self.exhausted = False
+
+    @property
+    def iterations(self) -> int:
+        return len(self.steps)
+
+    def on_agent_action(self, action, **kwargs: Any) -> Any:
+        message_log = getattr(action, "message_log", None)
+        step = id(message_log[-1]) if message_log else id(action)
+        self.steps.setdefault(step, []).append(action.tool)
+
+    def on_agent_finish(self, finish, **kwargs: Any) -> None:
+        output = str((finish.return_values or {}).get("output", ""))
+        if output.startswith(STOPPED_OUTPUT):
+            self.exhausted = True
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self.tool_runs[run_id] = (name, time.perf_counter())
+
+    def _finish_tool(self, run_id: UUID, error: bool):
+        name, start_time = self.tool_runs.pop(run_id, (None, None))
+        if name is not None:
+            self.monitor.log_tool_latency(name, time.perf_counter() - start_time, error=error)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_tool(run_id, error=False)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish_tool(run_id, error=True)
+        self.monitor.log_error(str(error))
+
+    def finish(self):
+        """Record the completed turn"""
+        self.monitor.log_turn(
+            tools=[" + ".join(sorted(tools)) for tools in self.steps.values()],
+            iterations=self.iterations,
+            llm_calls=self.llm_calls,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            exhausted=self.exhausted,
+            duration=time.perf_counter() - self.start_time,
+            tool_calls=sum(len(tools) for tools in self.steps.values()),
+            parallel_steps=sum(1 for tools in self.steps.values() if len(tools) > 1)
+        )
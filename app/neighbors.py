@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import json
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Neighbor lists kept per product: by CLIP image vector and by text embedding
+KINDS = ("visual", "text")
+
+IDS_FILE = "ids.json"
+META_FILE = "meta.json"
+
+# Rows fetched from Chroma per page while reading vectors
+READ_BATCH_SIZE = 1000
+
+def _read_vectors(collection, positions: Dict[str, int], id_suffix: str = "") -> Tuple[Optional[np.ndarray], np.ndarray]:
+    """
+    Read a collection's stored vectors into a matrix aligned with `positions`
+    (product id -> row). Returns (matrix, has_vector mask); rows of products
+    without a vector are zero.
+    """
+    matrix = None
+    has_vector = np.zeros(len(positions), dtype=bool)
+    total = collection.count()
+    for offset in range(0, total, READ_BATCH_SIZE):
+        page = collection.get(limit=READ_BATCH_SIZE, offset=offset, include=["embeddings"])
+        page_vectors = np.asarray(page['embeddings'], dtype=np.float32)
+        if not len(page_vectors):
+            continue
+        if matrix is None:
+            matrix = np.zeros((len(positions), page_vectors.shape[1]), dtype=np.float32)
+        for stored_id, vector in zip(page['ids'], page_vectors):
+            product_id = stored_id[:-len(id_suffix)] if id_suffix and stored_id.endswith(id_suffix) else stored_id
+            row = positions.get(product_id)
+            if row is not None:
+                matrix[row] = vector
+                has_vector[row] = True
+    if matrix is not None:
+        # Cosine similarity from here on: one matmul per chunk
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix, has_vector
+
+def top_k_neighbors(vectors: np.ndarray, valid: np.ndarray, k: int, chunk_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k cosine neighbors of every row among the other valid rows of a
+    normalized matrix. Rows are processed chunk_size at a time, so the
+    similarity block held in memory is chunk_size x n rather than n x n.
+    Returns (indices int32, scores float16), both n x k, padded with -1 / 0.
+    """
+    n = len(vectors)
+    indices = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float16)
+    k_eff = min(k, int(valid.sum()) - 1)
+    if k_eff <= 0:
+        return indices, scores
+
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n))
+        sims = vectors[rows] @ vectors.T
+        sims[:, ~valid] = -np.inf
+        sims[np.arange(len(rows)), rows] = -np.inf  # a product is not its own neighbor
+        candidates = np.argpartition(-sims, k_eff - 1, axis=1)[:, :k_eff]
+        candidate_scores = np.take_along_axis(sims, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        chunk_indices = np.take_along_axis(candidates, order, axis=1)
+        chunk_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        found = np.isfinite(chunk_scores) & valid[rows][:, None]
+        indices[rows, :k_eff] = np.where(found, chunk_indices, -1)
+        scores[rows, :k_eff] = np.where(found, chunk_scores, 0)
+    return indices, scores
+
+class NeighborTable:
+    """
+    Precomputed top-K "similar products" per product, by image and by text.
+
+    Neighbors are stored as int32 row numbers into the id list (-1 = none),
+    with float16 scores alongside, in .npy files opened with mmap. A lookup
+    is a dict hit plus one row read, whatever the catalog size.
+    """
+    def __init__(self, ids: List[str], tables: Dict[str, Tuple[np.ndarray, np.ndarray]], meta: Dict):
+        self.ids = ids
+        self.tables = tables
+        self.meta = meta
+        self.positions = {product_id: i for i, product_id in enumerate(ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.positions
+
+    @property
+    def k(self) -> int:
+        return int(self.meta.get("k", 0))
+
+    def neighbors(self, product_id: str, kind: str = "visual", n: Optional[int] = None) -> Optional[List[Tuple[str, float]]]:
+        """(product id, cosine similarity) of the nearest products, best first; None if the product isn't in the table"""
+        position = self.positions.get(product_id)
+        if position is None or kind not in self.tables:
+            return None
+        indices, scores = self.tables[kind]
+        row = indices[position][:n]
+        return [(self.ids[i], float(score)) for i, score in zip(row, scores[position][:n]) if i >= 0]
+
+    @classmethod
+    def build(cls, text_collection, image_collection, path: str, k: int = 20, chunk_size: int = 1024) -> "NeighborTable":
+        """Compute neighbors from the stored text and CLIP vectors and write them to path"""
+        start_time = time.time()
+        ids: List[str] = []
+        total = text_collection.count()
+        for offset in range(0, total, READ_BATCH_SIZE):
+            ids.extend(text_collection.get(limit=READ_BATCH_SIZE, offset=offset, include=[])['ids'])
+        if not ids:
+            raise ValueError("Text collection is empty, nothing to build neighbors for")
+        positions = {product_id: i for i, product_id in enumerate(ids)}
+
+        os.makedirs(path, exist_ok=True)
+        written = []
+        for kind, collection, id_suffix in (("visual", image_collection, "_img"), ("text", text_collection, "")):
+            vectors, valid = _read_vectors(collection, positions, id_suffix)
+            if vectors is None:
+                indices = np.full((len(ids), k), -1, dtype=np.int32)
+                scores = np.zeros((len(ids), k), dtype=np.float16)
+            else:
+                indices, scores = top_k_neighbors(vectors, valid, k, chunk_size)
+            del vectors
+            for suffix, array in (("", indices), ("_scores", scores)):
+                name = f"{kind}{suffix}.npy"
+                np.save(os.path.join(path, name + ".tmp.npy"), array)
+                written.append(name)
+
+        meta = {"k": k, "count": len(ids), "built_at": time.time(), "duration": round(time.time() - start_time, 3)}
+        with open(os.path.join(path, IDS_FILE + ".tmp"), "w") as f:
+            json.dump(ids, f)
+        with open(os.path.join(path, META_FILE + ".tmp"), "w") as f:
+            json.dump(meta, f)
+
+        # Rename into place so a reader never sees a half-written table (meta last marks it complete)
+        for name in written:
+            os.replace(os.path.join(path, name + ".tmp.npy"), os.path.join(path, name))
+        os.replace(os.path.join(path, IDS_FILE + ".tmp"), os.path.join(path, IDS_FILE))
+        os.replace(os.path.join(path, META_FILE + ".tmp"), os.path.join(path, META_FILE))
+        logger.info(f"Built top-{k} neighbors for {len(ids)} products in {meta['duration']:.2f}s")
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["NeighborTable"]:
+        """Open a table written by build(), or None if there isn't a complete one"""
+        try:
+            with open(os.path.join(path, META_FILE)) as f:
+                meta = json.load(f)
+            with open(os.path.join(path, IDS_FILE)) as f:
+                ids = json.load(f)
+            tables = {
+                kind: (np.load(os.path.join(path, f"{kind}.npy"), mmap_mode="r"),
+                       np.load(os.path.join(path, f"{kind}_scores.npy"), mmap_mode="r"))
+                for kind in KINDS
+            }
+        except (OSError, ValueError):
+            return None
+        if any(len(indices) != len(ids) for indices, _ in tables.values()):
+            logger.warning(f"Neighbor table at {path} is inconsistent, ignoring it")
+            return None
+        return cls(ids, tables, meta)
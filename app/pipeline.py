@@ -0,0 +1,112 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import contextvars
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Group an iterable into lists of up to size items, lazily"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_DONE = object()
+
+def prefetch(items: Iterable, depth: int = 2) -> Iterator:
+    """
+    Run an iterator on a background thread, at most `depth` items ahead of
+    the consumer. The bounded queue is the backpressure: a slow consumer
+    stalls the producer instead of letting results pile up in memory.
+    Producer errors are re-raised in the consumer; closing the consumer
+    stops the producer.
+    """
+    buffer: "queue.Queue" = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+
+    # Run in a copy of the caller's context so tracing spans nest under it
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(produce,), name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+
+class ProgressTracker:
+    """Count processed items and log progress, rate and ETA at most every `interval` seconds"""
+    def __init__(self, label: str, total: Optional[int] = None, done: int = 0, interval: float = 5.0):
+        self.label = label
+        self.total = total
+        self.start_done = done
+        self.done = done
+        self.interval = interval
+        self.start_time = time.time()
+        self._last_log = self.start_time
+
+    def update(self, count: int):
+        self.done += count
+        now = time.time()
+        if now - self._last_log >= self.interval:
+            self._last_log = now
+            logger.info(self.format())
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.time() - self.start_time
+        return (self.done - self.start_done) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        if not self.total or not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def format(self) -> str:
+        if self.total:
+            eta = f", ETA {self.eta:.0f}s" if self.eta is not None else ""
+            return f"{self.label}: {self.done}/{self.total} ({self.done / self.total:.0%}) at {self.rate:.1f}/s{eta}"
+        return f"{self.label}: {self.done} at {self.rate:.1f}/s"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "done": self.done,
+            "total": self.total,
+            "items_per_second": round(self.rate, 1),
+            "eta": round(self.eta, 1) if self.eta is not None else None
+        }
@@ -0,0 +1,126 @@
+from typing import Dict
+import gc
+import os
+import signal
+import socket
+import logging
+import uvicorn
+from app.config import get_settings
+from app.startup import StartupState
+from app import tools
+
+logger = logging.getLogger(__name__)
+
+def _preload_vector_store():
+    """
+    Sync the catalog (and build the indices saved next to it) once, then
+    snapshot the image vectors to an mmap'able file. The Chroma client itself
+    is not fork-safe (SQLite handles, background threads), so it is closed
+    again and each worker opens its own, without syncing, and inherits the
+    color index.
+    """
+    import chromadb
+    from app.vector_store import ProductVectorStore
+    from app.vector_snapshot import ImageVectorSnapshot
+
+    settings = get_settings()
+    store = ProductVectorStore(image_processor=tools.init_image_processor())
+    try:
+        if store.image_collection.count():
+            tools.image_snapshot = ImageVectorSnapshot.export(store.image_collection, settings.image_snapshot_path)
+        tools.color_index = store.color_index
+        tools.catalog_preloaded = True
+    finally:
+        del store
+        chromadb.api.client.SharedSystemClient.clear_system_cache()
+
+def preload():
+    """Load the models, the catalog and the image vector matrix in the master process"""
+    from app.fashion_dataset import get_dataset_loader
+
+    state = StartupState()
+    state.run([
+        ("clip_model", tools.init_image_processor),
+        ("catalog", get_dataset_loader),
+        ("image_snapshot", _preload_vector_store),
+    ])
+    if not state.ready:
+        raise RuntimeError(f"Preload failed during {state.failed_component}: {state.error}")
+
+    # Move everything loaded so far out of the GC's reach so collections in the
+    # workers don't write to (and un-share) the inherited pages
+    gc.collect()
+    gc.freeze()
+    return state.get_status()
+
+def _create_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def _run_worker(app, sock: socket.socket, index: int):
+    """Child process: serve the inherited socket until told to stop"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    logger.info(f"Worker {index} started (pid {os.getpid()})")
+    try:
+        server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+        server.run(sockets=[sock])
+    finally:
+        os._exit(0)
+
+def serve(app, workers: int):
+    """
+    Pre-fork server: load shared state once, bind the socket, then fork
+    workers that inherit both. Workers that die are replaced; SIGTERM/SIGINT
+    are forwarded to the workers and the master exits once they are gone.
+    """
+    settings = get_settings()
+    if settings.rate_limit_backend == "memory":
+        logger.warning("Each worker keeps its own rate limit counters; "
+                       "set RATE_LIMIT_BACKEND=redis to enforce limits across workers")
+
+    if settings.prefork_preload:
+        status = preload()
+        logger.info(f"Preloaded shared state in {status['startup_time']:.2f}s: {status['component_timings']}")
+
+    sock = _create_socket(settings.api_host, settings.api_port)
+    children: Dict[int, int] = {}  # pid -> worker index
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(app, sock, index)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for index in range(workers):
+        spawn(index)
+    logger.info(f"Master {os.getpid()} serving on {settings.api_host}:{settings.api_port} with {workers} workers")
+
+    while children:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            logger.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            spawn(index)
+
+    sock.close()
@@ -0,0 +1,144 @@
+from typing import Any, Dict, List, Optional
+from langchain.memory import ConversationBufferWindowMemory
+from langchain.tools import Tool
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import LLMResult
+import tiktoken
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-message overhead of the OpenAI chat format
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# Rough characters-per-token ratio used when no encoding can be loaded
+CHARS_PER_TOKEN = 4
+
+_encodings: Dict[str, Any] = {}
+
+def get_encoding(model_name: str):
+    """Get (and cache) the tiktoken encoding for a model, or None if unavailable"""
+    if model_name not in _encodings:
+        try:
+            try:
+                _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+            except KeyError:
+                _encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # tiktoken downloads its BPE files on first use; estimate if that fails
+            logger.warning(f"Could not load tiktoken encoding for {model_name}, estimating token counts: {e}")
+            _encodings[model_name] = None
+    return _encodings[model_name]
+
+def count_tokens(text: str, model_name: str = "gpt-4") -> int:
+    """Count tokens in a piece of text"""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return len(text or "") // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text or ""))
+
+def count_message_tokens(messages: List[BaseMessage], model_name: str = "gpt-4") -> int:
+    """Count tokens for a list of chat messages, including format overhead"""
+    return sum(count_tokens(str(m.content), model_name) + MESSAGE_TOKEN_OVERHEAD for m in messages)
+
+def truncate_to_tokens(text: str, max_tokens: int, model_name: str = "gpt-4") -> str:
+    """Cut text down to at most max_tokens tokens"""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        max_chars = max_tokens * CHARS_PER_TOKEN
+        return text if len(text or "") <= max_chars else text[:max_chars] + " ..."
+    tokens = encoding.encode(text or "")
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + " ..."
+
+class TokenBudgetedMemory(ConversationBufferWindowMemory):
+    """
+    Window memory that also fits the history into a token budget.
+
+    The newest messages are kept whole until the budget runs out. Older
+    turns are folded into a one-line extractive summary of what the user
+    asked, so the agent keeps the thread of the conversation without paying
+    for the full transcript.
+    """
+    token_budget: int = 1000
+    summary_token_budget: int = 120
+    model_name: str = "gpt-4"
+
+    def _summarize(self, messages: List[BaseMessage]) -> Optional[SystemMessage]:
+        """Summarize dropped turns without an extra LLM call"""
+        requests = [
+            " ".join(str(m.content).split()[:12])
+            for m in messages if isinstance(m, HumanMessage)
+        ]
+        if not requests:
+            return None
+        summary = "Earlier in this conversation the user asked about: " + "; ".join(requests[-5:])
+        return SystemMessage(content=truncate_to_tokens(summary, self.summary_token_budget, self.model_name))
+
+    @property
+    def buffer_as_messages(self) -> List[BaseMessage]:
+        messages = super().buffer_as_messages
+        if count_message_tokens(messages, self.model_name) <= self.token_budget:
+            return messages
+
+        # Keep the newest messages that fit, leaving room for the summary
+        budget = self.token_budget - self.summary_token_budget - MESSAGE_TOKEN_OVERHEAD
+        kept: List[BaseMessage] = []
+        used = 0
+        for message in reversed(messages):
+            tokens = count_tokens(str(message.content), self.model_name) + MESSAGE_TOKEN_OVERHEAD
+            if used + tokens > budget:
+                break
+            kept.insert(0, message)
+            used += tokens
+
+        # Start the kept history on a user turn
+        while kept and not isinstance(kept[0], HumanMessage):
+            kept.pop(0)
+
+        dropped = messages[:len(messages) - len(kept)]
+        summary = self._summarize(dropped)
+        return ([summary] if summary else []) + kept
+
+# Product handle lines written by utils.format_product_handles: "[id] name | $price | attribute"
+HANDLE_ATTRIBUTE_PATTERN = re.compile(r"^(\[[^\]]+\] .+? \| \$[\d.]+) \| .*$")
+
+def compact_observation(observation: str, max_tokens: int, model_name: str = "gpt-4") -> str:
+    """
+    Cap a tool observation at max_tokens before it reaches the LLM. Product
+    handles over budget first lose their trailing attribute, so more of
+    them fit whole before the text is truncated.
+    """
+    if not isinstance(observation, str):
+        observation = str(observation)
+    if count_tokens(observation, model_name) <= max_tokens:
+        return observation
+
+    observation = "\n".join(HANDLE_ATTRIBUTE_PATTERN.sub(r"\1", line) for line in observation.splitlines())
+    return truncate_to_tokens(observation, max_tokens, model_name)
+
+def budget_tools(tools: List[Tool], max_tokens: int, model_name: str = "gpt-4") -> List[Tool]:
+    """Wrap tools so their observations are compacted before the LLM sees them"""
+    budgeted = []
+    for tool in tools:
+        def run(query: str, _func=tool.func) -> str:
+            return compact_observation(_func(query), max_tokens, model_name)
+        budgeted.append(Tool(name=tool.name, func=run, description=tool.description,
+                             return_direct=tool.return_direct))
+    return budgeted
+
+class TokenUsageCallbackHandler(BaseCallbackHandler):
+    """Collect prompt/completion token counts reported by the LLM for one request"""
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.llm_calls += 1
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
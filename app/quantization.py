@@ -0,0 +1,211 @@
+from typing import List, Optional, Tuple
+import numpy as np
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# float32 keeps the full-precision matrix only; the others add a compressed copy that is scanned first
+MODES = ("float32", "float16", "int8", "pq")
+
+CODES_FILE = "codes.npy"
+QUANTIZER_FILE = "quantizer.npz"
+
+# Values decoded at a time while scoring; small enough that a decoded block stays in cache
+SCORE_BLOCK_VALUES = 1 << 19
+
+# float16 -> float32 for every bit pattern; a table lookup decodes faster than numpy's cast
+_FLOAT16_TABLE = np.arange(1 << 16, dtype=np.uint32).astype(np.uint16).view(np.float16).astype(np.float32)
+
+class ScalarQuantizer:
+    """
+    Per-value compression to float16, or to int8 with a symmetric scale per
+    dimension. Dot products with a query fold the scale into the query, so
+    scoring decodes nothing but the code block itself. numpy has no fast
+    half-precision path, so float16 saves memory but scans several times
+    slower than int8.
+    """
+    column_major = False
+
+    def __init__(self, mode: str, scale: Optional[np.ndarray] = None):
+        self.mode = mode
+        self.scale = scale
+
+    def fit(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        if self.mode == "int8":
+            self.scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12).astype(np.float32) / 127.0
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.mode == "float16":
+            return vectors.astype(np.float16)
+        return np.clip(np.round(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        if self.mode == "float16":
+            return np.take(_FLOAT16_TABLE, codes.view(np.uint16)) @ query
+        return codes.astype(np.float32) @ (query * self.scale)
+
+    def state(self) -> dict:
+        return {"scale": self.scale} if self.scale is not None else {}
+
+class ProductQuantizer:
+    """
+    Product quantization: each vector is split into `subspaces` chunks and
+    every chunk is stored as the id of its nearest k-means centroid (one
+    byte). A query is scored by asymmetric distance computation: one lookup
+    table of query-chunk x centroid dot products, then a gather and sum.
+    Codes are stored subspace-major (subspaces x rows) so each gather reads
+    one contiguous byte row.
+    """
+    mode = "pq"
+    column_major = True
+
+    def __init__(self, subspaces: int = 64, centroids: Optional[np.ndarray] = None):
+        self.subspaces = subspaces
+        self.centroids = centroids  # subspaces x 256 x chunk
+
+    def fit(self, vectors: np.ndarray, iterations: int = 15, sample_size: int = 20000, seed: int = 0) -> "ProductQuantizer":
+        n, dim = vectors.shape
+        if dim % self.subspaces:
+            raise ValueError(f"Dimension {dim} is not divisible into {self.subspaces} subspaces")
+        chunk = dim // self.subspaces
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, min(n, sample_size), replace=False)].astype(np.float32)
+        k = min(256, len(sample))
+        self.centroids = np.zeros((self.subspaces, 256, chunk), dtype=np.float32)
+        for m in range(self.subspaces):
+            points = sample[:, m * chunk:(m + 1) * chunk]
+            centers = points[rng.choice(len(points), k, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = self._nearest(points, centers)
+                counts = np.bincount(assignment, minlength=k)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, assignment, points)
+                filled = counts > 0
+                centers[filled] = sums[filled] / counts[filled, None]
+            self.centroids[m, :k] = centers
+        return self
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        distances = (points ** 2).sum(axis=1, keepdims=True) - 2 * points @ centers.T + (centers ** 2).sum(axis=1)
+        return np.argmin(distances, axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        chunk = self.centroids.shape[2]
+        codes = np.empty((self.subspaces, len(vectors)), dtype=np.uint8)
+        block_rows = max(1, SCORE_BLOCK_VALUES // vectors.shape[1])
+        for start in range(0, len(vectors), block_rows):
+            block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+            for m in range(self.subspaces):
+                codes[m, start:start + len(block)] = self._nearest(block[:, m * chunk:(m + 1) * chunk], self.centroids[m])
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        lookup = np.einsum("mkc,mc->mk", self.centroids, query.reshape(self.subspaces, -1))
+        scores = np.take(lookup[0], codes[0])
+        for m in range(1, self.subspaces):
+            scores += np.take(lookup[m], codes[m])
+        return scores
+
+    def state(self) -> dict:
+        return {"centroids": self.centroids}
+
+def make_quantizer(mode: str, pq_subspaces: int = 64):
+    if mode in ("float16", "int8"):
+        return ScalarQuantizer(mode)
+    if mode == "pq":
+        return ProductQuantizer(pq_subspaces)
+    raise ValueError(f"Unknown quantization mode '{mode}', expected one of: {', '.join(MODES[1:])}")
+
+class QuantizedMatrix:
+    """Compressed copy of a float32 matrix, for approximate dot-product scans"""
+    def __init__(self, quantizer, codes: np.ndarray):
+        self.quantizer = quantizer
+        self.codes = codes
+
+    @property
+    def mode(self) -> str:
+        return self.quantizer.mode
+
+    @property
+    def rows(self) -> int:
+        return self.codes.shape[1] if self.quantizer.column_major else len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes) + sum(int(value.nbytes) for value in self.quantizer.state().values())
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, mode: str, pq_subspaces: int = 64) -> "QuantizedMatrix":
+        quantizer = make_quantizer(mode, pq_subspaces).fit(np.asarray(vectors, dtype=np.float32))
+        return cls(quantizer, quantizer.encode(vectors))
+
+    def scores(self, query: np.ndarray, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Approximate dot products of rows [start, end) with query"""
+        end = self.rows if end is None else end
+        if end <= start:
+            return np.empty(0, dtype=np.float32)
+        if self.quantizer.column_major:
+            # Gathers only keep one float per row around, no need to block
+            return self.quantizer.scores(self.codes[:, start:end], query)
+        block_rows = max(1, SCORE_BLOCK_VALUES // self.codes.shape[1])
+        return np.concatenate([
+            self.quantizer.scores(self.codes[block:min(block + block_rows, end)], query)
+            for block in range(start, end, block_rows)
+        ])
+
+    def save(self, path: str):
+        """Write codes and quantizer parameters next to the full-precision matrix"""
+        np.save(os.path.join(path, CODES_FILE + ".tmp.npy"), self.codes)
+        np.savez(os.path.join(path, QUANTIZER_FILE + ".tmp.npz"), mode=self.mode, **self.quantizer.state())
+        os.replace(os.path.join(path, CODES_FILE + ".tmp.npy"), os.path.join(path, CODES_FILE))
+        os.replace(os.path.join(path, QUANTIZER_FILE + ".tmp.npz"), os.path.join(path, QUANTIZER_FILE))
+
+    @classmethod
+    def load(cls, path: str, mode: str) -> Optional["QuantizedMatrix"]:
+        """Open saved codes if they were written in `mode`, else None"""
+        try:
+            with np.load(os.path.join(path, QUANTIZER_FILE)) as state:
+                if str(state["mode"]) != mode:
+                    return None
+                if mode == "pq":
+                    centroids = state["centroids"]
+                    quantizer = ProductQuantizer(centroids.shape[0], centroids)
+                else:
+                    quantizer = ScalarQuantizer(mode, state["scale"] if "scale" in state else None)
+            codes = np.load(os.path.join(path, CODES_FILE), mmap_mode="r")
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(quantizer, codes)
+
+def search_matrix(vectors: np.ndarray, query: List[float], k: int, ranges: Optional[List[List[int]]] = None,
+                  quantized: Optional[QuantizedMatrix] = None, rescore_candidates: int = 100) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Top-k rows of `vectors` by dot product with query, within the given
+    [start, end) row ranges (all rows by default). With a quantized copy, the
+    ranges are scanned on the codes and only the best rescore_candidates rows
+    are rescored exactly against the float32 rows. Returns (rows, scores,
+    rows scanned), best first.
+    """
+    ranges = [[0, len(vectors)]] if ranges is None else ranges
+    query = np.asarray(query, dtype=np.float32)
+    rows = np.concatenate([np.arange(start, end) for start, end in ranges]) if ranges else np.empty(0, dtype=np.int64)
+    if not len(rows):
+        return rows, np.empty(0, dtype=np.float32), 0
+
+    if quantized is None:
+        scores = np.concatenate([vectors[start:end] @ query for start, end in ranges])
+    else:
+        approximate = np.concatenate([quantized.scores(query, start, end) for start, end in ranges])
+        shortlist = min(max(k, rescore_candidates), len(approximate))
+        candidates = np.argpartition(-approximate, shortlist - 1)[:shortlist]
+        # Exact float32 pass over the shortlist only (sorted reads from the mmap'd matrix)
+        rows = np.sort(rows[candidates])
+        scores = np.asarray(vectors[rows]) @ query
+
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return rows[top], scores[top], int(sum(end - start for start, end in ranges))
@@ -0,0 +1,156 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Optional
+import numpy as np
+import contextvars
+import time
+import logging
+from app.config import get_settings
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cross-encoder pairs scored per model call; the deadline is checked between calls
+CROSS_ENCODER_BATCH_SIZE = 16
+
+class DeadlineExceeded(Exception):
+    """A rerank job passed its caller's latency budget and stopped early"""
+
+def _check_deadline(deadline: float):
+    if time.time() > deadline:
+        raise DeadlineExceeded()
+
+class SearchReranker:
+    """
+    Second-stage reranker for vector search candidates.
+
+    Scores are computed in one batch per query: either CLIP text-to-image
+    similarity against the stored product image embeddings, or a small local
+    cross-encoder over (query, document) pairs. If scoring does not finish
+    within the latency budget the caller keeps the original vector order.
+
+    A job that overran stops at its next deadline check (before it starts,
+    and between scoring steps), and new reranks are turned away until it has,
+    so one slow batch can't make every rerank queued behind it time out too.
+    """
+    def __init__(self, image_processor, image_collection, image_snapshot=None):
+        settings = get_settings()
+        self.image_processor = image_processor
+        self.image_collection = image_collection
+        # Shared mmap'd copy of the image vectors (see ImageVectorSnapshot); Chroma is the fallback
+        self.image_snapshot = image_snapshot
+        self.mode = settings.rerank_mode
+        self.cross_encoder_model = settings.rerank_cross_encoder_model
+        self.latency_budget = settings.rerank_latency_budget_ms / 1000.0
+        self.clip_weight = settings.rerank_clip_weight
+        self._cross_encoder = None
+        # A single worker keeps reranks from piling up behind each other
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._overrun = None  # future of a timed-out job, until it stops
+        self.timeouts = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def _get_cross_encoder(self):
+        """Load the cross-encoder on first use"""
+        if self._cross_encoder is None:
+            from sentence_transformers import CrossEncoder
+            self._cross_encoder = CrossEncoder(self.cross_encoder_model)
+            logger.info(f"Cross-encoder {self.cross_encoder_model} loaded")
+        return self._cross_encoder
+
+    def _clip_scores(self, query: str, ids: List[str], deadline: float) -> np.ndarray:
+        """Score candidates by CLIP similarity between the query and product images"""
+        query_embedding = np.asarray(self.image_processor.get_text_embedding(query), dtype=np.float32)
+        _check_deadline(deadline)
+
+        image_ids = [f"{product_id}_img" for product_id in ids]
+
+        # Products without an image embedding score 0 and fall to the back
+        scores = np.zeros(len(ids), dtype=np.float32)
+        if self.image_snapshot is not None:
+            found, matrix = self.image_snapshot.get(image_ids)
+            if found:
+                scores[found] = matrix @ query_embedding
+            if len(found) == len(image_ids):
+                return scores
+            # Products added after the snapshot was taken are looked up in Chroma
+            found_set = set(found)
+            image_ids = [image_id for i, image_id in enumerate(image_ids) if i not in found_set]
+            _check_deadline(deadline)
+
+        stored = self.image_collection.get(ids=image_ids, include=["embeddings"])
+        position = {f"{product_id}_img": i for i, product_id in enumerate(ids)}
+        found_ids = stored.get('ids') or []
+        embeddings = stored.get('embeddings')
+        if found_ids and embeddings is not None and len(embeddings):
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            similarities = matrix @ query_embedding
+            for image_id, similarity in zip(found_ids, similarities):
+                scores[position[image_id]] = similarity
+        return scores
+
+    def _cross_encoder_scores(self, query: str, documents: List[str], deadline: float) -> np.ndarray:
+        """Score candidates with a cross-encoder, a few batches per query"""
+        model = self._get_cross_encoder()
+        pairs = [(query, document or "") for document in documents]
+        scores = []
+        for start in range(0, len(pairs), CROSS_ENCODER_BATCH_SIZE):
+            _check_deadline(deadline)
+            batch = pairs[start:start + CROSS_ENCODER_BATCH_SIZE]
+            scores.append(np.asarray(model.predict(batch, batch_size=len(batch)), dtype=np.float32))
+        return np.concatenate(scores)
+
+    def _score(self, query: str, ids: List[str], documents: List[str], distances: List[float],
+               deadline: float) -> List[int]:
+        """Compute the reranked order of candidate positions"""
+        # Queued behind a slow job for the whole budget: nobody is waiting for this any more
+        _check_deadline(deadline)
+        if self.mode == "cross_encoder":
+            scores = self._cross_encoder_scores(query, documents, deadline)
+        else:
+            clip_scores = self._clip_scores(query, ids, deadline)
+            # Keep some weight on the first-stage vector similarity
+            vector_scores = 1 / (1 + np.asarray(distances, dtype=np.float32))
+            scores = self.clip_weight * clip_scores + (1 - self.clip_weight) * vector_scores
+        return [int(i) for i in np.argsort(-scores, kind="stable")]
+
+    def rerank(self, query: str, ids: List[str], documents: List[str], distances: List[float]) -> Optional[List[int]]:
+        """
+        Return candidate positions in reranked order, or None to keep
+        the vector order (budget exceeded or scoring failed)
+        """
+        if len(ids) < 2:
+            return None
+        if self._overrun is not None and not self._overrun.done():
+            # A timed-out job still holds the worker; don't queue behind it
+            self.skipped += 1
+            return None
+
+        start_time = time.time()
+        deadline = start_time + self.latency_budget
+        # Run in a copy of the caller's context so tracing spans nest under the request
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._score, query, ids, documents, distances, deadline)
+        try:
+            order = future.result(timeout=self.latency_budget)
+            metrics.record_stage_time("rerank", time.time() - start_time)
+            return order
+        except (FutureTimeoutError, DeadlineExceeded):
+            self._overrun = future
+            self.timeouts += 1
+            metrics.record_stage_time("rerank_timeout", time.time() - start_time)
+            logger.warning(f"Rerank exceeded {self.latency_budget * 1000:.0f}ms budget, using vector order")
+            return None
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Error reranking results: {e}")
+            return None
+
+    def get_stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "latency_budget_ms": self.latency_budget * 1000,
+            "timeouts": self.timeouts,
+            "skipped_while_overrun": self.skipped,
+            "errors": self.errors
+        }
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from typing import Dict, Optional, Callable, Tuple
+import numpy as np
+import hashlib
+import threading
+import time
+import re
+import logging
+from app.color_index import COLOR_NAME_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Turns that refer back to the conversation can't be answered from another session's reply
+CONTEXT_DEPENDENT_PATTERN = re.compile(
+    r"\b(it|its|that|those|these|them|this one|the (first|second|third|last) one|"
+    r"cheaper|instead|previous|again|above|earlier)\b",
+    re.IGNORECASE
+)
+
+# Numbers (prices, sizes, quantities) and size words: two turns must agree on these exactly
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+SIZE_PATTERN = re.compile(r"\b(xxs|xs|xl|xxl|xxxl|small|medium|large|petite|plus size)\b", re.IGNORECASE)
+
+def constraint_tokens(message: str) -> tuple:
+    """
+    The colors, numbers and sizes a message asks for. Embeddings barely
+    separate "red dress under $50" from "blue dress under $30", so these
+    have to match exactly before a semantic hit is allowed.
+    """
+    text = message or ""
+    tokens = {f"color:{m.lower()}" for m in COLOR_NAME_PATTERN.findall(text)}
+    tokens |= {f"number:{m.replace(',', '')}" for m in NUMBER_PATTERN.findall(text)}
+    tokens |= {f"size:{m.lower()}" for m in SIZE_PATTERN.findall(text)}
+    return tuple(sorted(tokens))
+
+def normalize_message(message: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    text = re.sub(r"[^\w\s$]", " ", (message or "").lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+class SemanticResponseCache:
+    """
+    Cache of chat responses keyed by message embedding.
+
+    Entries live in a fixed-size matrix so a lookup is one matrix-vector
+    product. Exact repeats (after normalization) are answered without
+    embedding the message at all. Similar messages only match within a
+    partition: the same uploaded image and the same color, number and size
+    tokens. Entries expire after a TTL, are evicted
+    least-recently-used when full, and are dropped when the catalog version
+    they were computed against changes.
+    """
+    def __init__(self, embed_fn: Callable[[str], list], max_entries: int = 1000,
+                 ttl_seconds: int = 600, similarity_threshold: float = 0.93):
+        self.embed_fn = embed_fn
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.lock = threading.Lock()
+
+        self._vectors: Optional[np.ndarray] = None  # allocated on first insert
+        self._valid = np.zeros(max_entries, dtype=bool)
+        self._partitions = np.zeros(max_entries, dtype=np.int64)
+        self._slots: "OrderedDict[str, int]" = OrderedDict()  # cache key -> slot, in LRU order
+        self._entries: Dict[int, Dict] = {}
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+    def _partition(self, message: str, image: Optional[str]) -> int:
+        """A hash of the image and the message's constraint tokens; nothing is kept per partition"""
+        digest = hashlib.md5()
+        digest.update(image.encode() if image else b"")
+        digest.update("|".join(constraint_tokens(message)).encode())
+        return int.from_bytes(digest.digest()[:8], "little", signed=True)
+
+    def _evict(self, key: str):
+        slot = self._slots.pop(key)
+        self._valid[slot] = False
+        self._entries.pop(slot, None)
+        self._free_slots.append(slot)
+
+    def is_cacheable(self, message: str) -> bool:
+        return bool(normalize_message(message)) and not CONTEXT_DEPENDENT_PATTERN.search(message)
+
+    def get(self, message: str, image: Optional[str],
+            catalog_version: int) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """
+        Return the cached entry closest to this message, if close enough, and
+        the message embedding if the lookup computed one (pass it on to set()
+        so a miss costs one embedding call)
+        """
+        if not self.is_cacheable(message):
+            return None, None
+
+        normalized = normalize_message(message)
+        partition = self._partition(message, image)
+        embedding = None
+        with self.lock:
+            slot = self._slots.get(f"{partition}:{normalized}")
+            needs_embedding = slot is None and self._vectors is not None and self._valid.any()
+
+        if needs_embedding:
+            # Embed outside the lock; the model call dominates lookup time
+            embedding = np.asarray(self.embed_fn(normalized), dtype=np.float32)
+
+        with self.lock:
+            if needs_embedding:
+                similarities = self._vectors @ embedding
+                candidates = self._valid & (self._partitions == partition)
+                similarities[~candidates] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    slot = best
+            if slot is None or slot not in self._entries:
+                return None, embedding
+
+            entry = self._entries[slot]
+            if time.time() - entry["created_at"] > self.ttl_seconds or entry["catalog_version"] != catalog_version:
+                self._evict(entry["key"])
+                return None, embedding
+
+            self._slots.move_to_end(entry["key"])
+            return entry, embedding
+
+    def set(self, message: str, image: Optional[str], catalog_version: int, result: Dict, compute_time: float,
+            embedding: Optional[np.ndarray] = None):
+        """Store a response together with the time it took to produce; embedding is the one get() returned"""
+        if not self.is_cacheable(message):
+            return
+
+        normalized = normalize_message(message)
+        if embedding is None:
+            embedding = np.asarray(self.embed_fn(normalized), dtype=np.float32)
+        partition = self._partition(message, image)
+        with self.lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+
+            key = f"{partition}:{normalized}"
+            if key in self._slots:
+                self._evict(key)
+            if not self._free_slots:
+                # Evict the least recently used entry
+                self._evict(next(iter(self._slots)))
+
+            slot = self._free_slots.pop()
+            self._vectors[slot] = embedding
+            self._partitions[slot] = partition
+            self._valid[slot] = True
+            self._slots[key] = slot
+            self._entries[slot] = {
+                "key": key,
+                "result": result,
+                "compute_time": compute_time,
+                "catalog_version": catalog_version,
+                "created_at": time.time()
+            }
+
+    def clear(self):
+        with self.lock:
+            for key in list(self._slots):
+                self._evict(key)
+
+    def size(self) -> int:
+        return len(self._slots)
@@ -0,0 +1,144 @@
+from typing import Dict, List, Optional
+import numpy as np
+import re
+import logging
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Route names
+ROUTE_GREETING = "greeting"
+ROUTE_GENERAL = "general_chat"
+ROUTE_PRODUCT_SEARCH = "product_search"
+ROUTE_LLM = "llm"
+
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|hiya|howdy|yo|good (morning|afternoon|evening)|greetings)"
+    r"( there)?( commerceai)?\s*[!.?]*\s*$",
+    re.IGNORECASE
+)
+
+GENERAL_PATTERN = re.compile(
+    r"^\s*(what('| i)?s your name|who are you|what can you do|what do you do|"
+    r"how can you help( me)?|help|what are your capabilities)\s*[!.?]*\s*$",
+    re.IGNORECASE
+)
+
+SEARCH_PREFIX_PATTERN = re.compile(
+    r"^\s*(please\s+)?(show me|find me|find|search for|look for|i('m| am) looking for|"
+    r"i need|i want|do you have|get me|recommend( me)?)\s+(some\s+|a\s+|an\s+|any\s+)?",
+    re.IGNORECASE
+)
+
+# Words that tie a turn to earlier context or need reasoning; leave those to the LLM
+AMBIGUOUS_PATTERN = re.compile(
+    r"\b(it|its|that|those|these|them|this one|the (first|second|third|last) one|"
+    r"cheaper|more expensive|compare|difference|better|instead|previous|again|"
+    r"why|how much|under|over|between|return|order|shipping)\b|\$",
+    re.IGNORECASE
+)
+
+# Example utterances for the embedding classifier
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    ROUTE_GREETING: [
+        "hi", "hello there", "hey, good morning", "hello, how are you"
+    ],
+    ROUTE_GENERAL: [
+        "what is your name", "who are you", "what can you help me with",
+        "what are you able to do"
+    ],
+    ROUTE_PRODUCT_SEARCH: [
+        "red dresses", "running shoes for men", "black leather handbag",
+        "blue denim jacket", "women's summer tops", "casual sneakers",
+        "sports t-shirt", "winter jackets"
+    ],
+    ROUTE_LLM: [
+        "which of these is better for hiking", "is the second one cheaper",
+        "can you compare those two", "what goes well with the jacket you showed me",
+        "I bought something last week and want to return it"
+    ]
+}
+
+class IntentRouter:
+    """
+    Deterministic fast path in front of the LLM agent.
+
+    Regex rules catch greetings, identity questions and plain product
+    searches; anything else is scored by a nearest-prototype classifier over
+    CLIP text embeddings. Only confident, context-free turns are routed;
+    everything else goes to the agent.
+    """
+    def __init__(self, image_processor=None):
+        settings = get_settings()
+        self.image_processor = image_processor
+        self.confidence_threshold = settings.intent_router_confidence
+        self.margin = settings.intent_router_margin
+        self._prototypes: Optional[Dict[str, np.ndarray]] = None
+
+    def _get_prototypes(self) -> Dict[str, np.ndarray]:
+        """Embed the example utterances once and keep one normalized centroid per intent"""
+        if self._prototypes is None:
+            prototypes = {}
+            for intent, examples in INTENT_EXAMPLES.items():
+                embeddings = np.asarray(
+                    [self.image_processor.get_text_embedding(example) for example in examples],
+                    dtype=np.float32
+                )
+                centroid = embeddings.mean(axis=0)
+                prototypes[intent] = centroid / np.linalg.norm(centroid)
+            self._prototypes = prototypes
+        return self._prototypes
+
+    def _classify(self, message: str) -> Dict:
+        """Nearest-prototype classification on CLIP text embeddings"""
+        if self.image_processor is None:
+            return {"route": ROUTE_LLM, "confidence": 0.0, "source": "classifier"}
+
+        prototypes = self._get_prototypes()
+        embedding = np.asarray(self.image_processor.get_text_embedding(message), dtype=np.float32)
+        scores = sorted(
+            ((float(prototype @ embedding), intent) for intent, prototype in prototypes.items()),
+            reverse=True
+        )
+        (best_score, best_intent), (second_score, _) = scores[0], scores[1]
+
+        if best_score >= self.confidence_threshold and best_score - second_score >= self.margin:
+            return {"route": best_intent, "confidence": best_score, "source": "classifier"}
+        return {"route": ROUTE_LLM, "confidence": best_score, "source": "classifier"}
+
+    def extract_search_query(self, message: str) -> str:
+        """Strip conversational filler so only the product description is searched"""
+        query = SEARCH_PREFIX_PATTERN.sub("", message).strip()
+        return query.rstrip("?!. ") or message.strip()
+
+    def route(self, message: str, image: Optional[str] = None) -> Dict:
+        """Decide how a turn should be handled"""
+        text = (message or "").strip()
+
+        # Image turns and empty/long messages always go to the agent
+        if image or not text or len(text) > 200:
+            return {"route": ROUTE_LLM, "confidence": 0.0, "source": "rules"}
+
+        if GREETING_PATTERN.match(text):
+            return {"route": ROUTE_GREETING, "confidence": 1.0, "source": "rules"}
+        if GENERAL_PATTERN.match(text):
+            return {"route": ROUTE_GENERAL, "confidence": 1.0, "source": "rules"}
+        if AMBIGUOUS_PATTERN.search(text):
+            return {"route": ROUTE_LLM, "confidence": 0.0, "source": "rules"}
+        if SEARCH_PREFIX_PATTERN.match(text):
+            return {
+                "route": ROUTE_PRODUCT_SEARCH,
+                "confidence": 1.0,
+                "source": "rules",
+                "query": self.extract_search_query(text)
+            }
+
+        try:
+            decision = self._classify(text)
+        except Exception as e:
+            logger.error(f"Intent classification failed: {e}")
+            return {"route": ROUTE_LLM, "confidence": 0.0, "source": "classifier"}
+
+        if decision["route"] == ROUTE_PRODUCT_SEARCH:
+            decision["query"] = self.extract_search_query(text)
+        return decision
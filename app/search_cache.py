@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+import hashlib
+import json
+import threading
+import time
+import logging
+from app.response_cache import normalize_message
+
+logger = logging.getLogger(__name__)
+
+def _product_bytes(product: Dict) -> int:
+    """Rough in-memory size of a product dict; the base64 image dominates"""
+    return sum(len(str(key)) + len(str(value)) for key, value in product.items()) + 64
+
+class SearchResultCache:
+    """
+    Ranked, hydrated results of vector searches.
+
+    Text searches are keyed by the normalized query text (a hit also skips
+    the embedding call), image searches by the query vector quantized to
+    int8, so float noise from re-embedding the same upload mostly still
+    hits. Keys also cover the filters and n_results. Entries are evicted least-recently
+    used when either the entry or the byte budget is exceeded, and are
+    dropped when the catalog version they were computed against changes.
+    """
+    def __init__(self, max_entries: int = 2000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()  # key -> entry, in LRU order
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def text_key(query: str, n_results: int, filters: Optional[Dict] = None) -> str:
+        return f"text:{n_results}:{json.dumps(filters or {}, sort_keys=True)}:{normalize_message(query)}"
+
+    @staticmethod
+    def vector_key(embedding: List[float], n_results: int, filters: Optional[Dict] = None) -> str:
+        codes = np.clip(np.round(np.asarray(embedding, dtype=np.float32) * 127), -127, 127).astype(np.int8)
+        return f"image:{n_results}:{json.dumps(filters or {}, sort_keys=True)}:{hashlib.md5(codes.tobytes()).hexdigest()}"
+
+    def _evict(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["bytes"]
+
+    def get(self, key: str, catalog_version: int) -> Optional[Dict]:
+        """The cached entry for key, if it is still current ({"products", "compute_time", ...})"""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["catalog_version"] != catalog_version:
+                self._evict(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def products(self, entry: Dict) -> List[Dict]:
+        """Copies of a cached entry's products, so callers can annotate them freely"""
+        return [dict(product) for product in entry["products"]]
+
+    def set(self, key: str, catalog_version: int, products: List[Dict], compute_time: float):
+        """Store the ranked products of one search and the time it took"""
+        size = sum(_product_bytes(product) for product in products) + len(key)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self._entries:
+                self._evict(key)
+            while self._entries and (len(self._entries) >= self.max_entries or self._bytes + size > self.max_bytes):
+                self._evict(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = {
+                "products": [dict(product) for product in products],
+                "catalog_version": catalog_version,
+                "compute_time": compute_time,
+                "bytes": size,
+                "created_at": time.time()
+            }
+            self._bytes += size
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "evictions": self.evictions
+            }
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+import threading
+import logging
+from langchain_core.memory import BaseMemory
+
+logger = logging.getLogger(__name__)
+
+class _Session:
+    __slots__ = ("memory", "lock")
+
+    def __init__(self, memory: BaseMemory):
+        self.memory = memory
+        self.lock = threading.Lock()
+
+class SessionMemoryStore:
+    """
+    One conversation memory per session.
+
+    Chat turns run on several request threads at once, so a single shared
+    memory would interleave different sessions' histories. Each session
+    also has a lock held for its whole turn, so turns of the same session
+    run one after another and each sees the history of the one before.
+    The least recently used sessions are dropped beyond max_sessions.
+    """
+    def __init__(self, factory: Callable[[], BaseMemory], max_sessions: int = 1000):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+
+    def _get(self, session_id: str) -> _Session:
+        with self.lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.factory())
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    @contextmanager
+    def turn(self, session_id: Optional[str]) -> Iterator[BaseMemory]:
+        """The session's memory, held exclusively for one turn"""
+        if not session_id:
+            # No session to continue: a throwaway memory
+            yield self.factory()
+            return
+        session = self._get(session_id)
+        with session.lock:
+            yield session.memory
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._sessions)
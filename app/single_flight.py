@@ -0,0 +1,69 @@
+from typing import Any, Callable, Dict, Hashable, Optional
+import threading
+import logging
+from app.monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs
+    the function, callers arriving while it is in flight wait for it and
+    get the same result (or exception). Nothing is kept once the call
+    finishes, so this complements caches rather than replacing them; it
+    covers the burst before the first result is cached.
+
+    `share` copies the result for every caller (the leader included, so
+    nobody annotates the copy another caller is about to take), for results
+    callers mutate.
+    """
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, share: Optional[Callable[[Any], Any]] = None, **kwargs):
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        metrics.record_single_flight(self.name, coalesced=not leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return share(call.result) if share else call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return share(call.result) if share else call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.debug(f"{self.name}: {call.waiters} identical calls shared one result")
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,142 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Speculation:
+    """
+    Searches started on one turn's raw input, while the LLM plans.
+
+    The text search runs on the user's message and is reused by a
+    search_products call whose query is close enough to that message (CLIP
+    text similarity). The image search runs on the uploaded image and is
+    reused by any search_by_image call for the same image. Each reuse
+    records a hit or miss and the latency it saved: how long the search
+    took minus how long the tool still spent on it (waiting for it to
+    finish, and comparing the query with the message).
+    """
+    def __init__(self, engine: "SpeculativeRetrieval", message: str, image: Optional[str]):
+        self.engine = engine
+        self.message = message
+        self.image = image
+        self.used = {"text": False, "image": False}
+        self.message_embedding: Optional[Future] = None
+        self.text: Optional[Future] = None
+        self.image_search: Optional[Future] = None
+
+    def _timed(self, search: Callable, *args) -> Tuple[List[Dict], float]:
+        start_time = time.perf_counter()
+        products = search(*args)
+        return products, time.perf_counter() - start_time
+
+    def start(self, text_search: Optional[Callable[[str], List[Dict]]],
+              image_search: Optional[Callable[[str], List[Dict]]]) -> "Speculation":
+        submit = self.engine.submit
+        if text_search and self.message:
+            self.message_embedding = submit(self.engine.embed_fn, self.message)
+            self.text = submit(self._timed, text_search, self.message)
+        if image_search and self.image:
+            self.image_search = submit(self._timed, image_search, self.image)
+        return self
+
+    def _take(self, kind: str, future: Future, overhead: float = 0.0) -> Optional[List[Dict]]:
+        wait_start = time.perf_counter()
+        try:
+            products, search_time = future.result()
+        except Exception as e:
+            logger.warning(f"Speculative {kind} search failed: {e}")
+            self.engine.record(kind, hit=False)
+            return None
+        waited = time.perf_counter() - wait_start
+        self.used[kind] = True
+        self.engine.record(kind, hit=True, time_saved=search_time - waited - overhead)
+        # Copies, so each caller can annotate its own
+        return [dict(product) for product in products]
+
+    def take_text(self, query: str) -> Optional[List[Dict]]:
+        """The speculative text results, if query means the same as the message"""
+        if self.text is None:
+            return None
+        compare_start = time.perf_counter()
+        try:
+            message_embedding = np.asarray(self.message_embedding.result(), dtype=np.float32)
+            query_embedding = np.asarray(self.engine.embed_fn(query), dtype=np.float32)
+            similarity = float(message_embedding @ query_embedding)
+        except Exception as e:
+            logger.warning(f"Could not compare the search query with the message: {e}")
+            similarity = -1.0
+        if similarity < self.engine.similarity_threshold:
+            self.engine.record("text", hit=False)
+            return None
+        return self._take("text", self.text, overhead=time.perf_counter() - compare_start)
+
+    def take_image(self, image: str) -> Optional[List[Dict]]:
+        """The speculative image results, if they are for this image"""
+        if self.image_search is None or image != self.image:
+            return None
+        return self._take("image", self.image_search)
+
+    def finish(self):
+        """Count the searches no tool call used"""
+        for kind, future in (("text", self.text), ("image", self.image_search)):
+            if future is not None and not self.used[kind]:
+                future.cancel()
+                self.engine.record_unused(kind)
+
+class SpeculativeRetrieval:
+    """Runs speculative searches on a small thread pool, and keeps their statistics"""
+    def __init__(self, embed_fn: Callable[[str], List[float]], similarity_threshold: float = 0.9,
+                 max_workers: int = 4):
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self.lock = threading.Lock()
+        self.stats = {kind: {"started": 0, "hits": 0, "misses": 0, "unused": 0, "time_saved": 0.0}
+                      for kind in ("text", "image")}
+
+    def submit(self, fn: Callable, *args) -> Future:
+        # Keep the turn's trace context in the worker thread
+        return self.executor.submit(copy_context().run, fn, *args)
+
+    def start(self, message: str, image: Optional[str], text_search: Optional[Callable] = None,
+              image_search: Optional[Callable] = None) -> Speculation:
+        speculation = Speculation(self, message, image).start(text_search, image_search)
+        with self.lock:
+            if speculation.text is not None:
+                self.stats["text"]["started"] += 1
+            if speculation.image_search is not None:
+                self.stats["image"]["started"] += 1
+        return speculation
+
+    def record(self, kind: str, hit: bool, time_saved: float = 0.0):
+        with self.lock:
+            stats = self.stats[kind]
+            if hit:
+                stats["hits"] += 1
+                stats["time_saved"] += max(time_saved, 0.0)
+            else:
+                stats["misses"] += 1
+
+    def record_unused(self, kind: str):
+        with self.lock:
+            self.stats[kind]["unused"] += 1
+
+    def get_stats(self) -> Dict:
+        with self.lock:
+            return {
+                kind: {
+                    **{key: value for key, value in stats.items() if key != "time_saved"},
+                    "hit_rate": round(stats["hits"] / (stats["hits"] + stats["misses"]), 3) if stats["hits"] + stats["misses"] else 0,
+                    "time_saved": round(stats["time_saved"], 3),
+                    "average_time_saved": round(stats["time_saved"] / stats["hits"], 4) if stats["hits"] else 0
+                }
+                for kind, stats in self.stats.items()
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
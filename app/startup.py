@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StartupState:
+    """
+    Tracks background warmup of the heavyweight components (CLIP, dataset,
+    vector store, agent) so the API can answer /health while they load and
+    flip /ready once they are done.
+    """
+    def __init__(self):
+        self.status = "starting"  # starting, warming, ready, failed
+        self.current_component: Optional[str] = None
+        self.failed_component: Optional[str] = None
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @contextmanager
+    def component(self, name: str):
+        """Time the initialization of one component"""
+        self.current_component = name
+        start_time = time.time()
+        try:
+            yield
+        except Exception:
+            # Recorded before current_component is reset below
+            self.failed_component = name
+            raise
+        else:
+            logger.info(f"Startup: {name} initialized in {time.time() - start_time:.2f}s")
+        finally:
+            self.timings[name] = round(time.time() - start_time, 3)
+            self.current_component = None
+
+    def run(self, steps: List[Tuple[str, Callable[[], None]]]):
+        """Run warmup steps in order; a failing step marks startup as failed"""
+        self.status = "warming"
+        try:
+            for name, step in steps:
+                with self.component(name):
+                    step()
+            self.ready_at = time.time()
+            self.status = "ready"
+            logger.info(f"Startup complete in {self.ready_at - self.started_at:.2f}s")
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Startup failed during {self.failed_component}: {e}")
+
+    def start_background(self, steps: List[Tuple[str, Callable[[], None]]]) -> threading.Thread:
+        """Run warmup on a daemon thread so the server can start answering immediately"""
+        self._thread = threading.Thread(target=self.run, args=(steps,), name="warmup", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def get_status(self) -> Dict:
+        return {
+            "status": self.status,
+            "ready": self.ready,
+            "pid": os.getpid(),  # identifies the worker when pre-forked
+            "current_component": self.current_component,
+            "failed_component": self.failed_component,
+            "error": self.error,
+            "component_timings": dict(self.timings),
+            "startup_time": round((self.ready_at or time.time()) - self.started_at, 3)
+        }
+
+# Global startup state
+startup_state = StartupState()
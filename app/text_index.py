@@ -0,0 +1,46 @@
+from typing import List, Optional, Tuple
+import logging
+from app.vector_snapshot import VectorSnapshot
+from app.quantization import QuantizedMatrix, search_matrix
+
+logger = logging.getLogger(__name__)
+
+class TextVectorIndex(VectorSnapshot):
+    """
+    In-process index over the text collection's embeddings, used instead of
+    Chroma's HNSW when a quantized text mode is configured.
+
+    The float32 matrix stays on disk (mmap'd); queries scan the compressed
+    codes and rescore the top candidates exactly, so the memory that stays
+    hot is the codes (2x smaller for float16, 4x for int8).
+    """
+    def __init__(self, ids: List[str], vectors, quantized: Optional[QuantizedMatrix] = None,
+                 rescore_candidates: int = 100):
+        super().__init__(ids, vectors)
+        self.quantized = quantized
+        self.rescore_candidates = rescore_candidates
+
+    @classmethod
+    def build(cls, text_collection, path: str, mode: str, rescore_candidates: int = 100) -> "TextVectorIndex":
+        """Export the text vectors to path and quantize them"""
+        index = cls.export(text_collection, path)
+        QuantizedMatrix.fit(index.vectors, mode).save(path)
+        return cls.open(path, mode, rescore_candidates)
+
+    @classmethod
+    def open(cls, path: str, mode: str, rescore_candidates: int = 100) -> Optional["TextVectorIndex"]:
+        """Open an index built in `mode`, or None if there isn't one"""
+        index = cls.load(path)
+        if index is None:
+            return None
+        index.quantized = QuantizedMatrix.load(path, mode)
+        if index.quantized is None or index.quantized.rows != len(index):
+            return None
+        index.rescore_candidates = rescore_candidates
+        return index
+
+    def search(self, embedding: List[float], n_results: int) -> List[Tuple[str, float]]:
+        """Top n_results (product id, cosine similarity), best first"""
+        rows, scores, _ = search_matrix(self.vectors, embedding, n_results, quantized=self.quantized,
+                                        rescore_candidates=self.rescore_candidates)
+        return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
@@ -1,17 +1,110 @@
 from langchain.tools import Tool
 from typing import Optional, List, Dict
-from app.vector_store import ProductVectorStore
-from app.image_processor import ImageProcessor
+from app.utils import format_product_handles
+from app.color_index import find_color_name
+from app.tracing import traced
+from contextvars import ContextVar
+import re
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Initialize components
-vector_store = ProductVectorStore()
-image_processor = ImageProcessor()
+# Components are built by the startup warmup (see init_image_processor / init_vector_store)
+# so that importing this module doesn't load torch, CLIP or the dataset
+vector_store = None
+image_processor = None
+# Set by the pre-fork master (app/prefork.py) once it has synced the catalog
+image_snapshot = None
+color_index = None
+catalog_preloaded = False
+
+def init_image_processor():
+    """Load the CLIP model shared by the tools and the vector store"""
+    global image_processor
+    if image_processor is None:
+        from app.image_processor import ImageProcessor
+        image_processor = ImageProcessor()
+    return image_processor
+
+def init_vector_store():
+    """Load the dataset and open the vector store"""
+    global vector_store
+    if vector_store is None:
+        from app.vector_store import ProductVectorStore
+        # Workers of a pre-fork master open the catalog it already synced
+        vector_store = ProductVectorStore(image_processor=init_image_processor(), image_snapshot=image_snapshot,
+                                          color_index=color_index,
+                                          sync_on_startup=False if catalog_preloaded else None)
+    return vector_store
+
+def init_inference_pool():
+    """Start the CLIP/JPEG process pool if one is configured"""
+    from app.config import get_settings
+    from app.inference_pool import start_inference_pool
+    settings = get_settings()
+    if settings.inference_pool_size > 0:
+        try:
+            start_inference_pool(settings.inference_pool_size, settings.inference_pool_queue_depth,
+                                 settings.inference_pool_torch_threads)
+        except Exception as e:
+            logger.error(f"Could not start inference pool, running image work in-process: {e}")
+
+class TurnStore:
+    """
+    Dict-like state for the chat turn being handled. Values live in a ContextVar,
+    so concurrent turns on different threads don't see each other's data.
+    """
+    def __init__(self, name: str, **defaults):
+        self._values: ContextVar[Optional[Dict]] = ContextVar(name, default=None)
+        self._defaults = defaults
+
+    def _get(self) -> Dict:
+        values = self._values.get()
+        if values is None:
+            values = dict(self._defaults)
+            self._values.set(values)
+        return values
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __setitem__(self, key, value):
+        self._get()[key] = value
 
 # Store for current image (will be set by the agent)
-current_image_store = {"image": None}
+current_image_store = TurnStore("current_image", image=None)
+
+# Full product records from the last agent step's search tool calls (read back by the agent)
+current_products_store = TurnStore("current_products", products=None, source=None, step=0, products_step=None)
+
+# Searches started speculatively for this turn, while the LLM plans (see app/speculation.py)
+current_speculation_store = TurnStore("speculation", speculation=None)
+
+# Tools of one agent step run concurrently and may store products at the same time
+_products_lock = threading.Lock()
+
+def start_tool_step():
+    """Mark the start of a new agent step (a round of tool calls) in this turn"""
+    current_products_store["step"] += 1
+
+def store_products(products: List[Dict], source: str):
+    """
+    Keep a search tool's full product records for the API response. Tools
+    called in the same agent step add to each other's results (duplicates
+    dropped); a later step replaces them.
+    """
+    with _products_lock:
+        step = current_products_store["step"]
+        existing = current_products_store["products"]
+        if existing and current_products_store["products_step"] == step:
+            seen = {product.get('id') for product in existing}
+            products = existing + [product for product in products if product.get('id') not in seen]
+            if current_products_store["source"] != source:
+                source = "multiple"
+        current_products_store["products"] = products
+        current_products_store["source"] = source
+        current_products_store["products_step"] = step
 
 def load_sample_products():
     """Load sample products into vector store"""
@@ -80,7 +173,11 @@ def load_sample_products():
         except Exception as inner_e:
             logger.error(f"Failed to load products: {inner_e}")
 
+# Image search queries that ask for a color match
+COLOR_QUERY_PATTERN = re.compile(r"\b(colou?rs?|shades?)\b", re.IGNORECASE)
+
 # Tool functions
+@traced("tool.general_chat")
 def general_chat(query: str) -> str:
     """Handle general conversation that doesn't require product search"""
     responses = {
@@ -103,33 +200,51 @@ def general_chat(query: str) -> str:
     
     return "I'm here to help you with your shopping needs. Feel free to ask me about products or upload an image to find similar items!"
 
+# Image search candidates fetched when results get reranked by color
+COLOR_RERANK_CANDIDATES = 20
+
+def speculative_text_search(message: str) -> List[Dict]:
+    """What search_products would return if the LLM searched for the message itself"""
+    return find_products(message, n_results=5)
+
+def speculative_image_search(image: str) -> List[Dict]:
+    """Enough image search candidates for search_by_image, with or without color reranking"""
+    return vector_store.search_by_image_embedding(image_processor.get_image_embedding(image),
+                                                  n_results=COLOR_RERANK_CANDIDATES)
+
+def find_products(query: str, n_results: int = 5) -> List[Dict]:
+    """Run a text search, falling back to a plain dataset scan"""
+    products = vector_store.search_products(query, n_results=n_results)
+    
+    if not products:
+        # Try searching directly in dataset
+        products = vector_store.dataset_loader.search_products(query, limit=n_results)
+        products = [vector_store.dataset_loader.get_product_with_base64_image(p) for p in products]
+    
+    return products
+
+@traced("tool.search_products")
 def search_products(query: str) -> str:
     """Search for products based on text description"""
     try:
-        products = vector_store.search_products(query, n_results=5)
-        
-        if not products:
-            # Try searching directly in dataset
-            products = vector_store.dataset_loader.search_products(query, limit=5)
-            products = [vector_store.dataset_loader.get_product_with_base64_image(p) for p in products]
+        # Reuse the search started on the user's message if the query means the same
+        speculation = current_speculation_store["speculation"]
+        products = speculation.take_text(query) if speculation else None
+        if products is None:
+            products = find_products(query, n_results=5)
         
         if not products:
             return f"I couldn't find any products matching '{query}'. Try different keywords or browse our categories."
         
-        response = f"I found {len(products)} products for '{query}':\n\n"
-        for i, product in enumerate(products, 1):
-            response += f"{i}. **{product['name']}**\n"
-            response += f"   Brand: {product.get('brand', 'Unknown')}\n"
-            response += f"   Price: ${product['price']}\n"
-            response += f"   Color: {product.get('color', 'N/A')}\n"
-            response += f"   Category: {product.get('category', 'N/A')}\n"
-            response += f"   {product['description']}\n\n"
+        # Full records go to the API response; the LLM only sees compact handles
+        store_products(products, "search_products")
         
-        return response
+        return format_product_handles(f"Found {len(products)} products for '{query}'", products, key_attribute="color")
     except Exception as e:
         logger.error(f"Error searching products: {e}")
         return "I encountered an error while searching. Please try again."
 
+@traced("tool.search_by_image")
 def search_by_image(query: str) -> str:
     """Search for products similar to the provided image"""
     # Check if we have a current image
@@ -140,53 +255,102 @@ def search_by_image(query: str) -> str:
         # Log what query we received
         logger.info(f"search_by_image called with query: '{query}'")
         
-        # Get image embedding
-        image_embedding = image_processor.get_image_embedding(current_image_store["image"])
+        # Color requests ("in red", "same color") rerank a wider candidate set by color descriptor
+        color_name = find_color_name(query)
+        match_color = color_name is not None or COLOR_QUERY_PATTERN.search(query) is not None
         
-        # Search for similar products
-        products = vector_store.search_by_image_embedding(image_embedding, n_results=5)
+        # Search for similar products (already running if the turn started a speculative image search)
+        speculation = current_speculation_store["speculation"]
+        products = speculation.take_image(current_image_store["image"]) if speculation else None
+        if products is None:
+            image_embedding = image_processor.get_image_embedding(current_image_store["image"])
+            products = vector_store.search_by_image_embedding(
+                image_embedding, n_results=COLOR_RERANK_CANDIDATES if match_color else 5)
+        elif not match_color:
+            products = products[:5]
+        if match_color:
+            products = vector_store.rerank_by_color(
+                products, n_results=5,
+                image_base64=None if color_name else current_image_store["image"],
+                color_name=color_name,
+                # Cached by now; lets a named color pull in matching products the candidates lack
+                image_embedding=image_processor.get_image_embedding(current_image_store["image"]) if color_name else None
+            )
         
         if not products:
             return "I couldn't find products similar to your image. Try uploading a different image."
         
-        # Build response based on the query context
-        if "shirt" in query.lower():
-            response = "Based on your image, here are similar shirts:\n\n"
-        elif "shoe" in query.lower() or "footwear" in query.lower():
-            response = "Based on your image, here are similar footwear options:\n\n"
-        elif "jacket" in query.lower():
-            response = "Based on your image, here are similar jackets:\n\n"
-        else:
-            response = "Based on your image, here are similar products:\n\n"
+        store_products(products, "search_by_image")
         
-        for i, product in enumerate(products, 1):
-            response += f"{i}. **{product['name']}**\n"
-            response += f"   Price: ${product['price']}\n"
-            response += f"   {product['description']}\n"
-            if product.get('similarity_score'):
-                response += f"   Similarity: {product['similarity_score']*100:.1f}%\n"
-            response += "\n"
+        response = format_product_handles(
+            f"Found {len(products)} products similar to the uploaded image",
+            products,
+            key_attribute="similarity_score"
+        )
         
         # Add contextual information
-        if products[0].get('category'):
-            categories = set(p.get('category') for p in products if p.get('category'))
-            if categories:
-                response += f"\nThese products are from: {', '.join(categories)}"
+        categories = set(p.get('category') for p in products if p.get('category'))
+        if categories:
+            response += f"\nCategories: {', '.join(categories)}"
         
-        # Add context from the query if relevant
-        if "color" in query.lower():
-            response += "\n\nNote: Color matching is based on the overall appearance of the uploaded image."
-        elif "style" in query.lower():
-            response += "\n\nNote: I've found products with similar style and design elements."
+        # Say how color was taken into account
+        if color_name:
+            response += f"\nRanked by how much {color_name} each product shows."
+        elif match_color:
+            response += "\nRanked by color match with the uploaded image."
         
         return response
     except Exception as e:
         logger.error(f"Error processing image: {e}")
         return "I had trouble processing your image. Please make sure it's a valid image file and try again."
 
+# Product IDs as shown in the product handles, e.g. [prod_15970]
+PRODUCT_ID_PATTERN = re.compile(r"prod_\w+")
+
+@traced("tool.find_similar_products")
+def find_similar_products(query: str) -> str:
+    """Find products similar to a catalog product, by looks or by description"""
+    try:
+        match = PRODUCT_ID_PATTERN.search(query)
+        if match:
+            product_id = match.group(0)
+        else:
+            # No ID given: resolve the product by name with a text search
+            candidates = find_products(query, n_results=1)
+            if not candidates:
+                return f"I couldn't find a product matching '{query}'."
+            product_id = candidates[0]['id']
+        
+        kind = "text" if re.search(r"\b(text|description|described)\b", query.lower()) else "visual"
+        result = vector_store.get_similar_products(product_id, kind=kind, n_results=5)
+        if result is None:
+            return f"I couldn't find product {product_id} in the catalog."
+        products, _ = result
+        if not products:
+            return f"I don't have similar products for {product_id} yet."
+        
+        store_products(products, "find_similar_products")
+        
+        basis = "look" if kind == "visual" else "description"
+        return format_product_handles(
+            f"Found {len(products)} products with a similar {basis} to {product_id}",
+            products,
+            key_attribute="similarity_score"
+        )
+    except Exception as e:
+        logger.error(f"Error finding similar products: {e}")
+        return "I encountered an error while looking for similar products. Please try again."
+
+# Search tools whose results can end the turn as they are
+DIRECT_RETURN_TOOLS = ("search_products", "search_by_image")
+
 # Create tools list
-def create_tools():
-    """Create and return the list of tools"""
+def create_tools(direct_return: bool = False):
+    """
+    Create and return the list of tools. With direct_return, a step that
+    only calls one of DIRECT_RETURN_TOOLS ends the turn with its results,
+    without another LLM call.
+    """
     return [
         Tool(
             name="general_chat",
@@ -196,18 +360,18 @@ def create_tools():
         Tool(
             name="search_products",
             func=search_products,
-            description="Use this to search for products based on text descriptions. Use when users ask for specific products, categories, or features."
+            description="Use this to search for products based on text descriptions. Use when users ask for specific products, categories, or features.",
+            return_direct=direct_return
         ),
         Tool(
             name="search_by_image",
             func=search_by_image,
-            description="Use this to find products similar to an uploaded image. The query should describe what aspect of the image to focus on (e.g., 'similar shirts', 'same style', 'matching color'). Only use when the user has uploaded an image."
+            description="Use this to find products similar to an uploaded image. The query should describe what aspect of the image to focus on (e.g., 'similar shirts', 'same style', 'matching color'). Only use when the user has uploaded an image.",
+            return_direct=direct_return
+        ),
+        Tool(
+            name="find_similar_products",
+            func=find_similar_products,
+            description="Use this to find products similar to one already shown, e.g. 'more like this' or 'something similar to the second one'. Pass the product ID from the earlier results (e.g. 'prod_15970'); add 'description' to match on description instead of appearance."
         )
-    ]
-
-# Initialize products on module load
-try:
-    load_sample_products()
-except Exception as e:
-    logger.error(f"Error during initial product load: {e}")
-    print(f"Warning: Could not load sample products: {e}")
\ No newline at end of file
+    ]
\ No newline at end of file
@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Sequence
+from uuid import UUID
+import functools
+import threading
+import time
+import logging
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider, ReadableSpan
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+)
+from langchain_core.callbacks import BaseCallbackHandler
+from app.config import get_settings
+from app.monitoring import metrics
+from app.agent_runtime import STAGE_TAG_PREFIX
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer("ai-commerce-agent")
+
+# Stage durations for the current request, rendered into the Server-Timing header
+_server_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar("server_timings", default=None)
+
+class OTLPFileSpanExporter(SpanExporter):
+    """Append spans to a file as OTLP/JSON, one export request per line"""
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+        from google.protobuf.json_format import MessageToJson
+        try:
+            line = MessageToJson(encode_spans(spans), indent=None)
+            with self.lock, open(self.path, "a") as f:
+                f.write(line + "\n")
+            return SpanExportResult.SUCCESS
+        except Exception as e:
+            logger.error(f"Error exporting spans to {self.path}: {e}")
+            return SpanExportResult.FAILURE
+
+    def shutdown(self):
+        pass
+
+def setup_tracing():
+    """Install the tracer provider and exporter selected in settings"""
+    settings = get_settings()
+    if settings.tracing_exporter == "none":
+        return
+
+    provider = TracerProvider(resource=Resource.create({"service.name": settings.app_name}))
+    if settings.tracing_exporter == "console":
+        exporter = ConsoleSpanExporter()
+    elif settings.tracing_exporter == "otlp_file":
+        exporter = OTLPFileSpanExporter(settings.tracing_file_path)
+    else:
+        logger.error(f"Unknown tracing exporter '{settings.tracing_exporter}', tracing disabled")
+        return
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing enabled with {settings.tracing_exporter} exporter")
+
+def start_server_timing():
+    """Begin collecting stage durations for a request"""
+    return _server_timings.set({})
+
+def reset_server_timing(token):
+    _server_timings.reset(token)
+
+def record_server_timing(stage: str, duration: float):
+    """Add a stage duration to the current request, if one is being timed"""
+    timings = _server_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(stage, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+
+def get_server_timing_header(total: Optional[float] = None) -> str:
+    """Render the collected stage durations as a Server-Timing header value"""
+    timings = _server_timings.get() or {}
+    parts = []
+    for stage, (count, duration) in timings.items():
+        part = f"{stage};dur={duration * 1000:.1f}"
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+@contextmanager
+def stage_span(name: str, **attributes):
+    """Trace a stage as a span and add its duration to the Server-Timing header"""
+    start_time = time.perf_counter()
+    with tracer.start_as_current_span(name, attributes=attributes) as span:
+        try:
+            yield span
+        finally:
+            record_server_timing(name, time.perf_counter() - start_time)
+
+def traced(name: str):
+    """Decorator form of stage_span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class LLMTracingCallbackHandler(BaseCallbackHandler):
+    """
+    Open a span for every LLM call the agent makes. Calls tagged with an
+    agent stage ("agent_stage:plan") are timed per stage, as llm.<stage>.
+    """
+    run_inline = True
+
+    def __init__(self):
+        self.spans: Dict[UUID, Any] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any) -> None:
+        model = (kwargs.get("invocation_params") or {}).get("model_name") or (kwargs.get("invocation_params") or {}).get("model", "")
+        stage = next((tag[len(STAGE_TAG_PREFIX):] for tag in kwargs.get("tags") or [] if tag.startswith(STAGE_TAG_PREFIX)), None)
+        name = f"llm.{stage}" if stage else "llm"
+        span = tracer.start_span(name, attributes={"llm.model": str(model), "llm.stage": stage or ""})
+        self.spans[run_id] = (span, name, time.perf_counter())
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None):
+        span, name, start_time = self.spans.pop(run_id, (None, None, None))
+        if span is None:
+            return
+        if error is not None:
+            span.record_exception(error)
+        span.end()
+        duration = time.perf_counter() - start_time
+        record_server_timing(name, duration)
+        if name != "llm":
+            metrics.record_stage_time(name, duration)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id, error)
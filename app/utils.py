@@ -4,6 +4,9 @@ from typing import Optional
 import logging
 from datetime import datetime
 import re
+import time
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Tuple
 
 # Configure logging
@@ -52,46 +55,227 @@ def format_product_response(products: list) -> str:
     
     return response
 
+def format_product_results(query: str, products: List[Dict]) -> str:
+    """
+    Format text search results as a full markdown listing for the user
+    """
+    if not products:
+        return f"I couldn't find any products matching '{query}'. Try different keywords or browse our categories."
+    
+    response = f"I found {len(products)} products for '{query}':\n\n"
+    for i, product in enumerate(products, 1):
+        response += f"{i}. **{product['name']}**\n"
+        response += f"   Brand: {product.get('brand', 'Unknown')}\n"
+        response += f"   Price: ${product['price']}\n"
+        response += f"   Color: {product.get('color', 'N/A')}\n"
+        response += f"   Category: {product.get('category', 'N/A')}\n"
+        response += f"   {product['description']}\n\n"
+    
+    return response
+
+def format_image_results(products: List[Dict]) -> str:
+    """
+    Format image search results as a full markdown listing for the user
+    """
+    if not products:
+        return "I couldn't find products similar to your image. Try uploading a different image."
+    
+    response = f"I found {len(products)} products similar to your image:\n\n"
+    for i, product in enumerate(products, 1):
+        response += f"{i}. **{product['name']}**"
+        if product.get('similarity_score') is not None:
+            response += f" ({float(product['similarity_score']) * 100:.0f}% match)"
+        response += "\n"
+        response += f"   Brand: {product.get('brand', 'Unknown')}\n"
+        response += f"   Price: ${product['price']}\n"
+        response += f"   Color: {product.get('color', 'N/A')}\n"
+        response += f"   Category: {product.get('category', 'N/A')}\n\n"
+    
+    return response
+
+def format_product_handles(header: str, products: List[Dict], key_attribute: str = "color") -> str:
+    """
+    Format products as compact one-line handles for the LLM.
+    The full records are returned to the client separately, so only
+    ID, name, price and one distinguishing attribute are included.
+    """
+    lines = [f"{header} (shown to the user as product cards):"]
+    for product in products:
+        line = f"[{product.get('id', 'unknown')}] {product.get('name', 'Unknown')} | ${float(product.get('price', 0)):.2f}"
+        value = product.get(key_attribute)
+        if value is not None:
+            if key_attribute == "similarity_score":
+                value = f"{float(value) * 100:.0f}% match"
+            line += f" | {value}"
+        lines.append(line)
+    return "\n".join(lines)
+
 def log_api_request(endpoint: str, method: str, client_id: Optional[str] = None):
     """
     Log API requests for monitoring
     """
     logger.info(f"{datetime.now()} - {method} {endpoint} - Client: {client_id or 'Anonymous'}")
 
+class InMemoryRateLimitBackend:
+    """
+    Sliding-window counters kept in process memory.
+
+    State is split across shards (each with its own lock) so concurrent
+    requests for different clients rarely contend. Every key holds two
+    fixed-window counters; entries that have been idle for two windows are
+    swept a few at a time on the way in, oldest first.
+    """
+    def __init__(self, shards: int = 16, sweep_batch: int = 8):
+        self.shards = [OrderedDict() for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+        self.sweep_batch = sweep_batch
+    
+    def _sweep(self, shard: OrderedDict, now: float):
+        """Drop up to sweep_batch idle entries from the least recently used end"""
+        for _ in range(self.sweep_batch):
+            if not shard:
+                return
+            key, state = next(iter(shard.items()))
+            if now - state[3] < 2 * state[4]:
+                return
+            del shard[key]
+    
+    def _state(self, shard: OrderedDict, key: str, window_seconds: float, now: float) -> list:
+        """The key's counters, rolled forward to the current window"""
+        window = int(now // window_seconds)
+        # [window id, current count, previous count, last seen, window length]
+        state = shard.get(key)
+        if state is None:
+            state = [window, 0, 0, now, window_seconds]
+            shard[key] = state
+        elif state[0] != window:
+            state[2] = state[1] if state[0] == window - 1 else 0
+            state[1] = 0
+            state[0] = window
+        state[3] = now
+        shard.move_to_end(key)
+        return state
+    
+    def acquire(self, key: str, limit: int, window_seconds: float, now: float) -> bool:
+        return self.acquire_all([(key, limit, window_seconds)], now)
+    
+    def acquire_all(self, limits: List[Tuple[str, int, float]], now: float) -> bool:
+        """Count one request against every (key, limit, window) only if none of them is exhausted"""
+        indices = sorted({hash(key) % len(self.shards) for key, _, _ in limits})
+        # Shard locks are taken in index order, so concurrent calls can't deadlock
+        for index in indices:
+            self.locks[index].acquire()
+        try:
+            for index in indices:
+                self._sweep(self.shards[index], now)
+            states = []
+            for key, limit, window_seconds in limits:
+                state = self._state(self.shards[hash(key) % len(self.shards)], key, window_seconds, now)
+                # Weight the previous window by how much of it still overlaps the sliding window
+                overlap = 1 - (now % window_seconds) / window_seconds
+                if state[2] * overlap + state[1] >= limit:
+                    return False
+                states.append(state)
+            for state in states:
+                state[1] += 1
+            return True
+        finally:
+            for index in reversed(indices):
+                self.locks[index].release()
+    
+    def size(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+class RedisRateLimitBackend:
+    """
+    Sliding-window counters in Redis, shared by all workers.
+    Requires the optional `redis` package.
+    """
+    # KEYS: current and previous window counter per limit; ARGV: overlap, limit and TTL per limit.
+    # Every limit is checked before any counter is incremented.
+    SCRIPT = """
+    for i = 1, #KEYS, 2 do
+        local current = tonumber(redis.call('GET', KEYS[i]) or '0')
+        local previous = tonumber(redis.call('GET', KEYS[i + 1]) or '0')
+        local arg = (i - 1) / 2 * 3
+        if previous * tonumber(ARGV[arg + 1]) + current >= tonumber(ARGV[arg + 2]) then
+            return 0
+        end
+    end
+    for i = 1, #KEYS, 2 do
+        redis.call('INCR', KEYS[i])
+        redis.call('EXPIRE', KEYS[i], ARGV[(i - 1) / 2 * 3 + 3])
+    end
+    return 1
+    """
+    
+    def __init__(self, url: str, prefix: str = "ratelimit"):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.acquire_script = self.client.register_script(self.SCRIPT)
+    
+    def acquire(self, key: str, limit: int, window_seconds: float, now: float) -> bool:
+        return self.acquire_all([(key, limit, window_seconds)], now)
+    
+    def acquire_all(self, limits: List[Tuple[str, int, float]], now: float) -> bool:
+        """Count one request against every (key, limit, window) only if none of them is exhausted, atomically"""
+        keys, args = [], []
+        for key, limit, window_seconds in limits:
+            window = int(now // window_seconds)
+            overlap = 1 - (now % window_seconds) / window_seconds
+            keys += [f"{self.prefix}:{key}:{window}", f"{self.prefix}:{key}:{window - 1}"]
+            args += [overlap, limit, int(2 * window_seconds)]
+        return bool(self.acquire_script(keys=keys, args=args))
+
 class RateLimiter:
     """
-    Simple rate limiter for API endpoints
+    Sliding-window-counter rate limiter for API endpoints.
+    Each check is O(1) regardless of how many clients are tracked.
+    Route limits apply on top of the global per-client limit, matched by path prefix.
     """
-    def __init__(self, max_requests: int = 100, window_seconds: int = 60):
+    def __init__(self, max_requests: int = 100, window_seconds: int = 60,
+                 route_limits: Optional[Dict[str, Tuple[int, int]]] = None, backend=None):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self.requests = {}
+        self.route_limits = sorted(
+            ((prefix, int(limit[0]), int(limit[1])) for prefix, limit in (route_limits or {}).items()),
+            key=lambda item: len(item[0]),
+            reverse=True
+        )
+        self.backend = backend or InMemoryRateLimitBackend()
     
-    def is_allowed(self, client_id: str) -> bool:
-        now = datetime.now()
-        
-        # Clean old entries
-        self.requests = {
-            cid: timestamps for cid, timestamps in self.requests.items()
-            if timestamps and (now - timestamps[-1]).seconds < self.window_seconds
-        }
-        
-        # Check current client
-        if client_id not in self.requests:
-            self.requests[client_id] = []
-        
-        # Filter timestamps within window
-        client_requests = [
-            ts for ts in self.requests[client_id]
-            if (now - ts).seconds < self.window_seconds
-        ]
-        
-        if len(client_requests) < self.max_requests:
-            client_requests.append(now)
-            self.requests[client_id] = client_requests
-            return True
-        
-        return False
+    def _route_limit(self, route: Optional[str]) -> Optional[Tuple[str, int, int]]:
+        if route:
+            for prefix, limit, window in self.route_limits:
+                if route.startswith(prefix):
+                    return prefix, limit, window
+        return None
+    
+    def is_allowed(self, client_id: str, route: Optional[str] = None) -> bool:
+        limits = [(client_id, self.max_requests, self.window_seconds)]
+        route_limit = self._route_limit(route)
+        if route_limit:
+            prefix, limit, window = route_limit
+            limits.append((f"{prefix}|{client_id}", limit, window))
+        # A request counts against its limits only if all of them allow it
+        return self.backend.acquire_all(limits, time.time())
+
+def create_rate_limiter(settings) -> RateLimiter:
+    """Build the rate limiter described by settings"""
+    backend = None
+    if settings.rate_limit_backend == "redis":
+        try:
+            backend = RedisRateLimitBackend(settings.rate_limit_redis_url)
+        except Exception as e:
+            logger.error(f"Could not use Redis for rate limiting, falling back to in-memory: {e}")
+    
+    return RateLimiter(
+        max_requests=settings.rate_limit_requests,
+        window_seconds=settings.rate_limit_window_seconds,
+        route_limits=settings.rate_limit_routes,
+        backend=backend
+    )
     
 def extract_products_from_response(response: str) -> List[Dict]:
     """Extract product information from agent response"""
@@ -0,0 +1,92 @@
+from typing import List, Optional, Tuple
+import numpy as np
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.json"
+
+# Rows fetched from Chroma per page while exporting
+EXPORT_BATCH_SIZE = 1000
+
+class VectorSnapshot:
+    """
+    Read-only copy of a collection's vectors as one float32 matrix.
+
+    The matrix is written to an .npy file and opened with mmap, so every
+    worker process maps the same page-cache pages instead of holding its own
+    copy. Lookups by entry id are a dict hit plus a row gather.
+    """
+    def __init__(self, ids: List[str], vectors: np.ndarray):
+        self.ids = ids
+        self.vectors = vectors
+        self.positions = {entry_id: i for i, entry_id in enumerate(ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def export(cls, collection, path: str) -> "VectorSnapshot":
+        """Write the collection's vectors to path and return the mmap'd snapshot"""
+        os.makedirs(path, exist_ok=True)
+        total = collection.count()
+        ids: List[str] = []
+        vectors = None
+        for offset in range(0, total, EXPORT_BATCH_SIZE):
+            page = collection.get(limit=EXPORT_BATCH_SIZE, offset=offset, include=["embeddings"])
+            page_vectors = np.asarray(page['embeddings'], dtype=np.float32)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(path, VECTORS_FILE + ".tmp"), mode="w+",
+                    dtype=np.float32, shape=(total, page_vectors.shape[1])
+                )
+            vectors[len(ids):len(ids) + len(page_vectors)] = page_vectors
+            ids.extend(page['ids'])
+
+        if vectors is None:
+            raise ValueError("Collection is empty, nothing to snapshot")
+        vectors.flush()
+        del vectors
+
+        # Rename into place so a reader never sees a half-written snapshot
+        with open(os.path.join(path, IDS_FILE + ".tmp"), "w") as f:
+            json.dump(ids, f)
+        os.replace(os.path.join(path, VECTORS_FILE + ".tmp"), os.path.join(path, VECTORS_FILE))
+        os.replace(os.path.join(path, IDS_FILE + ".tmp"), os.path.join(path, IDS_FILE))
+        logger.info(f"Exported {len(ids)} vectors to {path}")
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VectorSnapshot"]:
+        """Open a snapshot written by export(), or None if there isn't one"""
+        vectors_path = os.path.join(path, VECTORS_FILE)
+        ids_path = os.path.join(path, IDS_FILE)
+        if not (os.path.exists(vectors_path) and os.path.exists(ids_path)):
+            return None
+        with open(ids_path) as f:
+            ids = json.load(f)
+        vectors = np.load(vectors_path, mmap_mode="r")
+        if len(ids) != len(vectors):
+            logger.warning(f"Vector snapshot at {path} is inconsistent, ignoring it")
+            return None
+        return cls(ids, vectors)
+
+    def get(self, entry_ids: List[str]) -> Tuple[List[int], np.ndarray]:
+        """
+        Look up vectors by entry id.
+        Returns the positions in entry_ids that were found and their vectors.
+        """
+        found = [(i, self.positions[entry_id]) for i, entry_id in enumerate(entry_ids) if entry_id in self.positions]
+        if not found:
+            return [], np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+        positions, rows = zip(*found)
+        return list(positions), np.asarray(self.vectors[list(rows)])
+
+class ImageVectorSnapshot(VectorSnapshot):
+    """
+    Snapshot of the image collection, shared by pre-forked workers for
+    reranking. Entries are keyed by image id ("<product id>_img").
+    """
@@ -1,17 +1,37 @@
 import chromadb
 from chromadb.utils import embedding_functions
 import json
-from typing import List, Dict, Optional
+import hashlib
+from contextlib import contextmanager
+from typing import Iterable, List, Dict, Optional, Tuple
 import numpy as np
 from app.config import get_settings
 from app.image_processor import ImageProcessor
-from app.fashion_dataset import FashionDatasetLoader
+from app.fashion_dataset import get_dataset_loader
+from app.reranker import SearchReranker
+from app.catalog_sync import CatalogSync
+from app.neighbors import NeighborTable
+from app.image_partitions import ImagePartitionIndex, choose_partition
+from app.text_index import TextVectorIndex
+from app.color_index import ColorIndex, color_descriptor, encode_histogram
+from app.search_cache import SearchResultCache
+from app.catalog_version import CatalogVersion, build_lock, read_built_version, write_built_version
+from app.single_flight import SingleFlight
+from app.monitoring import metrics
+from app.tracing import traced, stage_span
 import logging
+import os
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Most-colored catalog products considered when image results show too little of a named color
+COLOR_FILL_CANDIDATES = 50
+
 class ProductVectorStore:
-    def __init__(self):
+    def __init__(self, image_processor: Optional[ImageProcessor] = None, image_snapshot=None,
+                 color_index: Optional[ColorIndex] = None, sync_on_startup: Optional[bool] = None):
         settings = get_settings()
         
         # Initialize ChromaDB
@@ -23,9 +43,9 @@ class ProductVectorStore:
             model_name=settings.embedding_model
         )
         
-        # Initialize components
-        self.image_processor = ImageProcessor()
-        self.dataset_loader = FashionDatasetLoader()
+        # Initialize components (reuse a loaded CLIP model when one is passed in)
+        self.image_processor = image_processor or ImageProcessor()
+        self.dataset_loader = get_dataset_loader()
         
         # Get or create collections
         self.text_collection = self.client.get_or_create_collection(
@@ -38,105 +58,506 @@ class ProductVectorStore:
             embedding_function=None
         )
         
-        # Initialize with dataset if empty
-        if self.text_collection.count() == 0:
+        # Bumped whenever the catalog changes so caches and indices can invalidate;
+        # kept on disk so every pre-forked worker sees changes made by the others
+        self.catalog_versions = CatalogVersion(os.path.join(settings.chroma_persist_directory, "catalog_version"))
+        self._seen_version = self.catalog_versions.current()
+        self._index_lock = threading.Lock()
+        self._deferred_changes = 0
+        self._pending_change = False
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._refresh_in_background = False  # the constructor opens the indices itself
+        self.image_partitions = None
+        self.text_index = None
+        self.index_status: Dict[str, str] = {}  # derived index -> building, ready, rebuilding, empty, failed
+        
+        # Ranked, hydrated results of recent text and image searches
+        self.search_cache = None
+        if settings.search_cache_enabled:
+            self.search_cache = SearchResultCache(max_entries=settings.search_cache_max_entries,
+                                                  max_bytes=settings.search_cache_max_mb * 1024 * 1024)
+        
+        # Concurrent identical query embeddings and searches share one computation
+        self.embedding_flights = SingleFlight("openai.embedding", enabled=settings.single_flight_enabled)
+        self.search_flights = SingleFlight("vector_store.search", enabled=settings.single_flight_enabled)
+        
+        # Read-only image vector matrix shared between worker processes, if one was preloaded
+        self.image_snapshot = image_snapshot
+        
+        # Optional second-stage reranking of text search candidates
+        self.reranker = None
+        self.rerank_candidates = settings.rerank_candidates
+        if settings.rerank_enabled:
+            self.reranker = SearchReranker(self.image_processor, self.image_collection, self.image_snapshot)
+        
+        # Per-product color descriptors, kept current by the entry builders during syncs
+        self.color_index = color_index if color_index is not None else ColorIndex.build(self.text_collection)
+        self.color_rerank_weight = settings.color_rerank_weight
+        self.color_min_share = settings.color_min_share
+        
+        # Embed only what changed since the last run (and finish an interrupted one)
+        self.catalog_sync = CatalogSync(
+            self.text_collection,
+            self.image_collection,
+            checkpoint_path=settings.catalog_sync_checkpoint_path,
+            batch_size=settings.catalog_sync_batch_size,
+            prefetch_batches=settings.catalog_sync_prefetch_batches
+        )
+        self.last_sync_report: Optional[Dict] = None
+        # sync_on_startup=False (pre-forked workers) never syncs; by default an empty store always does
+        if sync_on_startup is None:
+            sync_on_startup = settings.catalog_sync_on_startup or self.text_collection.count() == 0
+        if sync_on_startup:
             self._initialize_from_dataset()
+        
+        # Precomputed item-to-item neighbors (stale entries are filtered at lookup)
+        self.neighbors = NeighborTable.load(settings.neighbors_path)
+        catalog_synced = self.last_sync_report is not None and self.last_sync_report["delta"]
+        if settings.neighbors_build_on_startup and (self.neighbors is None or catalog_synced):
+            try:
+                self.build_neighbors()
+            except Exception as e:
+                logger.error(f"Could not build the neighbor table: {e}")
+        
+        # Image vectors partitioned by category, for zero-shot routed image search
+        # (and, when quantized, for every image search instead of Chroma).
+        # Quantized in-process text index, used instead of Chroma's HNSW when configured.
+        # Both are rebuilt in the background whenever the catalog changes.
+        self.image_routing_enabled = settings.image_routing_enabled
+        self.image_routing_confidence = settings.image_routing_confidence
+        if settings.image_routing_enabled or settings.image_index_mode != "float32":
+            self.index_status["image_index"] = "building"
+        if settings.text_index_mode != "chroma":
+            self.index_status["text_index"] = "building"
+        installed = self._install_indices(*self._open_indices())
+        with self._index_lock:
+            self._refresh_in_background = True
+            if not installed:
+                self._schedule_refresh()
     
-    def _initialize_from_dataset(self):
-        """Initialize vector store with fashion dataset"""
-        print("Initializing vector store with fashion dataset...")
+    def _dataset_entry(self, product: Dict) -> Tuple[str, Dict, str]:
+        """Text document, metadata and image fingerprint for a dataset product"""
+        doc = f"{product['name']} {product['description']} {product['category']} {product['brand']} {product['color']} {' '.join(product['features'])}"
         
-        # Get a sample of products (you can adjust the number)
-        products = self.dataset_loader.get_random_products(500)
+        # ChromaDB only accepts str, int, float, or None - convert booleans to strings
+        metadata = {
+            'id': product['id'],
+            'name': product['name'],
+            'description': product['description'],
+            'price': float(product['price']),  # Ensure float
+            'category': product['category'],
+            'sub_category': product['sub_category'],
+            'gender': product['gender'],
+            'color': product['color'],
+            'brand': product['brand'],
+            'in_stock': str(product['in_stock']),  # Convert bool to string
+            'features': json.dumps(product['features'])
+        }
         
-        text_documents = []
-        text_metadatas = []
-        text_ids = []
+        image = product.get('image')
+        fingerprint = hashlib.md5(image.tobytes()).hexdigest() if image is not None else ""
+        if image is not None:
+            metadata.update(self._color_fields(image))
+        return doc, metadata, fingerprint
+    
+    def _sample_entry(self, product: Dict) -> Tuple[str, Dict, str]:
+        """Text document, metadata and image fingerprint for a hand-written product"""
+        features_text = ' '.join(product.get('features', []))
+        doc = f"{product['name']} {product['description']} {product['category']} {features_text}"
         
-        image_embeddings = []
-        image_metadatas = []
-        image_ids = []
+        metadata = {
+            'id': product['id'],
+            'name': product['name'],
+            'description': product['description'],
+            'price': product['price'],
+            'category': product['category'],
+            'in_stock': product.get('in_stock', True),
+            'features': json.dumps(product.get('features', [])),
+            'image_url': product.get('image_url', '')
+        }
+        return doc, metadata, product.get('image_description', '')
+    
+    def _bulk_entry(self, product: Dict) -> Tuple[str, Dict, str]:
+        """Text document, metadata and image fingerprint for a product from a bulk upload"""
+        features = product.get('features') or []
+        parts = [product['name'], product.get('description') or '', product.get('category') or '',
+                 product.get('brand') or '', product.get('color') or '', ' '.join(features)]
+        doc = " ".join(part for part in parts if part)
         
-        for product in products:
-            # Prepare text embedding data
-            doc = f"{product['name']} {product['description']} {product['category']} {product['brand']} {product['color']} {' '.join(product['features'])}"
-            
-            # ChromaDB only accepts str, int, float, or None - convert booleans to strings
-            metadata = {
-                'id': product['id'],
-                'name': product['name'],
-                'description': product['description'],
-                'price': float(product['price']),  # Ensure float
-                'category': product['category'],
-                'sub_category': product['sub_category'],
-                'gender': product['gender'],
-                'color': product['color'],
-                'brand': product['brand'],
-                'in_stock': str(product['in_stock']),  # Convert bool to string
-                'features': json.dumps(product['features'])
-            }
-            
-            text_documents.append(doc)
-            text_metadatas.append(metadata)
-            text_ids.append(product['id'])
-            
-            # Generate image embedding if image exists
+        metadata = {
+            'id': product['id'],
+            'name': product['name'],
+            'description': product.get('description') or '',
+            'price': float(product['price']),
+            'category': product.get('category') or 'General',
+            'in_stock': str(product.get('in_stock', True)),
+            'features': json.dumps(features),
+            'image_url': product.get('image_url') or ''
+        }
+        # Optional attributes are only stored when present (Chroma rejects None)
+        for field in ('sub_category', 'gender', 'color', 'brand'):
+            if product.get(field):
+                metadata[field] = product[field]
+        
+        if product.get('image_base64'):
+            try:
+                metadata.update(self._color_fields(self.image_processor.base64_to_image(product['image_base64'])))
+            except Exception as e:
+                logger.warning(f"No color descriptor for {product['id']}: {e}")
+        
+        image_source = product.get('image_base64') or product.get('image_description') or product.get('image_url') or ''
+        return doc, metadata, hashlib.md5(image_source.encode()).hexdigest() if image_source else ""
+    
+    def _color_fields(self, image) -> Dict:
+        """Dominant color and compact color histogram of a product image, as metadata fields"""
+        histogram, dominant_color = color_descriptor(image)
+        return {'dominant_color': dominant_color, 'color_histogram': encode_histogram(histogram)}
+    
+    def _entry_builder(self, source: str):
+        build = {"dataset": self._dataset_entry, "sample": self._sample_entry}.get(source, self._bulk_entry)
+        
+        def prepare(product: Dict) -> Tuple[str, Dict, str]:
+            entry = build(product)
+            # Keep the in-memory color index in step with what is being stored
+            if entry[1].get('color_histogram'):
+                self.color_index.set_encoded(product['id'], entry[1]['color_histogram'])
+            return entry
+        return prepare
+    
+    def _embed_product_images(self, products: List[Dict]) -> List[Optional[List[float]]]:
+        """
+        CLIP vectors for a batch of products: from the product image, or failing
+        that its image description (None when it has neither)
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(products)
+        image_positions, images = [], []
+        text_positions, texts = [], []
+        for i, product in enumerate(products):
             if product.get('image'):
-                try:
-                    # Convert PIL image to base64
-                    image_base64 = self.dataset_loader.image_to_base64(product['image'])
-                    # Generate embedding
-                    embedding = self.image_processor.get_image_embedding(image_base64)
-                    
-                    image_embeddings.append(embedding)
-                    image_metadatas.append(metadata.copy())  # Use same metadata
-                    image_ids.append(f"{product['id']}_img")
-                except Exception as e:
-                    logger.error(f"Error processing image for {product['id']}: {e}")
+                # Dataset products carry a PIL image
+                image_positions.append(i)
+                images.append(self.dataset_loader.image_to_base64(product['image']))
+            elif product.get('image_base64'):
+                image_positions.append(i)
+                images.append(product['image_base64'])
+            elif product.get('image_description'):
+                # Use CLIP to generate embedding from text description
+                text_positions.append(i)
+                texts.append(product['image_description'])
         
-        # Add to collections
-        if text_documents:
-            self.text_collection.add(
-                documents=text_documents,
-                metadatas=text_metadatas,
-                ids=text_ids
-            )
-            logger.info(f"Added {len(text_documents)} products to text collection")
+        if images:
+            for i, embedding in zip(image_positions, self.image_processor.get_image_embeddings(images)):
+                embeddings[i] = embedding
+        if texts:
+            for i, embedding in zip(text_positions, self.image_processor.get_text_embeddings(texts)):
+                embeddings[i] = embedding
+        return embeddings
+    
+    def sync_catalog(self, products: Iterable[Dict], source: str, delete_missing: bool = True, **options) -> Dict:
+        """
+        Incrementally sync products from one catalog source: only new or changed
+        products are embedded, and (with delete_missing) products of that source
+        that are no longer listed are removed. products may be a generator; see
+        CatalogSync.sync for the streaming and resume options. Returns the sync report.
+        """
+        report = self.catalog_sync.sync(products, source, self._entry_builder(source), self._embed_product_images,
+                                        delete_missing=delete_missing, **options)
+        self.last_sync_report = report
+        if report["delta"]:
+            self._catalog_changed()
+        return report
+    
+    def upsert_products(self, products: List[Dict], source: str = "bulk") -> Dict:
+        """Upsert one chunk of products (new or changed ones only) without touching the rest of the catalog"""
+        report = self.catalog_sync.upsert(products, source, self._entry_builder(source), self._embed_product_images)
+        if report["delta"]:
+            self._catalog_changed()
+        return report
+    
+    def build_neighbors(self) -> NeighborTable:
+        """Recompute the top-K visual and text neighbors of every stored product"""
+        settings = get_settings()
+        self.neighbors = NeighborTable.build(self.text_collection, self.image_collection, settings.neighbors_path,
+                                             k=settings.neighbors_k, chunk_size=settings.neighbors_chunk_size)
+        return self.neighbors
+    
+    def _open_image_index(self, settings, version: int) -> Optional[ImagePartitionIndex]:
+        """Load the category labels into the CLIP classifier and open the partitioned image index built for version"""
+        try:
+            if settings.image_routing_enabled and self.image_processor.category_label_embeddings is None:
+                self.image_processor.load_category_labels(self.dataset_loader.category_taxonomy())
+            path, mode = settings.image_partitions_path, settings.image_index_mode
+            with build_lock(path):
+                index = None
+                if read_built_version(path) == version:
+                    index = ImagePartitionIndex.load(path, mode, settings.quantization_rescore_candidates)
+                if index is None:
+                    if not self.image_collection.count():
+                        self.index_status["image_index"] = "empty"
+                        return None
+                    index = ImagePartitionIndex.build(self.image_collection, path, mode, settings.pq_subspaces)
+                    index.rescore_candidates = settings.quantization_rescore_candidates
+                    write_built_version(path, version)
+            self.index_status["image_index"] = "ready"
+            return index
+        except Exception as e:
+            logger.error(f"In-process image index disabled: {e}")
+            self.index_status["image_index"] = "failed"
+            return None
+    
+    def _open_text_index(self, settings, version: int) -> Optional[TextVectorIndex]:
+        """Open the quantized text index built for version"""
+        path, mode = settings.text_index_path, settings.text_index_mode
+        if mode not in ("float16", "int8"):
+            logger.error(f"Unsupported text index mode '{mode}', using Chroma")
+            self.index_status["text_index"] = "failed"
+            return None
+        try:
+            with build_lock(path):
+                index = None
+                if read_built_version(path) == version:
+                    index = TextVectorIndex.open(path, mode, settings.quantization_rescore_candidates)
+                if index is None:
+                    if not self.text_collection.count():
+                        self.index_status["text_index"] = "empty"
+                        return None
+                    index = TextVectorIndex.build(self.text_collection, path, mode,
+                                                  settings.quantization_rescore_candidates)
+                    write_built_version(path, version)
+            self.index_status["text_index"] = "ready"
+            return index
+        except Exception as e:
+            logger.error(f"Quantized text index disabled, using Chroma: {e}")
+            self.index_status["text_index"] = "failed"
+            return None
+    
+    def _open_indices(self) -> Tuple[int, Optional[ImagePartitionIndex], Optional[TextVectorIndex]]:
+        """
+        The derived indices for the current catalog version. Whichever worker
+        gets to an index first builds it; the others wait for it and load it.
+        """
+        settings = get_settings()
+        version = self._seen_version
+        image_partitions = self._open_image_index(settings, version) if "image_index" in self.index_status else None
+        text_index = self._open_text_index(settings, version) if "text_index" in self.index_status else None
+        return version, image_partitions, text_index
+    
+    def _install_indices(self, version: int, image_partitions, text_index) -> bool:
+        """Swap in indices opened for version, unless the catalog changed again meanwhile"""
+        with self._index_lock:
+            if version != self._seen_version:
+                return False
+            self.image_partitions = image_partitions
+            self.text_index = text_index
+            self._refresh_thread = None
+            return True
+    
+    def _refresh_loop(self):
+        while not self._install_indices(*self._open_indices()):
+            logger.info("Catalog changed during the index rebuild, rebuilding again")
+    
+    def _schedule_refresh(self):
+        # Called with _index_lock held
+        if not self._refresh_in_background or not self.index_status:
+            return
+        for name in self.index_status:
+            self.index_status[name] = "rebuilding"
+        if self._refresh_thread is None:
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True)
+            self._refresh_thread.start()
+    
+    @property
+    def catalog_version(self) -> int:
+        """Current catalog version; noticing a change made by another worker invalidates here too"""
+        version = self.catalog_versions.current()
+        if version != self._seen_version:
+            self._on_catalog_change(version)
+        return version
+    
+    @contextmanager
+    def deferred_invalidation(self):
+        """Hold back invalidation while several writes land (e.g. the chunks of one bulk job), then do it once"""
+        with self._index_lock:
+            self._deferred_changes += 1
+        try:
+            yield
+        finally:
+            with self._index_lock:
+                self._deferred_changes -= 1
+                changed = self._pending_change and not self._deferred_changes
+                if changed:
+                    self._pending_change = False
+            if changed:
+                self._catalog_changed()
+    
+    def _catalog_changed(self):
+        """Invalidate derived state after this process changed the stored catalog"""
+        with self._index_lock:
+            if self._deferred_changes:
+                self._pending_change = True
+                return
+        self._on_catalog_change(self.catalog_versions.bump())
+    
+    def _on_catalog_change(self, version: int):
+        """Drop state derived from an older catalog (changed here or by another worker) and rebuild the indices"""
+        with self._index_lock:
+            if version == self._seen_version:
+                return
+            self._seen_version = version
+            # The shared snapshot and the in-process indices no longer match the collections;
+            # searches use Chroma until the rebuilt indices are swapped in
+            self.image_snapshot = None
+            self.image_partitions = None
+            self.text_index = None
+            if self.reranker:
+                self.reranker.image_snapshot = None
+            # Entries are version-checked anyway; clearing frees their memory now
+            if self.search_cache:
+                self.search_cache.clear()
+            self._schedule_refresh()
+    
+    def get_index_status(self) -> Dict:
+        """State of the derived indices; degraded while searches fall back to Chroma"""
+        status = dict(self.index_status)
+        return {
+            "indices": status,
+            "image_snapshot": self.image_snapshot is not None,
+            "catalog_version": self.catalog_version,
+            "degraded": any(state in ("building", "rebuilding", "failed") for state in status.values())
+        }
+    
+    def _initialize_from_dataset(self):
+        """
+        Sync the dataset sample into the vector store as a stream:
+        dataset rows -> products -> diff + CLIP batch -> upsert chunk
+        """
+        settings = get_settings()
+        print("Syncing vector store with fashion dataset...")
+        indices = self.dataset_loader.catalog_indices(settings.catalog_size, settings.catalog_seed)
+        
+        # Pick up where an interrupted sync of the same sample stopped
+        resume_key = f"{len(self.dataset_loader.dataset)}:{settings.catalog_size}:{settings.catalog_seed}"
+        start = self.catalog_sync.resume_position("dataset", resume_key)
         
-        if image_embeddings:
-            self.image_collection.add(
-                embeddings=image_embeddings,
-                metadatas=image_metadatas,
-                ids=image_ids
-            )
-            logger.info(f"Added {len(image_embeddings)} products to image collection")
+        return self.sync_catalog(
+            self.dataset_loader.iter_products(indices[start:]),
+            source="dataset",
+            total=len(indices),
+            catalog_ids=self.dataset_loader.catalog_product_ids(indices),
+            resume_key=resume_key,
+            start=start
+        )
+    
+    def _to_product(self, metadata: Dict) -> Dict:
+        """Product dict from stored metadata, with its dataset image attached"""
+        product = metadata.copy()
+        # The color descriptor is for the color index, not for clients
+        product.pop('color_histogram', None)
+        
+        # Convert back from strings
+        if 'features' in product and product['features']:
+            product['features'] = json.loads(product['features'])
+        if 'in_stock' in product:
+            product['in_stock'] = product['in_stock'] == 'True'
+        
+        # Get the full product with image from dataset
+        full_product = self.dataset_loader.get_product_by_id(product['id'])
+        if full_product and full_product.get('image'):
+            product['image_base64'] = self.dataset_loader.image_to_base64(full_product['image'])
+        return product
+    
+    def _query_text_index(self, text_index: TextVectorIndex, query_embedding: List[float], n_results: int) -> Dict:
+        """Search the quantized text index; results are shaped like a Chroma query result"""
+        hits = text_index.search(query_embedding, n_results)
+        stored = self.text_collection.get(ids=[product_id for product_id, _ in hits], include=["metadatas", "documents"])
+        entries = {product_id: (metadata, document)
+                   for product_id, metadata, document in zip(stored['ids'], stored['metadatas'], stored['documents'])}
+        hits = [(product_id, score) for product_id, score in hits if product_id in entries]
+        return {
+            'ids': [[product_id for product_id, _ in hits]],
+            'metadatas': [[entries[product_id][0] for product_id, _ in hits]],
+            'documents': [[entries[product_id][1] for product_id, _ in hits]],
+            # Chroma's squared L2 between normalized vectors
+            'distances': [[2 - 2 * score for _, score in hits]]
+        }
     
+    def _cached_search(self, key: Optional[str], cache: str) -> Optional[List[Dict]]:
+        """Products of a cached search for key, recording the lookup"""
+        if key is None:
+            return None
+        start_time = time.time()
+        entry = self.search_cache.get(key, self.catalog_version)
+        if entry is None:
+            metrics.record_cache_lookup(cache, hit=False)
+            return None
+        metrics.record_cache_lookup(cache, hit=True, time_saved=entry["compute_time"] - (time.time() - start_time))
+        return self.search_cache.products(entry)
+    
+    def _embed_query(self, query: str) -> List[float]:
+        """OpenAI embedding of a search query (identical queries in flight share one call)"""
+        return self.embedding_flights.do(query, lambda: self.text_embedding_function([query])[0])
+    
+    @staticmethod
+    def _copy_products(products: List[Dict]) -> List[Dict]:
+        return [dict(product) for product in products]
+    
+    @traced("vector_store.search_products")
     def search_products(self, query: str, n_results: int = 5) -> List[Dict]:
         """Search for products by text query"""
+        # Repeated queries skip the embedding call, the vector query and hydration
+        cache_key = SearchResultCache.text_key(query, n_results)
+        cached = self._cached_search(cache_key if self.search_cache else None, "search_text")
+        if cached is not None:
+            return cached
+        return self.search_flights.do(cache_key, self._search_products, query, n_results, cache_key,
+                                      share=self._copy_products)
+    
+    def _search_products(self, query: str, n_results: int, cache_key: str) -> List[Dict]:
+        search_start = time.time()
+        catalog_version = self.catalog_version
         try:
+            # Over-fetch candidates when a rerank stage follows
+            n_candidates = max(n_results, self.rerank_candidates) if self.reranker else n_results
+            
+            # Embed the query separately so the OpenAI call and the Chroma query are timed apart
+            with stage_span("openai.embedding"):
+                query_embedding = self._embed_query(query)
+            
             # First try vector search
-            results = self.text_collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
+            start_time = time.time()
+            text_index = self.text_index  # may be swapped out by a rebuild meanwhile
+            if text_index is not None:
+                with stage_span("text_index.query", n_results=n_candidates):
+                    results = self._query_text_index(text_index, query_embedding, n_candidates)
+            else:
+                with stage_span("chroma.query", collection="text", n_results=n_candidates):
+                    results = self.text_collection.query(
+                        query_embeddings=[query_embedding],
+                        n_results=n_candidates
+                    )
+            metrics.record_stage_time("vector_query", time.time() - start_time)
             
             if results and results['metadatas']:
+                metadatas = results['metadatas'][0]
+                
+                if self.reranker and len(metadatas) > n_results:
+                    order = self.reranker.rerank(
+                        query,
+                        ids=results['ids'][0],
+                        documents=(results.get('documents') or [[]])[0] or [''] * len(metadatas),
+                        distances=(results.get('distances') or [[]])[0] or [0.0] * len(metadatas)
+                    )
+                    if order is not None:
+                        metadatas = [metadatas[i] for i in order]
+                metadatas = metadatas[:n_results]
+                
+                start_time = time.time()
                 products = []
-                for metadata in results['metadatas'][0]:
-                    product = metadata.copy()
-                    
-                    # Convert back from strings
-                    if 'features' in product and product['features']:
-                        product['features'] = json.loads(product['features'])
-                    if 'in_stock' in product:
-                        product['in_stock'] = product['in_stock'] == 'True'
-                    
-                    # Get the full product with image from dataset
-                    full_product = self.dataset_loader.get_product_by_id(product['id'])
-                    if full_product and full_product.get('image'):
-                        product['image_base64'] = self.dataset_loader.image_to_base64(full_product['image'])
-                    
-                    products.append(product)
+                for metadata in metadatas:
+                    products.append(self._to_product(metadata))
+                metrics.record_stage_time("hydrate_products", time.time() - start_time)
+                if self.search_cache and products:
+                    self.search_cache.set(cache_key, catalog_version, products, time.time() - search_start)
                 return products
             
             # Fallback to dataset search if vector search returns nothing
@@ -149,40 +570,88 @@ class ProductVectorStore:
             dataset_results = self.dataset_loader.search_products(query, limit=n_results)
             return [self.dataset_loader.get_product_with_base64_image(p) for p in dataset_results]
     
+    def _search_image_partition(self, partitions: ImagePartitionIndex, image_embedding: List[float],
+                                n_results: int) -> Optional[List[Dict]]:
+        """
+        Image search on the in-process index: in the predicted category's
+        partition, or across all of it when quantized. None means fall back to Chroma.
+        """
+        route = None
+        if self.image_routing_enabled:
+            with stage_span("image.route"):
+                route = choose_partition(self.image_processor.classify_category(image_embedding),
+                                         partitions, self.image_routing_confidence, n_results)
+        if route is None and partitions.quantized is None:
+            metrics.record_image_route("global", len(partitions))
+            return None
+        level, label, confidence = route or (None, None, None)
+        
+        start_time = time.time()
+        hits, scanned = partitions.search(image_embedding, n_results, level, label)
+        metrics.record_stage_time("image_partition_query", time.time() - start_time)
+        metrics.record_image_route(level or "global", scanned)
+        if route:
+            logger.info(f"Image search routed to {level} '{label}' ({confidence:.0%} confident, {scanned} candidates)")
+        
+        stored = self.text_collection.get(ids=[product_id for product_id, _ in hits], include=["metadatas"])
+        metadata_by_id = dict(zip(stored['ids'], stored['metadatas']))
+        products = []
+        for product_id, score in hits:
+            if product_id not in metadata_by_id:
+                continue
+            product = self._to_product(metadata_by_id[product_id])
+            # Same scale as the global search: Chroma's squared L2 is 2 - 2 * cosine for normalized vectors
+            product['similarity_score'] = round(1 / (1 + (2 - 2 * score)), 3)
+            products.append(product)
+        return products or None
+    
+    @traced("vector_store.search_by_image")
     def search_by_image_embedding(self, image_embedding: List[float], n_results: int = 5) -> List[Dict]:
         """Search for products by image embedding"""
+        cache_key = SearchResultCache.vector_key(image_embedding, n_results)
+        cached = self._cached_search(cache_key if self.search_cache else None, "search_image")
+        if cached is not None:
+            return cached
+        return self.search_flights.do(cache_key, self._search_by_image_embedding, image_embedding, n_results,
+                                      cache_key, share=self._copy_products)
+    
+    def _search_by_image_embedding(self, image_embedding: List[float], n_results: int, cache_key: str) -> List[Dict]:
+        search_start = time.time()
+        catalog_version = self.catalog_version
         try:
-            results = self.image_collection.query(
-                query_embeddings=[image_embedding],
-                n_results=n_results
-            )
+            # Search only the predicted category's partition when the classifier is confident
+            # (or the quantized in-process index)
+            partitions = self.image_partitions  # may be swapped out by a rebuild meanwhile
+            if partitions is not None:
+                products = self._search_image_partition(partitions, image_embedding, n_results)
+                if products:
+                    if self.search_cache:
+                        self.search_cache.set(cache_key, catalog_version, products, time.time() - search_start)
+                    return products
+            
+            with stage_span("chroma.query", collection="image", n_results=n_results):
+                results = self.image_collection.query(
+                    query_embeddings=[image_embedding],
+                    n_results=n_results
+                )
             
             if results and results['metadatas']:
                 products = []
                 distances = results.get('distances', [[]])[0]
                 
                 for i, metadata in enumerate(results['metadatas'][0]):
-                    product = metadata.copy()
-                    
-                    # Convert back from strings
-                    if 'features' in product and product['features']:
-                        product['features'] = json.loads(product['features'])
-                    if 'in_stock' in product:
-                        product['in_stock'] = product['in_stock'] == 'True'
+                    product = self._to_product(metadata)
                     
                     # Add similarity score
                     if i < len(distances):
                         similarity = 1 / (1 + distances[i])
                         product['similarity_score'] = round(similarity, 3)
                     
-                    # Get the full product with image
-                    full_product = self.dataset_loader.get_product_by_id(product['id'])
-                    if full_product and full_product.get('image'):
-                        product['image_base64'] = self.dataset_loader.image_to_base64(full_product['image'])
-                    
                     products.append(product)
                 
                 products.sort(key=lambda x: x.get('similarity_score', 0), reverse=True)
+                if self.search_cache and products:
+                    self.search_cache.set(cache_key, catalog_version, products, time.time() - search_start)
                 return products
             
             # If no results, return random products as fallback
@@ -195,62 +664,123 @@ class ProductVectorStore:
             random_products = self.dataset_loader.get_random_products(n_results)
             return [self.dataset_loader.get_product_with_base64_image(p) for p in random_products]
         
-    def add_products_with_images(self, products: List[Dict]):
-        """Add products with both text and image embeddings"""
-        text_documents = []
-        text_metadatas = []
-        text_ids = []
-        
-        image_embeddings = []
-        image_metadatas = []
-        image_ids = []
-        
-        for product in products:
-            # Prepare text data
-            features_text = ' '.join(product.get('features', []))
-            doc = f"{product['name']} {product['description']} {product['category']} {features_text}"
-            text_documents.append(doc)
-            
-            # Prepare metadata
-            metadata = {
-                'id': product['id'],
-                'name': product['name'],
-                'description': product['description'],
-                'price': product['price'],
-                'category': product['category'],
-                'in_stock': product.get('in_stock', True),
-                'features': json.dumps(product.get('features', [])),
-                'image_url': product.get('image_url', '')
-            }
-            
-            text_metadatas.append(metadata.copy())
-            text_ids.append(product['id'])
-            
-            # Generate image embedding if image description is provided
-            if product.get('image_description'):
-                try:
-                    # Use CLIP to generate embedding from text description
-                    embedding = self.image_processor.get_text_embedding(product['image_description'])
-                    image_embeddings.append(embedding)
-                    image_metadatas.append(metadata.copy())
-                    image_ids.append(f"{product['id']}_img")
-                except Exception as e:
-                    logger.error(f"Error generating image embedding for {product['id']}: {e}")
+    def _products_of_color(self, color_name: str, image_embedding: List[float], exclude: set, n: int) -> List[Dict]:
+        """Of the catalog products showing the most of a named color, the n closest to the query image"""
+        candidates = [product_id for product_id, share in
+                      self.color_index.nearest_to_color(color_name, COLOR_FILL_CANDIDATES + len(exclude))
+                      if product_id not in exclude and share >= self.color_min_share][:COLOR_FILL_CANDIDATES]
+        if not candidates or n <= 0:
+            return []
+        stored = self.image_collection.get(ids=[f"{product_id}_img" for product_id in candidates],
+                                           include=["embeddings", "metadatas"])
+        query = np.asarray(image_embedding, dtype=np.float32)
+        products = []
+        for embedding, metadata in zip(stored['embeddings'], stored['metadatas']):
+            product = self._to_product(metadata)
+            # Same score as a Chroma image query: squared L2 distance -> 1 / (1 + d)
+            distance = float(np.sum((np.asarray(embedding, dtype=np.float32) - query) ** 2))
+            product['similarity_score'] = round(1 / (1 + distance), 3)
+            products.append(product)
+        products.sort(key=lambda product: product['similarity_score'], reverse=True)
+        return products[:n]
+    
+    def rerank_by_color(self, products: List[Dict], n_results: int, image_base64: Optional[str] = None,
+                        color_name: Optional[str] = None,
+                        image_embedding: Optional[List[float]] = None) -> List[Dict]:
+        """
+        Reorder image search results by color: against a named color (products
+        with too little of it are dropped while enough remain), or else against
+        the colors of the uploaded image. Scores blend with the CLIP similarity.
+        With a named color and the query's image_embedding, too few matching
+        candidates are topped up from the catalog's most-colored products.
+        """
+        if not products or (not image_base64 and not color_name):
+            return products[:n_results]
+        start_time = time.time()
+        ids = [product['id'] for product in products]
+        if color_name:
+            color_scores = self.color_index.share_of_color(ids, color_name)
+            matching = int(np.sum(color_scores >= self.color_min_share))  # NaN (no descriptor) never matches
+            if matching < n_results and image_embedding is not None:
+                extra = self._products_of_color(color_name, image_embedding, set(ids), n_results - matching)
+                if extra:
+                    products = products + extra
+                    ids = [product['id'] for product in products]
+                    color_scores = self.color_index.share_of_color(ids, color_name)
+        else:
+            histogram, _ = color_descriptor(self.image_processor.base64_to_image(image_base64))
+            color_scores = self.color_index.similarity_to_histogram(ids, histogram)
         
-        # Add to text collection
-        if text_documents:
-            self.text_collection.add(
-                documents=text_documents,
-                metadatas=text_metadatas,
-                ids=text_ids
-            )
-            logger.info(f"Added {len(text_documents)} products to text collection")
+        ranked = []
+        for product, color_score in zip(products, color_scores):
+            if np.isnan(color_score):
+                continue  # no descriptor (e.g. no product image): keep it after the scored ones
+            product['color_score'] = round(float(color_score), 3)
+            blended = (1 - self.color_rerank_weight) * product.get('similarity_score', 0) + self.color_rerank_weight * color_score
+            ranked.append((blended, product))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        reordered = [product for _, product in ranked]
+        if color_name:
+            matching = [product for product in reordered if product['color_score'] >= self.color_min_share]
+            if len(matching) >= n_results:
+                reordered = matching
+        unscored = [product for product in products if 'color_score' not in product]
+        metrics.record_stage_time("color_rerank", time.time() - start_time)
+        return (reordered + unscored)[:n_results]
+    
+    def _live_neighbors(self, product_id: str, kind: str, n_results: int) -> Optional[List[Tuple[str, float]]]:
+        """Neighbors of a product the table doesn't cover (e.g. added since it was built), from its stored vector"""
+        if kind == "visual":
+            collection, stored_id = self.image_collection, f"{product_id}_img"
+        else:
+            collection, stored_id = self.text_collection, product_id
+        stored = collection.get(ids=[stored_id], include=["embeddings"])
+        if not stored['ids']:
+            return None
+        with stage_span("chroma.query", collection="image" if kind == "visual" else "text", n_results=n_results + 1):
+            results = collection.query(query_embeddings=[stored['embeddings'][0]], n_results=n_results + 1)
+        neighbors = []
+        for neighbor_id, distance in zip(results['ids'][0], (results.get('distances') or [[]])[0]):
+            neighbor_id = neighbor_id[:-len("_img")] if kind == "visual" else neighbor_id
+            if neighbor_id != product_id:
+                # Distances are squared L2 between normalized vectors, i.e. 2 - 2 * cosine
+                neighbors.append((neighbor_id, 1 - distance / 2))
+        return neighbors[:n_results]
+    
+    @traced("vector_store.similar_products")
+    def get_similar_products(self, product_id: str, kind: str = "visual", n_results: int = 5) -> Optional[Tuple[List[Dict], str]]:
+        """
+        Products similar to a catalog product, by image ("visual") or text.
+        Served from the precomputed neighbor table, falling back to a vector
+        query for products it doesn't cover. Returns (products, source), or
+        None if the product is unknown.
+        """
+        start_time = time.time()
+        neighbors = None
+        source = "precomputed"
+        if self.neighbors is not None:
+            # Over-fetch a little: products deleted since the build are dropped below
+            neighbors = self.neighbors.neighbors(product_id, kind, n_results + 5)
+        if neighbors is None:
+            source = "live"
+            # None here also covers a known product without a vector of this kind (checked below)
+            neighbors = self._live_neighbors(product_id, kind, n_results) or []
         
-        # Add to image collection
-        if image_embeddings:
-            self.image_collection.add(
-                embeddings=image_embeddings,
-                metadatas=image_metadatas,
-                ids=image_ids
-            )
-            logger.info(f"Added {len(image_embeddings)} products to image collection")
\ No newline at end of file
+        # One read for the product itself (it may have been deleted since the build) and its neighbors
+        neighbor_ids = [neighbor_id for neighbor_id, _ in neighbors]
+        stored = self.text_collection.get(ids=[product_id] + neighbor_ids, include=["metadatas"])
+        metadata_by_id = dict(zip(stored['ids'], stored['metadatas']))
+        if product_id not in metadata_by_id:
+            return None
+        products = []
+        for neighbor_id, score in neighbors:
+            if neighbor_id in metadata_by_id and len(products) < n_results:
+                product = self._to_product(metadata_by_id[neighbor_id])
+                product['similarity_score'] = round(score, 3)
+                products.append(product)
+        metrics.record_stage_time(f"similar_products.{source}", time.time() - start_time)
+        return products, source
+    
+    def add_products_with_images(self, products: List[Dict]):
+        """Add (or update) products with both text and image embeddings"""
+        return self.sync_catalog(products, source="sample", delete_missing=False)
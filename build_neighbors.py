@@ -0,0 +1,29 @@
+"""
+Precompute the "similar products" neighbor table from the stored vectors
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chromadb
+from app.config import get_settings
+from app.neighbors import NeighborTable
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+if __name__ == "__main__":
+    settings = get_settings()
+    print("Building item-to-item neighbor table...")
+    
+    # Only stored vectors are read, so no embedding models are loaded
+    client = chromadb.PersistentClient(path=settings.chroma_persist_directory)
+    text_collection = client.get_collection("fashion_products_text")
+    image_collection = client.get_collection("fashion_products_images")
+    
+    table = NeighborTable.build(text_collection, image_collection, settings.neighbors_path,
+                                k=settings.neighbors_k, chunk_size=settings.neighbors_chunk_size)
+    
+    print(f"\n✅ Top-{table.k} visual and text neighbors for {len(table)} products "
+          f"in {table.meta['duration']:.2f}s")
+    print(f"Written to {settings.neighbors_path}")
@@ -101,19 +101,13 @@ if __name__ == "__main__":
     # Initialize vector store
     vector_store = ProductVectorStore()
     
-    # Clear existing data (optional)
-    try:
-        vector_store.text_collection.delete(where={})
-        vector_store.image_collection.delete(where={})
-        logger.info("Cleared existing collections")
-    except:
-        pass
-    
-    # Load products
+    # Sync products: only new or changed ones are embedded, removed ones are deleted
     products = load_products_with_images()
-    vector_store.add_products_with_images(products)
+    report = vector_store.sync_catalog(products, source="sample")
     
-    logger.info(f"Successfully loaded {len(products)} products with image embeddings")
+    logger.info(f"Synced {len(products)} products with image embeddings: "
+                f"{report['added']} added, {report['updated']} updated, {report['deleted']} deleted, "
+                f"{report['unchanged']} unchanged in {report['duration']:.2f}s")
     
     # Test search
     logger.info("\nTesting text search...")
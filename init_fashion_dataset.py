@@ -25,6 +25,11 @@ if __name__ == "__main__":
     for product in results:
         print(f"- {product['name']} (${product['price']}) - {product['brand']}")
     
+    report = vector_store.last_sync_report
+    if report:
+        print(f"\nSync: {report['added']} added, {report['updated']} updated, {report['deleted']} deleted, "
+              f"{report['unchanged']} unchanged in {report['duration']:.2f}s")
+    
     print("\n✅ Fashion dataset initialized successfully!")
     print(f"Total products in text collection: {vector_store.text_collection.count()}")
     print(f"Total products in image collection: {vector_store.image_collection.count()}")
\ No newline at end of file
@@ -12,10 +12,16 @@ if not settings.openai_api_key:
 if __name__ == "__main__":
     print(f"🚀 Starting {settings.app_name} v{settings.version}")
     print(f"📍 API running at http://{settings.api_host}:{settings.api_port}")
-    uvicorn.run(
-        "app.main:app",
-        host=settings.api_host,
-        port=settings.api_port,
-        reload=False,
-        log_level="info"
-    )
\ No newline at end of file
+    if settings.workers > 1:
+        # Pre-fork: models and indices load once here and are shared with the workers
+        from app.prefork import serve
+        print(f"👥 Pre-forking {settings.workers} workers")
+        serve(app, settings.workers)
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host=settings.api_host,
+            port=settings.api_port,
+            reload=False,
+            log_level="info"
+        )
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+Benchmark zero-shot category routing of image search: recall vs. candidates and latency.
+
+The catalog sample is embedded with CLIP and partitioned by category. Query
+images are dataset products outside the catalog, like real uploads. For each
+confidence threshold, every query is classified and searched in its routed
+partition, or globally below the threshold. Results are compared against an
+exact global search over the same vectors:
+
+    recall@k       overlap of the routed top-k with the global top-k
+    routed         share of queries that searched a partition
+    candidates     average vectors scanned per query
+    latency        classification + search, against global search alone
+    label acc      routed label matches the query product's own label
+
+Needs the CLIP model and the HuggingFace dataset.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.fashion_dataset import FashionDatasetLoader
+from app.image_processor import ImageProcessor
+from app.image_partitions import ImagePartitionIndex, choose_partition
+
+def embed_products(loader, processor, indices, chunk_size=256):
+    ids, labels, vectors = [], [], []
+    for start in range(0, len(indices), chunk_size):
+        products = [p for p in loader.iter_products(indices[start:start + chunk_size]) if p.get('image')]
+        images = [loader.image_to_base64(p['image']) for p in products]
+        vectors.extend(processor.get_image_embeddings(images))
+        ids.extend(p['id'] for p in products)
+        labels.extend((p['category'], p['sub_category']) for p in products)
+    return ids, labels, np.asarray(vectors, dtype=np.float32)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.5, 0.6, 0.7, 0.8, 0.9, 1.01])
+    args = parser.parse_args()
+
+    loader = FashionDatasetLoader()
+    processor = ImageProcessor()
+    processor.load_category_labels(loader.category_taxonomy())
+
+    catalog = loader.catalog_indices(args.catalog_size, seed=42)
+    in_catalog = set(catalog)
+    held_out = [i for i in range(len(loader.dataset)) if i not in in_catalog]
+    queries = sorted(int(i) for i in np.random.default_rng(7).choice(held_out, args.queries, replace=False))
+
+    print(f"Embedding {len(catalog)} catalog and {len(queries)} query images...")
+    ids, labels, vectors = embed_products(loader, processor, catalog)
+    _, query_labels, query_vectors = embed_products(loader, processor, queries)
+    index = ImagePartitionIndex.from_arrays(ids, vectors, labels)
+
+    # Exact global results, and the classifier's decision per query (independent of the threshold)
+    exact, global_times, decisions, classify_times = [], [], [], []
+    for query in query_vectors:
+        start_time = time.perf_counter()
+        hits, _ = index.search(query, args.k)
+        global_times.append(time.perf_counter() - start_time)
+        exact.append({product_id for product_id, _ in hits})
+
+        start_time = time.perf_counter()
+        decisions.append(processor.classify_category(query.tolist()))
+        classify_times.append(time.perf_counter() - start_time)
+
+    print(f"\n{len(index)} catalog images, {len(index.partitions['category'])} categories, "
+          f"{len(index.partitions['sub_category'])} sub-categories; global search "
+          f"{np.mean(global_times) * 1000:.2f}ms, classification {np.mean(classify_times) * 1000:.2f}ms")
+    print(f"{'threshold':>9} {'routed':>7} {'candidates':>10} {'latency ms':>10} {'recall@' + str(args.k):>9} {'label acc':>9}")
+    for threshold in args.thresholds:
+        routed = correct = candidates = 0
+        recalls, latencies = [], []
+        for query, decision, true_labels, expected, classify_time in zip(
+                query_vectors, decisions, query_labels, exact, classify_times):
+            start_time = time.perf_counter()
+            route = choose_partition(decision, index, threshold, args.k)
+            level, label = (route[0], route[1]) if route else (None, None)
+            hits, scanned = index.search(query, args.k, level, label)
+            latencies.append(time.perf_counter() - start_time + classify_time)
+            candidates += scanned
+            recalls.append(len(expected & {product_id for product_id, _ in hits}) / len(expected))
+            if route:
+                routed += 1
+                correct += true_labels[0 if level == "category" else 1] == label
+        print(f"{threshold:>9.2f} {routed / len(queries):>7.0%} {candidates / len(queries):>10.0f} "
+              f"{np.mean(latencies) * 1000:>10.2f} {np.mean(recalls):>9.3f} "
+              f"{(correct / routed if routed else 0):>9.0%}")
@@ -0,0 +1,78 @@
+"""
+Benchmark the fashion dataset loader: peak RSS and load time, eager vs lazy indices.
+
+The eager loader is the previous _create_indices, which formatted every
+row up front and kept all ~44k products, each holding its decoded PIL image,
+in all_products and the lookup dicts. The lazy loader (FashionDatasetLoader)
+indexes row numbers read from the image-less columns and formats products
+(and decodes images) only when a lookup returns them.
+
+Each loader is measured in a fresh process, since peak RSS only grows.
+The figures are for the real HuggingFace dataset, so `datasets` must be
+installed and the dataset downloadable or cached.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(mode: str, lookups: int) -> dict:
+    from app.fashion_dataset import FashionDatasetLoader
+
+    class EagerLoader(FashionDatasetLoader):
+        """The previous index build: every product formatted and kept in memory"""
+        def _create_indices(self):
+            super()._create_indices()
+            self.all_products = [self._format_product(item, idx) for idx, item in enumerate(self.dataset)]
+            self.products_by_id = {product['id']: product for product in self.all_products}
+
+        def get_product_by_id(self, product_id):
+            return self.products_by_id.get(product_id)
+
+    loader_class = EagerLoader if mode == "eager" else FashionDatasetLoader
+    baseline = rss_mb()
+    start_time = time.perf_counter()
+    loader = loader_class()
+    load_time = time.perf_counter() - start_time
+
+    product_ids = [product_id for product_id, _ in zip(loader.row_by_id, range(lookups))]
+    start_time = time.perf_counter()
+    for product_id in product_ids:
+        loader.get_product_by_id(product_id)
+    lookup_time = (time.perf_counter() - start_time) / max(len(product_ids), 1)
+
+    start_time = time.perf_counter()
+    loader.get_products_by_filters({"category": "Apparel", "max_price": 50}, limit=10)
+    filter_time = time.perf_counter() - start_time
+    return {"products": len(loader.dataset), "load_s": load_time, "peak_mb": peak_rss_mb() - baseline,
+            "rss_mb": rss_mb() - baseline, "lookup_us": lookup_time * 1e6, "filter_ms": filter_time * 1000}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=["eager", "lazy"], help="measure one loader in this process")
+    parser.add_argument("--lookups", type=int, default=200, help="get_product_by_id calls to time")
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.mode, args.lookups)))
+        sys.exit(0)
+
+    print(f"{'loader':>7} {'products':>9} {'load s':>7} {'peak MB':>8} {'held MB':>8} {'lookup us':>10} {'filter ms':>10}")
+    for mode in ("eager", "lazy"):
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--lookups", str(args.lookups)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>7} {result['products']:>9} {result['load_s']:>7.1f} {result['peak_mb']:>8.0f} "
+              f"{result['rss_mb']:>8.0f} {result['lookup_us']:>10.0f} {result['filter_ms']:>10.1f}")
@@ -0,0 +1,85 @@
+"""
+Benchmark single product searches: LLM round trips and latency per turn.
+
+Compares the usual agent turn (the LLM calls a search tool, then writes
+the answer from its observation) with DIRECT_RETURN_ENABLED, where the
+search tool ends the turn and the response comes from the local results
+template. With DIRECT_RETURN_INTRO the results are sent first and a
+short LLM intro follows, so the table reports both when the results
+arrive and when the intro is complete.
+
+The LLM is a scripted chat model with a fixed latency per call and the
+search sleeps for a fixed time, so no OpenAI key, CLIP model or vector
+store is needed.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.tools import Tool
+
+from benchmark_parallel_tools import PROMPT, ScriptedChatModel
+from app.agent_runtime import AgentLoop, create_agent_executor
+from app.monitoring_agent import AgentMonitor, AgentMonitorCallbackHandler
+from app.tools import current_products_store, start_tool_step, store_products
+from app.utils import format_product_handles, format_product_results
+
+QUERIES = ["rain jackets", "summer dresses under $50", "black running shoes"]
+
+def make_tools(latency: float, direct_return: bool) -> List[Tool]:
+    def search(query: str) -> str:
+        time.sleep(latency)
+        products = [{"id": f"prod_{i}", "name": f"{query} {i}", "brand": "Brand", "price": 20.0 + i,
+                     "color": "Black", "category": "Apparel", "description": f"A {query} product."}
+                    for i in range(5)]
+        store_products(products, "search_products")
+        return format_product_handles(f"Found {len(products)} products for '{query}'", products)
+    return [Tool(name="search_products", func=search, description="search_products tool",
+                 return_direct=direct_return)]
+
+def run_turn(mode: str, query: str, args, loop: AgentLoop):
+    llm = ScriptedChatModel(plan=[("search_products", query)], latency=args.llm_latency)
+    tools = make_tools(args.tool_latency, direct_return=mode != "agent answer")
+    executor = create_agent_executor(llm, tools, PROMPT, max_iterations=3, on_tool_step=start_tool_step,
+                                     return_intermediate_steps=True)
+
+    current_products_store["products"] = None
+    current_products_store["source"] = None
+    usage = AgentMonitorCallbackHandler(monitor=AgentMonitor())
+    start_time = time.perf_counter()
+    result = loop.run(executor.ainvoke({"input": query}, config={"callbacks": [usage]}))
+    if mode != "agent answer":
+        action, _ = result["intermediate_steps"][-1]
+        format_product_results(str(action.tool_input), current_products_store["products"])
+    results_at = time.perf_counter() - start_time
+    if mode == "direct + intro":
+        # The intro is one more short completion, sent after the results
+        ScriptedChatModel(plan=[], latency=args.intro_latency).invoke(f"Introduce results for {query}")
+    return usage.llm_calls, results_at, time.perf_counter() - start_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per agent LLM call")
+    parser.add_argument("--intro-latency", type=float, default=0.4, help="seconds for the short intro completion")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="seconds per search")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    loop = AgentLoop()
+    print(f"LLM {args.llm_latency * 1000:.0f}ms per call, intro {args.intro_latency * 1000:.0f}ms, "
+          f"search {args.tool_latency * 1000:.0f}ms")
+    print(f"{'mode':>14} {'LLM calls':>9} {'results s':>9} {'done s':>7}")
+    baseline = None
+    for mode in ("agent answer", "direct", "direct + intro"):
+        results = [run_turn(mode, query, args, loop) for query in QUERIES for _ in range(args.repeats)]
+        llm_calls = sum(r[0] for r in results) / len(results)
+        results_at = sum(r[1] for r in results) / len(results)
+        done = sum(r[2] for r in results) / len(results)
+        baseline = baseline or results_at
+        print(f"{mode:>14} {llm_calls:>9.1f} {results_at:>9.2f} {done:>7.2f}"
+              f"  ({(1 - results_at / baseline) * 100:.0f}% less time to results)")
+    loop.shutdown()
@@ -0,0 +1,120 @@
+"""
+Benchmark peak memory of building the product index for 500 vs 44k products.
+
+Compares the streaming CatalogSync pipeline with the previous build, which
+collected every document, metadata dict and embedding into lists before a
+single add. Peak memory is the tracemalloc peak of the build itself, so
+the dataset loaded beforehand is not counted. Collections are in-memory
+stand-ins that only count writes, and embeddings are fixed 512-d vectors,
+so the numbers reflect the pipeline and not Chroma or CLIP.
+
+By default products are synthetic (60x80 images, like the dataset's).
+Pass --dataset to stream the real HuggingFace dataset instead.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.catalog_sync import CatalogSync
+
+EMBEDDING_DIM = 512
+
+class CountingCollection:
+    """Accepts writes and keeps only a count"""
+    def __init__(self):
+        self.written = 0
+
+    def get(self, limit=None, offset=0, include=None, ids=None):
+        return {"ids": [], "metadatas": []}
+
+    def upsert(self, ids, metadatas, documents=None, embeddings=None):
+        self.written += len(ids)
+
+    add = upsert
+
+    def delete(self, ids):
+        pass
+
+def synthetic_products(n: int):
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        pixels = rng.integers(0, 255, (80, 60, 3), dtype=np.uint8)
+        yield {
+            "id": f"prod_{i}", "name": f"Product {i}", "description": f"Synthetic product number {i}",
+            "price": 19.99, "category": "Apparel", "sub_category": "Topwear", "gender": "Unisex",
+            "color": "Blue", "brand": "Generic", "in_stock": True,
+            "features": ["Tshirts", "Blue", "Summer", "Casual", "Unisex"],
+            "image": Image.fromarray(pixels)
+        }
+
+def dataset_products(n: int):
+    from app.fashion_dataset import FashionDatasetLoader
+    loader = FashionDatasetLoader()
+    return lambda: loader.iter_products(loader.catalog_indices(n))
+
+def prepare(product):
+    doc = f"{product['name']} {product['description']} {product['category']} {product['brand']} {product['color']} {' '.join(product['features'])}"
+    metadata = {key: product[key] for key in ("id", "name", "description", "price", "category", "color", "brand")}
+    metadata["in_stock"] = str(product["in_stock"])
+    metadata["features"] = json.dumps(product["features"])
+    return doc, metadata, str(hash(product["image"].tobytes()))
+
+def embed_images(products):
+    # Shaped like ImageProcessor output: lists of Python floats
+    return [np.full(EMBEDDING_DIM, 0.01, dtype=np.float32).tolist() for _ in products]
+
+def legacy_build(products, text_collection, image_collection):
+    """The previous build: accumulate everything, then add once"""
+    text_documents, text_metadatas, text_ids = [], [], []
+    image_embeddings, image_metadatas, image_ids = [], [], []
+    for product in products:
+        doc, metadata, _ = prepare(product)
+        text_documents.append(doc)
+        text_metadatas.append(metadata)
+        text_ids.append(product["id"])
+        image_embeddings.append(embed_images([product])[0])
+        image_metadatas.append(metadata.copy())
+        image_ids.append(f"{product['id']}_img")
+    text_collection.add(documents=text_documents, metadatas=text_metadatas, ids=text_ids)
+    image_collection.add(embeddings=image_embeddings, metadatas=image_metadatas, ids=image_ids)
+
+def streaming_build(products, text_collection, image_collection, batch_size: int):
+    sync = CatalogSync(text_collection, image_collection,
+                       checkpoint_path=os.path.join(tempfile.mkdtemp(), "checkpoint.json"),
+                       batch_size=batch_size)
+    sync.sync(products, "dataset", prepare, embed_images)
+
+def measure(build, products) -> tuple:
+    text_collection, image_collection = CountingCollection(), CountingCollection()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    build(products, text_collection, image_collection)
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert text_collection.written and image_collection.written
+    return peak / 1024 / 1024, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 44000])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--dataset", action="store_true", help="stream the real dataset (needs `datasets`)")
+    args = parser.parse_args()
+
+    print(f"{'products':>9} {'build':>10} {'peak MB':>9} {'seconds':>8}")
+    for size in args.sizes:
+        source = dataset_products(size) if args.dataset else (lambda size=size: synthetic_products(size))
+        for name, build in (("legacy", legacy_build),
+                            ("streaming", lambda p, t, i: streaming_build(p, t, i, args.batch_size))):
+            peak, elapsed = measure(build, source())
+            print(f"{size:>9} {name:>10} {peak:>9.1f} {elapsed:>8.2f}")
@@ -0,0 +1,78 @@
+"""
+Benchmark model tiering: per-stage LLM latency and wall time per product query.
+
+Runs the agent with real ChatOpenAI clients against the stub
+OpenAI-compatible server (test/stub_openai_server.py), which sleeps a
+per-model latency. Configurations:
+  - one model (LLM_MODEL) for every step
+  - LLM_TOOL_MODEL picks the tools and writes the queries, LLM_MODEL answers
+  - the same, with DIRECT_RETURN_ENABLED (no answer step for single searches)
+Stage times (llm.plan, llm.answer) come from the app's LLM tracing
+callback, as they do under /metrics stage_timings. No API key, CLIP model
+or vector store needed.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from langchain_openai import ChatOpenAI
+
+from benchmark_direct_return import make_tools
+from benchmark_parallel_tools import PROMPT
+from stub_openai_server import start_in_thread
+from app.agent_runtime import create_agent_executor
+from app.monitoring import metrics
+from app.tools import start_tool_step
+from app.tracing import LLMTracingCallbackHandler
+
+QUERIES = ["rain jackets for hiking", "summer dresses under $50", "black running shoes", "a leather wallet"]
+
+def run_config(base_url: str, tool_model: str, answer_model: str, direct_return: bool, args) -> dict:
+    def chat_model(model: str) -> ChatOpenAI:
+        return ChatOpenAI(model=model, base_url=base_url, api_key="stub", temperature=0.7)
+    tool_llm = chat_model(tool_model)
+    answer_llm = chat_model(answer_model) if answer_model != tool_model else tool_llm
+    executor = create_agent_executor(tool_llm, make_tools(args.tool_latency, direct_return), PROMPT,
+                                     answer_llm=answer_llm, max_iterations=3, on_tool_step=start_tool_step)
+
+    metrics.stage_times.clear()
+    walls = []
+    for query in QUERIES * args.repeats:
+        start_time = time.perf_counter()
+        executor.invoke({"input": query}, config={"callbacks": [LLMTracingCallbackHandler()]})
+        walls.append(time.perf_counter() - start_time)
+    stages = {stage: histogram.summary() for stage, histogram in metrics.stage_times.items()}
+    return {"wall": sum(walls) / len(walls), "stages": stages}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--model", default="gpt-4", help="answer model (LLM_MODEL)")
+    parser.add_argument("--tool-model", default="gpt-4o-mini", help="tool selection model (LLM_TOOL_MODEL)")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="seconds per search")
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    server = start_in_thread(args.port)
+    stub_url = f"http://127.0.0.1:{args.port}"
+    configs = [
+        (f"{args.model} only", args.model, args.model, False),
+        (f"{args.tool_model} -> {args.model}", args.tool_model, args.model, False),
+        (f"{args.tool_model} + direct", args.tool_model, args.model, True),
+    ]
+    print(f"{'config':>26} {'plan s':>7} {'answer s':>8} {'wall s':>7}  calls per model")
+    for name, tool_model, answer_model, direct_return in configs:
+        requests.post(f"{stub_url}/stats/reset", timeout=5)
+        result = run_config(f"{stub_url}/v1", tool_model, answer_model, direct_return, args)
+        calls = requests.get(f"{stub_url}/stats", timeout=5).json()
+        plan = result["stages"].get("llm.plan", {}).get("average", 0)
+        answer = result["stages"].get("llm.answer", {}).get("average", 0)
+        per_model = ", ".join(f"{model}: {entry['calls']}" for model, entry in calls.items())
+        print(f"{name:>26} {plan:>7.2f} {answer:>8.2f} {result['wall']:>7.2f}  {per_model}")
+    server.should_exit = True
@@ -0,0 +1,129 @@
+"""
+Benchmark multi-intent agent turns: LLM round trips and wall time per turn.
+
+Compares the previous functions agent (one function call per LLM step, so
+one round trip per intent) with the tools-calling agent, whose first step
+returns every tool call at once. The tools agent runs them either one
+after another (invoke) or concurrently on the agent loop (ainvoke), as
+AGENT_PARALLEL_TOOLS selects.
+
+The LLM is a scripted chat model with a fixed latency per call and the
+tools sleep for a fixed time, so the numbers isolate the executor: no
+OpenAI key, CLIP model or vector store needed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.agents import AgentExecutor, create_openai_functions_agent
+from langchain.tools import Tool
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, FunctionMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from app.agent_runtime import AgentLoop, create_agent_executor
+from app.monitoring_agent import AgentMonitor, AgentMonitorCallbackHandler
+from app.tools import current_products_store, start_tool_step, store_products
+
+# Multi-intent turns: the tool calls a model should make for each
+TURNS = [
+    [("search_by_image", "similar jackets"), ("search_products", "rain gear")],
+    [("search_products", "summer dresses"), ("search_products", "sandals")],
+    [("search_products", "running shoes"), ("search_products", "sports socks"), ("search_products", "water bottle")],
+]
+
+class ScriptedChatModel(BaseChatModel):
+    """Issues the planned tool calls (all at once for tools, one per step for functions), then answers"""
+    plan: List[Any]
+    latency: float
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _respond(self, messages, **kwargs) -> ChatResult:
+        done = sum(isinstance(message, (ToolMessage, FunctionMessage)) for message in messages)
+        if done >= len(self.plan):
+            message = AIMessage(content=f"Here is what I found for all {len(self.plan)} requests.")
+        elif "functions" in kwargs:
+            tool, query = self.plan[done]
+            message = AIMessage(content="", additional_kwargs={
+                "function_call": {"name": tool, "arguments": json.dumps({"__arg1": query})}})
+        else:
+            message = AIMessage(content="", tool_calls=[
+                {"name": tool, "args": {"__arg1": query}, "id": f"call_{i}"} for i, (tool, query) in enumerate(self.plan)])
+        usage = {"prompt_tokens": 400, "completion_tokens": 30}
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage})
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return self._respond(messages, **kwargs)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._respond(messages, **kwargs)
+
+def make_tools(latency: float) -> List[Tool]:
+    def search(source: str):
+        def run(query: str) -> str:
+            time.sleep(latency)
+            store_products([{"id": f"{source}:{query}:{i}"} for i in range(5)], source)
+            return f"Found 5 products for '{query}'"
+        return run
+    return [Tool(name=name, func=search(name), description=f"{name} tool")
+            for name in ("search_products", "search_by_image")]
+
+PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a shopping assistant."),
+    ("human", "{input}"),
+    MessagesPlaceholder(variable_name="agent_scratchpad"),
+])
+
+def run_turn(mode: str, plan, args, loop: AgentLoop):
+    llm = ScriptedChatModel(plan=plan, latency=args.llm_latency)
+    tools = make_tools(args.tool_latency)
+    if mode == "functions":
+        executor = AgentExecutor(agent=create_openai_functions_agent(llm, tools, PROMPT), tools=tools, max_iterations=5)
+    else:
+        executor = create_agent_executor(llm, tools, PROMPT, max_iterations=5, on_tool_step=start_tool_step)
+
+    current_products_store["products"] = None
+    current_products_store["source"] = None
+    usage = AgentMonitorCallbackHandler(monitor=AgentMonitor())
+    inputs, config = {"input": "multi-intent turn"}, {"callbacks": [usage]}
+    start_time = time.perf_counter()
+    if mode == "tools (parallel)":
+        loop.run(executor.ainvoke(inputs, config=config))
+    else:
+        executor.invoke(inputs, config=config)
+    elapsed = time.perf_counter() - start_time
+    return usage.llm_calls, elapsed, len(current_products_store["products"] or [])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per LLM call")
+    parser.add_argument("--tool-latency", type=float, default=0.3, help="seconds per tool call")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    loop = AgentLoop()
+    print(f"LLM {args.llm_latency * 1000:.0f}ms per call, tools {args.tool_latency * 1000:.0f}ms per call")
+    print(f"{'intents':>7} {'agent':>18} {'LLM calls':>9} {'wall s':>7} {'products':>8}")
+    for plan in TURNS:
+        for mode in ("functions", "tools (sequential)", "tools (parallel)"):
+            results = [run_turn(mode, plan, args, loop) for _ in range(args.repeats)]
+            llm_calls = sum(r[0] for r in results) / len(results)
+            wall = sum(r[1] for r in results) / len(results)
+            print(f"{len(plan):>7} {mode:>18} {llm_calls:>9.1f} {wall:>7.2f} {results[-1][2]:>8}")
+    loop.shutdown()
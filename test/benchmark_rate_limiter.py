@@ -0,0 +1,74 @@
+"""
+Microbenchmark for RateLimiter.is_allowed as the number of tracked clients grows.
+
+Each run first registers N distinct clients, then times checks for random
+clients. The per-request cost should stay flat from 1k to 100k clients.
+The previous implementation, which rebuilt its whole state on every call,
+is timed alongside for comparison (with fewer calls, since it is O(N)).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import RateLimiter
+
+class LegacyRateLimiter:
+    """The original list-of-timestamps limiter, kept here as a baseline"""
+    def __init__(self, max_requests: int = 100, window_seconds: int = 60):
+        self.max_requests = max_requests
+        self.window_seconds = window_seconds
+        self.requests = {}
+
+    def is_allowed(self, client_id: str) -> bool:
+        now = datetime.now()
+        self.requests = {
+            cid: timestamps for cid, timestamps in self.requests.items()
+            if timestamps and (now - timestamps[-1]).seconds < self.window_seconds
+        }
+        if client_id not in self.requests:
+            self.requests[client_id] = []
+        client_requests = [ts for ts in self.requests[client_id] if (now - ts).seconds < self.window_seconds]
+        if len(client_requests) < self.max_requests:
+            client_requests.append(now)
+            self.requests[client_id] = client_requests
+            return True
+        return False
+
+def time_checks(limiter, clients, calls: int, **kwargs) -> float:
+    """Return mean microseconds per is_allowed call"""
+    sample = [random.choice(clients) for _ in range(calls)]
+    start = time.perf_counter()
+    for client in sample:
+        limiter.is_allowed(client, **kwargs)
+    return (time.perf_counter() - start) / calls * 1e6
+
+def bench(client_counts, calls: int, legacy_calls: int):
+    print(f"{'clients':>10} {'new (us/req)':>14} {'new + route':>14} {'legacy (us/req)':>16}")
+    for count in client_counts:
+        clients = [f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}" for i in range(count)]
+
+        limiter = RateLimiter(max_requests=100, window_seconds=60, route_limits={"/chat": (30, 60)})
+        for client in clients:
+            limiter.is_allowed(client)
+        new_cost = time_checks(limiter, clients, calls)
+        route_cost = time_checks(limiter, clients, calls, route="/chat")
+
+        legacy = LegacyRateLimiter()
+        for client in clients:
+            legacy.requests[client] = [datetime.now()]
+        legacy_cost = time_checks(legacy, clients, legacy_calls)
+
+        print(f"{count:>10} {new_cost:>14.2f} {route_cost:>14.2f} {legacy_cost:>16.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--legacy-calls", type=int, default=50)
+    args = parser.parse_args()
+
+    bench([1000, 10000, 100000], args.calls, args.legacy_calls)
@@ -0,0 +1,94 @@
+"""
+Benchmark tool observation size: legacy markdown listing vs compact product handles.
+
+Offline mode compares the tokens each search result adds to the LLM prompt
+and the time to build (and, for the legacy format, regex-parse back) the
+observation. With --live it also sends product queries to a running server
+and reports per-turn latency and the token usage recorded in /metrics.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils import format_product_results, format_product_handles, extract_products_from_response
+from app.prompt_budget import count_tokens
+
+QUERIES = ["red dresses", "running shoes", "black leather handbag", "denim jacket", "summer tops"]
+
+def make_products(n: int = 5):
+    """Products shaped like FashionDatasetLoader records"""
+    products = []
+    for i in range(n):
+        name = f"Roadster Men Navy Blue Slim Fit Casual Shirt {i}"
+        products.append({
+            "id": f"prod_{15970 + i}",
+            "name": name,
+            "brand": "Roadster",
+            "price": 39.99 + i,
+            "color": "Navy Blue",
+            "category": "Apparel",
+            "description": (f"{name}. This Roadster Shirts is perfect for your wardrobe. "
+                            "Features Navy Blue color, ideal for Fall season. Great for Casual occasions")
+        })
+    return products
+
+def bench_offline(iterations: int):
+    products = make_products()
+    legacy_tokens, compact_tokens = [], []
+    legacy_time = compact_time = 0.0
+
+    for query in QUERIES:
+        legacy = format_product_results(query, products)
+        compact = format_product_handles(f"Found {len(products)} products for '{query}'", products)
+        legacy_tokens.append(count_tokens(legacy))
+        compact_tokens.append(count_tokens(compact))
+
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for query in QUERIES:
+            # Legacy round trip: build markdown, then regex it back into products
+            extract_products_from_response(format_product_results(query, products))
+        legacy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        for query in QUERIES:
+            format_product_handles(f"Found {len(products)} products for '{query}'", products)
+        compact_time += time.perf_counter() - start
+
+    turns = iterations * len(QUERIES)
+    avg_legacy = sum(legacy_tokens) / len(legacy_tokens)
+    avg_compact = sum(compact_tokens) / len(compact_tokens)
+    print("Tool observation per search turn (5 products)")
+    print(f"  legacy markdown : {avg_legacy:7.1f} tokens  {legacy_time / turns * 1e6:8.1f} us build+parse")
+    print(f"  compact handles : {avg_compact:7.1f} tokens  {compact_time / turns * 1e6:8.1f} us build")
+    print(f"  token reduction : {(1 - avg_compact / avg_legacy) * 100:.0f}%")
+    print("  (each agent iteration after the tool call re-sends the observation, so savings multiply)")
+
+def bench_live(base_url: str):
+    import requests
+
+    latencies = []
+    for query in QUERIES:
+        start = time.perf_counter()
+        response = requests.post(f"{base_url}/chat", json={"message": f"Can you suggest {query} for a trip?"}, timeout=60)
+        latencies.append(time.perf_counter() - start)
+        print(f"  {query:24s} {latencies[-1]:6.2f}s  status={response.status_code}")
+
+    usage = requests.get(f"{base_url}/metrics", timeout=10).json().get("token_usage", {})
+    print(f"Average turn latency: {sum(latencies) / len(latencies):.2f}s")
+    print(f"Average prompt tokens: {usage.get('average_prompt_tokens')}, "
+          f"completion tokens: {usage.get('average_completion_tokens')}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--live", action="store_true", help="also benchmark a running server")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    args = parser.parse_args()
+
+    bench_offline(args.iterations)
+    if args.live:
+        bench_live(args.base_url)
@@ -0,0 +1,130 @@
+"""
+Benchmark memory per worker and aggregate throughput for 1..N pre-forked workers.
+
+For each worker count the script starts `python run.py` with WORKERS=<n>,
+waits for every worker to report ready, reads Rss and Pss (proportional
+set size, which splits shared pages between the processes mapping them)
+from /proc/<pid>/smaps_rollup, then drives concurrent /chat requests for a
+fixed time. With shared preloaded state, Pss per worker should fall well
+below Rss and total Pss should grow much slower than N x single-worker Rss.
+Linux only. Needs OPENAI_API_KEY in the environment or .env; the default
+message is a greeting, which the intent router answers without the LLM.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def read_memory(pid: int) -> dict:
+    """Rss/Pss in MB from smaps_rollup"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:", "Shared_Clean:", "Private_Dirty:"):
+                values[parts[0].rstrip(":").lower()] = int(parts[1]) / 1024
+    return values
+
+def child_pids(pid: int) -> list:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError):
+            continue
+    return children
+
+def wait_ready(base_url: str, workers: int, timeout: float) -> bool:
+    """Poll /ready until enough distinct worker pids have answered ready"""
+    ready_pids = set()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = requests.get(f"{base_url}/ready", timeout=5)
+            if response.status_code == 200:
+                ready_pids.add(response.json().get("pid"))
+                if len(ready_pids) >= workers:
+                    return True
+                continue
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+def drive_load(base_url: str, message: str, concurrency: int, duration: float) -> dict:
+    deadline = time.time() + duration
+    sessions = [requests.Session() for _ in range(concurrency)]
+
+    def client(session):
+        completed = errors = 0
+        while time.time() < deadline:
+            try:
+                response = session.post(f"{base_url}/chat", json={"message": message}, timeout=30)
+                if response.status_code == 200:
+                    completed += 1
+                else:
+                    errors += 1
+            except requests.RequestException:
+                errors += 1
+        return completed, errors
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(client, sessions))
+    elapsed = time.time() - start_time
+    completed = sum(r[0] for r in results)
+    return {"requests": completed, "errors": sum(r[1] for r in results), "rps": completed / elapsed}
+
+def run(workers: int, args) -> dict:
+    env = dict(os.environ,
+               WORKERS=str(workers),
+               API_PORT=str(args.port),
+               RATE_LIMIT_REQUESTS=str(10 ** 9),
+               PREFORK_PRELOAD=str(not args.no_preload))
+    base_url = f"http://127.0.0.1:{args.port}"
+    process = subprocess.Popen([sys.executable, "run.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(base_url, workers, args.startup_timeout):
+            raise RuntimeError(f"Server with {workers} workers did not become ready")
+
+        # Single-process mode serves from the launched process itself
+        pids = child_pids(process.pid) if workers > 1 else [process.pid]
+        memory = [read_memory(pid) for pid in pids]
+        master = read_memory(process.pid) if workers > 1 else None
+        load = drive_load(base_url, args.message, args.concurrency, args.duration)
+        return {"workers": workers, "memory": memory, "master": master, **load}
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--message", default="hello there")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--no-preload", action="store_true", help="fork before loading anything (baseline)")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'rss/worker':>11} {'pss/worker':>11} {'total pss':>10} {'req/s':>8} {'errors':>7}")
+    for workers in args.workers:
+        result = run(workers, args)
+        memory = result["memory"]
+        rss = sum(m["rss"] for m in memory) / len(memory)
+        pss = sum(m["pss"] for m in memory) / len(memory)
+        total_pss = sum(m["pss"] for m in memory) + (result["master"]["pss"] if result["master"] else 0)
+        print(f"{workers:>7} {rss:>9.0f}MB {pss:>9.0f}MB {total_pss:>8.0f}MB "
+              f"{result['rps']:>8.1f} {result['errors']:>7}")
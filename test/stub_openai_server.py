@@ -0,0 +1,145 @@
+"""
+Stub OpenAI-compatible chat completions server with per-model latency.
+
+Answers /v1/chat/completions (plain and streamed) the way the agent needs:
+when tools are offered and none has run since the user's last message, it
+calls search_products (or the first tool) with the user's message as the
+query; otherwise it writes a canned answer. Each model sleeps for a base
+latency plus a per-token time, so fast and large models can be told apart
+without an API key. GET /stats reports calls and latency per model.
+
+Run it standalone and point the app at it:
+    python test/stub_openai_server.py --port 8100
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=stub LLM_TOOL_MODEL=gpt-4o-mini python run.py
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# model -> (seconds before the first token, seconds per completion token)
+MODEL_LATENCY: Dict[str, Tuple[float, float]] = {
+    "gpt-4": (0.6, 0.03),
+    "gpt-4-turbo": (0.4, 0.015),
+    "gpt-4o": (0.3, 0.01),
+    "gpt-4o-mini": (0.2, 0.005),
+    "gpt-3.5-turbo": (0.2, 0.005),
+}
+DEFAULT_LATENCY = (0.3, 0.01)
+
+ANSWER = ("Here are a few options that fit what you asked for. The first one is the best value, "
+          "and the second has the strongest reviews. Let me know if you want other colors or sizes.")
+
+app = FastAPI(title="Stub OpenAI")
+stats_lock = threading.Lock()
+stats = defaultdict(lambda: {"calls": 0, "tool_calls": 0, "answers": 0, "completion_tokens": 0, "latency": 0.0})
+
+def _tool_call(body: Dict) -> Dict:
+    """The tool call for this request, or None to answer"""
+    tools = body.get("tools") or []
+    messages = body.get("messages") or []
+    if not tools:
+        return None
+    last_user = max((i for i, m in enumerate(messages) if m.get("role") == "user"), default=-1)
+    if any(m.get("role") == "tool" for m in messages[last_user + 1:]):
+        return None
+    tool = next((t for t in tools if t["function"]["name"] == "search_products"), tools[0])["function"]
+    argument = next(iter((tool.get("parameters") or {}).get("properties") or {"query": None}))
+    query = messages[last_user].get("content", "") if last_user >= 0 else ""
+    if isinstance(query, list):
+        query = " ".join(part.get("text", "") for part in query if isinstance(part, dict))
+    return {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+            "function": {"name": tool["name"], "arguments": json.dumps({argument: query})}}
+
+def _usage(body: Dict, completion_tokens: int) -> Dict:
+    prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+def _record(model: str, tool_call, completion_tokens: int, latency: float):
+    with stats_lock:
+        entry = stats[model]
+        entry["calls"] += 1
+        entry["tool_calls" if tool_call else "answers"] += 1
+        entry["completion_tokens"] += completion_tokens
+        entry["latency"] += latency
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "stub")
+    first_token, per_token = MODEL_LATENCY.get(model, DEFAULT_LATENCY)
+    tool_call = _tool_call(body)
+    words = [] if tool_call else ANSWER.split(" ")
+    max_tokens = body.get("max_completion_tokens") or body.get("max_tokens")
+    if max_tokens:
+        words = words[:max_tokens]
+    completion_tokens = 20 if tool_call else len(words)
+    completion_id, created = f"chatcmpl-{uuid.uuid4().hex[:12]}", int(time.time())
+    start_time = time.perf_counter()
+
+    if not body.get("stream"):
+        await asyncio.sleep(first_token + per_token * completion_tokens)
+        message = {"role": "assistant", "content": None if tool_call else " ".join(words)}
+        if tool_call:
+            message["tool_calls"] = [tool_call]
+        _record(model, tool_call, completion_tokens, time.perf_counter() - start_time)
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": _usage(body, completion_tokens)
+        }
+
+    async def events():
+        def chunk(delta: Dict, finish_reason=None) -> str:
+            data = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(data)}\n\n"
+
+        await asyncio.sleep(first_token)
+        if tool_call:
+            yield chunk({"role": "assistant", "tool_calls": [dict(tool_call, index=0)]})
+        for i, word in enumerate(words):
+            await asyncio.sleep(per_token)
+            yield chunk({"role": "assistant", "content": word if i == 0 else " " + word})
+        yield chunk({}, "tool_calls" if tool_call else "stop")
+        _record(model, tool_call, completion_tokens, time.perf_counter() - start_time)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/stats")
+async def get_stats():
+    with stats_lock:
+        return {model: dict(entry, average_latency=round(entry["latency"] / entry["calls"], 3) if entry["calls"] else 0,
+                            latency=round(entry["latency"], 3))
+                for model, entry in stats.items()}
+
+@app.post("/stats/reset")
+async def reset_stats():
+    with stats_lock:
+        stats.clear()
+    return {"status": "reset"}
+
+def start_in_thread(port: int):
+    """Serve on 127.0.0.1:port from a daemon thread; returns the uvicorn server once it is up"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="stub-openai", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+    uvicorn.run(app, host="127.0.0.1", port=args.port)